@@ -142,25 +142,34 @@ def main ():
 			'protocol': (value.redirector,string.quote,'url',                        'what protocol to use (url -> squid like / icap:://<uri> -> icap like)')
 		},
 		'http' : {
-			'idle-connect'    : (value.integer,string.nop,'300',     'time before we abandon new inactive http client connections (0: unlimited)'),
+			'idle-connect'    : (value.unlimited,string.nop,'300',     'time before we abandon new inactive http client connections (0: unlimited)'),
+			'connect-timeout' : (value.unlimited,string.nop,'30',      'time before we give up connecting to an address of a web server, and try the next (0: unlimited)'),
 			'connections'     : (value.integer,string.nop,'32768',   'the maximum number of proxy connections'),
+			'pool'            : (value.unlimited,string.nop,'8',       'idle connections to each web server kept for the next requests (0: disabled)'),
+			'pool-timeout'    : (value.unlimited,string.nop,'15',      'time before we close an idle connection to a web server (0: unlimited)'),
+			'race-delay'      : (value.unlimited,string.nop,'250',     'milliseconds before also connecting to the next address of a web server (0: disabled)'),
 			'transparent'     : (value.boolean,string.lower,'false', 'do not reveal the presence of the proxy'),
 			'forward'         : (value.lowunquote,string.quote,'',   'read client address from this header (normally x-forwarded-for)'),
 			'allow-connect'   : (value.boolean,string.lower,'true',  'allow client to use CONNECT and https connections'),
 			'expect'          : (value.boolean,string.lower,'false', 'block messages with EXPECT headers with a 417'),
 			'extensions'      : (value.methods,string.list,'',       'allow new HTTP method (space separated)'),
 			'proxied'         : (value.boolean,string.lower,'false', 'request is encapsulated with haproxy proxy protocol'),
-			'header-size'     : (value.integer,string.nop,'65536',   'maximum size in bytes for HTTP headers (0 : unlimited)'),
+			'header-size'     : (value.unlimited,string.nop,'65536',   'maximum size in bytes for HTTP headers (0 : unlimited)'),
+			'splice'          : (value.unlimited,string.nop,'1024',    'maximum CONNECT tunnels relayed by the kernel, each uses two pipes (0: disabled, linux only)'),
+			'upload-high'     : (value.unlimited,string.nop,'65536',   'bytes waiting to be sent to a web server before we stop reading from its client (0: any)'),
+			'upload-low'      : (value.integer,string.nop,'16384',   'bytes waiting to be sent to a web server below which we read from its client again'),
+			'download-high'   : (value.unlimited,string.nop,'65536',   'bytes waiting to be sent to a client before we stop reading from its web server (0: any)'),
+			'download-low'    : (value.integer,string.nop,'16384',   'bytes waiting to be sent to a client below which we read from its web server again'),
 		},
 		'icap' : {
 			'enable'          : (value.boolean,string.lower,'true',             'enable the icap server'),
 			'host'            : (value.unquote,string.quote,'127.0.0.1',        'the address the icap server listens on'),
 			'ipv6'            : (value.unquote,string.quote,'::',               'the ipv6 address the icap server listens on'),
 			'port'            : (value.integer,string.nop,'1344',               'port the icap server listens on'),
-			'idle-connect'    : (value.integer,string.nop,'300',     'time before we abandon new inactive icap client connections (0: unlimited)'),
+			'idle-connect'    : (value.unlimited,string.nop,'300',     'time before we abandon new inactive icap client connections (0: unlimited)'),
 			'connections'     : (value.integer,string.nop,'32768',   'the maximum number of icap connections'),
 			'proxied'         : (value.boolean,string.lower,'false', 'request is encapsulated with haproxy proxy protocol'),
-			'header-size'     : (value.integer,string.nop,'65536',   'maximum size in bytes for ICAP headers (0 : unlimited)'),
+			'header-size'     : (value.unlimited,string.nop,'65536',   'maximum size in bytes for ICAP headers (0 : unlimited)'),
 		},
 		'web' : {
 			'enable'      : (value.boolean,string.lower,'true',             'enable the built-in webserver'),
@@ -175,7 +184,11 @@ def main ():
 			'pidfile'     : (value.unquote,string.quote,'',      'where to save the pid if we manage it'),
 			'user'        : (value.user,string.quote,'nobody',   'user to run as'),
 			'daemonize'   : (value.boolean,string.lower,'false', 'should we run in the background'),
-			'reactor'     : (value.unquote,string.quote,'epoll', 'what event mechanism to use (select/epoll)'),
+			'event-budget' : (value.budgets,string.budgets,'read_client:256 write_client:256 read_download:256 write_download:256', 'maximum sockets (or decisions) handled per loop for each event (<event>:<count>, others are unlimited)'),
+			'accept-budget' : (value.unlimited,string.nop,'64',  'maximum connections accepted from one listening socket per loop (0: until none are waiting)'),
+			'reactor'     : (value.unquote,string.quote,'epoll', 'what event mechanism to use (select/epoll/epoll-et)'),
+			'read-budget' : (value.integer,string.nop,'262144', 'with epoll-et, maximum bytes read from one connection per loop before servicing others'),
+			'workers'     : (value.integer,string.nop,'1',       'number of reactor processes sharing the proxy ports (SO_REUSEPORT)'),
 			'speed'       : (value.integer,string.nop,'2',       'when waiting for connection how long are we sleeping for'),
 			'poll-interfaces' : (value.boolean,string.lower,'true',  'periodically poll for local addresses the proxy should not connect to'),
 		},
@@ -276,8 +289,8 @@ def main ():
 	from exaproxy.supervisor import Supervisor
 
 	if not configuration.profile.enable:
-		Supervisor(configuration).run()
-		__exit(configuration.debug.memory,0)
+		code = Supervisor(configuration).run()
+		__exit(configuration.debug.memory,code)
 
 	try:
 		import cProfile as profile
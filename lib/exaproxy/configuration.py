@@ -83,6 +83,13 @@ class value (object):
 			raise TypeError('the value must be positive')
 		return value
 
+	@staticmethod
+	def unlimited (_):
+		value = int(_)
+		if value < 0:
+			raise TypeError('the value must be positive or zero')
+		return value
+
 	@staticmethod
 	def lowunquote (_):
 		return _.strip().strip('\'"').lower()
@@ -164,6 +171,17 @@ class value (object):
 		except ValueError:
 			raise TypeError('resolv.conf can not be found (are you using DHCP without any network setup ?)')
 
+	@staticmethod
+	def budgets (all):
+		try:
+			budgets = {}
+			for budget in value.unquote(all).split():
+				name,count = budget.split(':')
+				budgets[name] = int(count)
+			return budgets
+		except ValueError:
+			raise TypeError('invalid budget, the format is <event>:<count>')
+
 	@staticmethod
 	def redirector (name):
 		if name == 'url' or name.startswith('icap://'):
@@ -213,6 +231,11 @@ class string (object):
 		l = ' '.join(('%s:%d' % (host,port) for host,port in _))
 		return "'%s'" % l
 
+	@staticmethod
+	def budgets (_):
+		l = ' '.join(('%s:%d' % (name,count) for name,count in sorted(_.items())))
+		return "'%s'" % l
+
 import ConfigParser
 
 class Store (dict):
@@ -122,11 +122,16 @@ class DNSResponseType(DNSBaseType):
 
 		return info
 
-	def extract(self, hostname, rdtype, info, seen=[]):
+	def extract(self, hostname, rdtype, info, seen=[], every=False):
 		data = info.get(hostname)
 
 		if data:
-			if rdtype in data:
+			if rdtype in data and every and rdtype in ('A', 'AAAA'):
+				# all the addresses, in random order so servers behind round-robin DNS still share the load
+				addresses = list(set(data[rdtype]))
+				random.shuffle(addresses)
+				value = ' '.join(addresses)
+			elif rdtype in data:
 				value = random.choice(data[rdtype])
 			else:
 				value = None
@@ -135,7 +140,7 @@ class DNSResponseType(DNSBaseType):
 
 		return value
 
-	def getValue(self, question=None, qtype=None):
+	def getValue(self, question=None, qtype=None, every=False):
 		if question is None or qtype is None:
 			if self.queries:
 				query = self.queries[0]
@@ -147,9 +152,9 @@ class DNSResponseType(DNSBaseType):
 					qtype = query.querytype
 
 		info = self.getResponse()
-		return qtype, self.extract(question, qtype, info)
+		return qtype, self.extract(question, qtype, info, every=every)
 
-	def getChainedValue(self):
+	def getChainedValue(self, every=False):
 		cname = None
 
 		if self.queries:
@@ -160,7 +165,7 @@ class DNSResponseType(DNSBaseType):
 				cname = question
 				qtype, question = self.getValue(question, qtype)
 
-		return self.getValue(cname)
+		return self.getValue(cname, every=every)
 
 	def getRelated (self):
 		for response in self.responses:
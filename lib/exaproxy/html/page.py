@@ -22,6 +22,7 @@ from .licence import licence
 from .humans import humans
 
 from exaproxy.util.log.history import History,Errors
+from exaproxy.util.histogram import Histogram
 from exaproxy.util.log.logger import Logger
 
 options = (
@@ -34,9 +35,13 @@ options = (
 		('Requests', '/graph/requests.html', False),
 		('Loops', '/graph/loops.html', False),
 		('Events', '/graph/events.html', False),
+		('Timing', '/graph/timing.html', False),
+		('Lag', '/graph/lag.html', False),
 		('Processes', '/graph/processes.html', False),
 		('Queue', '/graph/queue.html', False),
 		('Connections', '/graph/connections.html', False),
+		('Accepts', '/graph/accepts.html', False),
+		('Buffers', '/graph/buffers.html', False),
 		('Transfered', '/graph/transfered.html', False),
 		('Clients', '/graph/clients.html', False),
 		('Servers', '/graph/servers.html', False),
@@ -44,6 +49,7 @@ options = (
 	('End Points', '/end-point.html', (
 		('Clients', '/end-point/clients.html', False),
 		('Servers', '/end-point/servers.html', False),
+		('Buffers', '/end-point/buffers.html', False),
 	)),
 	('Control', '/control.html', (
 		('Workers', '/control/workers.html', False),
@@ -98,6 +104,9 @@ _listing = """\
 def Bpstobps (bytes):
 	return bytes * 8
 
+def stoms (seconds):
+	return seconds * 1000
+
 class Page (object):
 
 	def __init__(self,supervisor):
@@ -139,9 +148,36 @@ class Page (object):
 				'clients.speaking',
 				'servers.opening',
 				'servers.established',
+				'servers.idle',
 				]
 		)
 
+	def _accepts (self):
+		return graph(
+			self.monitor,
+			'Accepted connections',
+			20000,
+			[
+				'accept.connections',
+				'accept.wakeups',
+				'accept.exhausted',
+				'system.ListenOverflows',
+			],
+			True,
+		)
+
+	def _buffers (self):
+		return graph(
+			self.monitor,
+			'Bytes/seconds the write queues did not have to copy',
+			20000,
+			[
+				'buffer.client.saved',
+				'buffer.download.saved',
+			],
+			True,
+		)
+
 	def _processes (self):
 		return graph(
 			self.monitor,
@@ -161,6 +197,12 @@ class Page (object):
 			20000,
 			[
 				'clients.requests',
+				'clients.reused',
+				'clients.pipelined',
+				'servers.pool.hit',
+				'servers.pool.miss',
+				'servers.race.won4',
+				'servers.race.won6',
 			],
 			True,
 		)
@@ -226,6 +268,25 @@ class Page (object):
 			True,
 		)
 
+	def _timing (self):
+		return graph(
+			self.monitor,
+			'Milliseconds spent in each part of the reactor loop',
+			20000,
+			['timing.%s.time' % phase for phase in self.supervisor.reactor.phases],
+			True,
+			adaptor=stoms,
+		)
+
+	def _lag (self):
+		return graph(
+			self.monitor,
+			'Reactor loops per duration (from poll return to end of loop)',
+			20000,
+			['timing.lag.%s' % bucket for bucket in Histogram.names],
+			True,
+		)
+
 	def _queue (self):
 		return graph(
 			self.monitor,
@@ -270,6 +331,20 @@ class Page (object):
 	def _clients_source (self):
 		return self._source(self.supervisor.client.bysock)
 
+	def _buffered (self):
+		clients = self.supervisor.client.buffered()
+		servers = self.supervisor.content.buffered()
+
+		ordered = sorted(set(clients) | set(servers), key=lambda name: clients.get(name, 0) + servers.get(name, 0), reverse=True)
+
+		result = []
+		result.append('<div style="padding: 10px 10px 10px 10px; font-weight:bold;">ExaProxy Statistics</div><br/>')
+		result.append('<center>%d connection(s) with data waiting to be sent</center><br/>' % len(ordered))
+		for name in ordered:
+			result.append('<span class="key">client %s</span><span class="value">&nbsp; %d bytes to the client, %d bytes to the server</span><br/>' % (name, clients.get(name, 0), servers.get(name, 0)))
+
+		return _listing % '\n'.join(result)
+
 
 	def _workers (self):
 		form = '<form action="/control/workers/commit" method="get">%s: <input type="text" name="%s" value="%s"><input type="submit" value="Submit"></form>'
@@ -365,6 +440,10 @@ class Page (object):
 				return menu(self._processes())
 			if subsection == 'connections':
 				return menu(self._connections())
+			if subsection == 'accepts':
+				return menu(self._accepts())
+			if subsection == 'buffers':
+				return menu(self._buffers())
 			if subsection == 'servers':
 				return menu(self._servers())
 			if subsection == 'clients':
@@ -377,6 +456,10 @@ class Page (object):
 				return menu(self._loops())
 			if subsection == 'events':
 				return menu(self._events())
+			if subsection == 'timing':
+				return menu(self._timing())
+			if subsection == 'lag':
+				return menu(self._lag())
 			if subsection == 'queue':
 				return menu(self._queue())
 			return menu(index)
@@ -386,6 +469,8 @@ class Page (object):
 				return menu(self._servers_source())
 			if subsection == 'clients':
 				return menu(self._clients_source())
+			if subsection == 'buffers':
+				return menu(self._buffered())
 			return menu(index)
 
 		if section == 'control':
@@ -0,0 +1,261 @@
+# encoding: utf-8
+"""
+framing.py
+
+Created by agent on 2026-10-17.
+Copyright (c) 2011-2013  Exa Networks. All rights reserved.
+"""
+
+# http://tools.ietf.org/html/rfc7230#section-3.3.3
+
+MAX_HEADER = 64*1024   # past this, we stop looking for where the response ends
+MAX_LINE = 4*1024      # the longest chunk size or trailer line we accept
+MAX_CHUNK = 0xFFFFFFFF # the largest chunk we accept, past this we stop looking for where the response ends
+HEX = '0123456789abcdefABCDEF'
+
+IDLE = 0        # the response is complete, or none was asked for
+HEADER = 1      # reading the status line and the headers
+BODY = 2        # reading a body of known length
+CHUNK_SIZE = 3  # reading the size line of a chunk
+CHUNK_DATA = 4  # reading the data of a chunk
+CHUNK_END = 5   # reading the end of line after the data of a chunk
+TRAILER = 6     # reading the trailer after the last chunk
+CLOSE = 7       # reading a body which ends when the server closes the connection
+LOST = 8        # we can not tell where the responses end (switched protocol, invalid response)
+
+
+def _blank (data, start, end):
+	"""where the empty line after the headers starts and where it ends, -1 if it is not in data[start:end]"""
+	# the lines end with \r\n, or with \n alone
+	crlf = data.find('\n\r\n', start, end)
+	lf = data.find('\n\n', start, crlf + 2 if crlf >= 0 else end)
+
+	if lf >= 0:
+		return lf, lf + 2
+	if crlf >= 0:
+		return crlf, crlf + 3
+	return -1, -1
+
+
+class Framing (object):
+	"""Where the responses sent on a connection start and end
+
+	Only the status line, the headers, the chunk sizes and the trailers are
+	looked at (and copied when split between reads), the body is skipped
+	by counting, so following a response costs next to nothing whatever its
+	size. The data itself is never changed, it is passed on as read."""
+
+	def __init__ (self, sizes=None):
+		self.sizes = sizes     # Histogram of the size of the complete responses, if we keep one
+		self.state = IDLE
+
+		# True: a response is coming and we know where it ends, False: it is complete, None: we can not tell
+		self.answering = False
+		self.keepalive = True  # the server did not say it will close the connection
+		self.head = False      # the response has no body whatever its headers say
+		self.buffer = ''       # the start of a header or line split between reads
+		self.remaining = 0     # bytes of the body (or of the chunk) still to come
+		self.size = 0          # bytes received of this response
+		self.unexpected = 0    # bytes received when no response was expected
+
+	def lost (self):
+		"""stop following the responses, for tunnels or when we make no sense of them"""
+		self.state = LOST
+		self.answering = None
+		self.buffer = ''
+
+	def expect (self, head):
+		"""a request was sent, its response (without body if head) is the next data"""
+		if self.state == LOST:
+			return
+
+		self.state = HEADER
+		self.answering = True
+		self.head = head
+		self.buffer = ''
+		self.remaining = 0
+		self.size = 0
+
+	def _complete (self, extra):
+		"""the response ended extra bytes before the end of what we were given"""
+		self.state = IDLE
+		self.answering = False
+		self.size -= extra
+		if self.sizes is not None:
+			self.sizes.add(self.size)
+
+	def _header (self, header):
+		"""the next state, from the status line and headers of the response"""
+		if not header.startswith('HTTP/'):
+			return LOST
+
+		code = header[9:12]
+
+		# an interim response (100 continue), the final one follows
+		if code[:1] == '1':
+			return LOST if code == '101' else HEADER
+
+		# HTTP/1.0 servers close the connection unless told otherwise
+		self.keepalive = header[5:8] != '1.0'
+		empty = self.head or code in ('204', '304')
+		length = None
+		chunked = False
+		encoded = False
+
+		for line in header.split('\n')[1:]:
+			name, _, value = line.partition(':')
+			name = name.strip().lower()
+
+			if name == 'content-length':
+				value = value.strip()
+				if not value.isdigit() or (length is not None and length != int(value)):
+					return LOST
+				length = int(value)
+
+			elif name == 'transfer-encoding':
+				encoded = True
+				# only a chunked final encoding tells where the body ends
+				chunked = value.rsplit(',', 1)[-1].strip().lower() == 'chunked'
+
+			elif name == 'connection':
+				value = value.lower()
+				if 'close' in value:
+					self.keepalive = False
+				elif 'keep-alive' in value:
+					self.keepalive = True
+
+		if empty:
+			return IDLE
+
+		if encoded:
+			return CHUNK_SIZE if chunked else CLOSE
+
+		if length is None:
+			return CLOSE
+
+		self.remaining = length
+		return BODY if length else IDLE
+
+	def feed (self, data):
+		"""follow the data read from the server"""
+		start = 0
+		end = len(data)
+
+		if self.state == IDLE:
+			# the server sent something we did not ask for, do not trust the connection
+			self.unexpected += end
+			self.keepalive = False
+			return
+
+		self.size += end
+
+		while start < end:
+			state = self.state
+
+			if state == BODY or state == CHUNK_DATA:
+				available = end - start
+				if available < self.remaining:
+					self.remaining -= available
+					return
+
+				start += self.remaining
+				self.remaining = 0
+
+				if state == BODY:
+					self._complete(end - start)
+				elif data[start:start+2] == '\r\n':
+					start += 2
+					self.state = CHUNK_SIZE
+				else:
+					self.state = CHUNK_END
+
+			elif state == CLOSE:
+				return
+
+			elif state == HEADER:
+				if self.buffer:
+					# the end of the header may be split between the two reads
+					joined = self.buffer + data[start:start+2]
+					position, after = _blank(joined, max(0, len(self.buffer) - 2), len(joined))
+
+					if position >= 0:
+						header = joined[:position]
+						after = start + after - len(self.buffer)
+					else:
+						position, after = _blank(data, start, end)
+						header = self.buffer + data[start:position]
+				else:
+					position, after = _blank(data, start, end)
+					header = data[start:position]
+
+				if position < 0:
+					self.buffer += data[start:]
+					if len(self.buffer) > MAX_HEADER:
+						self.lost()
+					return
+
+				start = after
+				self.buffer = ''
+				self.state = self._header(header)
+				if self.state == IDLE:
+					self._complete(end - start)
+				elif self.state == LOST:
+					self.lost()
+					return
+
+			elif state == CHUNK_SIZE or state == TRAILER or state == CHUNK_END:
+				position = data.find('\n', start)
+
+				if position < 0:
+					self.buffer += data[start:]
+					if len(self.buffer) > MAX_LINE:
+						self.lost()
+					return
+
+				line = self.buffer + data[start:position] if self.buffer else data[start:position]
+				self.buffer = ''
+				start = position + 1
+
+				if state == CHUNK_END:
+					if line.strip():
+						self.lost()
+						return
+					self.state = CHUNK_SIZE
+
+				elif state == CHUNK_SIZE:
+					try:
+						# int() ignores the whitespace and the \r around the number
+						size = int(line.partition(';')[0], 16)
+					except ValueError:
+						self.lost()
+						return
+
+					# but it also takes leading white space, a sign or a 0x prefix: only hex digits are a size
+					if line[0] not in HEX or line[0] == '0' and line[1:2] in ('x', 'X') or size > MAX_CHUNK:
+						self.lost()
+						return
+
+					if size:
+						self.remaining = size
+						self.state = CHUNK_DATA
+					else:
+						self.state = TRAILER
+
+				# the empty line ending the trailer
+				elif not line.strip():
+					self._complete(end - start)
+
+			else:
+				# IDLE after a complete response, or LOST
+				if state == IDLE:
+					self.unexpected += end - start
+					self.keepalive = False
+				return
+
+	def closed (self):
+		"""the server closed the connection, returns False if a response was cut short"""
+		if self.state == CLOSE:
+			self._complete(0)
+			return True
+
+		return self.state in (IDLE, LOST)
@@ -18,12 +18,31 @@ class InvalidRequest (Exception):
 	pass
 
 class Headers (object):
+	well_known = ('host', 'transfer-encoding', 'te', 'content-length', 'connection', 'upgrade')
+
 	def __init__ (self,http_version,separator, expect=True):
 		self._order = []
 		self._data = {}
 		self.http_version = http_version
 		self.separator = separator
 		self.expect = expect
+		# the value of the first of the headers we use, filled while parsing
+		self.fields = dict.fromkeys(self.well_known,'')
+
+		# the headers as received, forwarded as they are but for the headers we edited
+		self._raw = None
+		self._start = 0     # where the headers start in _raw
+		self._end = 0       # where the empty line ending them starts
+		self._offsets = {}  # where each line of a header starts in _raw
+		self._edited = []   # the headers we changed, in the order we did
+		self._cut = []      # where the lines we do not forward start in _raw
+
+	def _edit (self, key):
+		# the lines of key we received are not forwarded, its current lines are added at the end
+		if key not in self._edited:
+			self._edited.append(key)
+			if key in self._offsets:
+				self._cut.extend(self._offsets[key])
 
 	def get (self,key,default):
 		return self._data.get(key,default)
@@ -33,9 +52,12 @@ class Headers (object):
 			self._order.append(key)
 
 		self._data[key] = [value]
+		self._edit(key)
 		return self
 
 	def replace (self,key,value):
+		if key in self._data:
+			self._edit(key)
 		self._data[key] = [value]
 
 	def default (self,key,value):
@@ -43,6 +65,7 @@ class Headers (object):
 			self._data[key] = [value]
 
 	def extend (self,key,value):
+		self._edit(key)
 		if key in self._order:
 			self._data[key].append(value)
 			return self
@@ -54,53 +77,98 @@ class Headers (object):
 		if key in self._data:
 			value = self._data.pop(key)
 			self._order.remove(key)
+			self._edit(key)
 			return value
 		else:
 			return default
 
+	# forget the headers as received, they are all serialised again
+	def rewrite (self):
+		self._raw = None
+
 	def count_quotes (self, line):
 		return line.count('"') - line.count('\\"')
 
-	def parse (self, transparent, lines):
+	# the value of the first key header, '' if there is none
+	def value (self, key):
+		lines = self._data.get(key,None)
+		return lines[0].split(':',1)[1].strip() if lines else ''
+
+	# the headers are read from offset up to the first empty line, in one pass,
+	# the values of the headers we use are recorded as they are found
+	def parse (self, transparent, data, offset=0):
 		# HTTP/1.0 can validly send no headers, and we must not error
-		if lines.strip() and lines[0].isspace():
+		if data[offset:offset+1].isspace() and data[offset:].strip():
 			raise InvalidRequest('malformed headers, headers starts with a white space')
 
-		key = ''
-		quoted = False
+		order = self._order
+		values = self._data
+		fields = self.fields
 
-		try:
-			for line in lines.split('\n'):
-				line = line.strip('\r')
+		offsets = self._offsets
 
-				if quoted:
-					self.extend(key, line)
-					if self.count_quotes(line) % 2:
-						quoted = False
-					continue
+		# only when a quote is present do we need to follow quoted values over several lines
+		quotes = data.find('"', offset) != -1
+		quoted = False
+		key = ''
+		position = offset
+		end = None
 
-				if not line: break
+		for line in data[offset:].split('\n'):
+			start = position
+			position += len(line) + 1
+			line = line.strip('\r')
 
+			if quoted:
+				values[key].append(line)
+				offsets[key].append(start)
 				if self.count_quotes(line) % 2:
-					quoted = True
+					quoted = False
+				continue
+
+			if not line:
+				end = start
+				break
+
+			if quotes and self.count_quotes(line) % 2:
+				quoted = True
+
+			if line[0].isspace():
+				if not key:
+					raise InvalidRequest('malformed headers, continuation line without header (line : %s)' % line)
+				values[key].append(line)
+				offsets[key].append(start)
+				continue
+
+			colon = line.find(':')
+			if colon <= 0:
+				if colon == -1:
+					raise InvalidRequest('malformed headers (line : %s) headers %s' % (line,data[offset:].replace('\t','\\t').replace('\r','\\r').replace('\n','\\n')))
+				raise InvalidRequest('malformed headers, line starts with colon (:)')
+
+			key = line[:colon].strip().lower()
 
-				if line[0].isspace():
-					# ValueError if key is not already there
-					# IndexError the list is empty
-					self.extend(key,line)
-					continue
+			if key in values:
+				values[key].append(line)
+				offsets[key].append(start)
+				continue
 
-				# KeyError if split does not return two elements
-				key, value = line.split(':', 1)
-				key = key.strip().lower()
-				self.extend(key,line)
+			order.append(key)
+			values[key] = [line]
+			offsets[key] = [start]
 
-		except (KeyError,TypeError,IndexError):
-			raise InvalidRequest('malformed headers (line : %s) headers %s' % (line,lines.replace('\t','\\t').replace('\r','\\r').replace('\n','\\n')))
+			if key in fields:
+				fields[key] = line[colon+1:].strip()
 
 		if quoted:
 			raise InvalidRequest('end of headers reached while in quoted content')
 
+		# without the empty line, what we forward is built from the lines
+		if end is not None:
+			self._raw = data
+			self._start = offset
+			self._end = end
+
 		if not transparent:
 			try:
 				# follow rules about not forwarding connection header as set in section s14.10
@@ -111,6 +179,7 @@ class Headers (object):
 						value = value.strip().lower()
 						if not (value == 'websocket' or value.startswith('tls/')):
 							upgrades.remove(upgrade)
+							self._edit('upgrade')
 							self.pop(value.lower())
 					# we modified the list in data directly
 					if not upgrades:
@@ -128,10 +197,15 @@ class Headers (object):
 							continue
 						# otherwise we remove the unknown upgrade
 						connections.remove(connection)
+						self._edit('connection')
 					# we modified the list in data directly
 					if not connections:
 						self.pop('connection')
 
+					# what is left of the headers we removed tokens from
+					fields['upgrade'] = self.value('upgrade')
+					fields['connection'] = self.value('connection')
+
 				# remove keep-alive header for http/1.0
 				if self.http_version == '1.0':
 					self.pop('keep-alive')
@@ -144,12 +218,36 @@ class Headers (object):
 			except (KeyError,TypeError,IndexError):
 				raise InvalidRequest('can not remove connection tokens from headers')
 
-
-		# we got a line starting with a :
-		if '' in self._data:
-			raise InvalidRequest('malformed headers, line starts with colon (:)')
-
 		return self
 
+	# the header lines, each followed by its end of line
 	def __str__ (self):
-		return self.separator.join([self.separator.join(self._data[key]) for key in self._order])
+		raw = self._raw
+		separator = self.separator
+
+		if raw is None:
+			return ''.join([line + separator for key in self._order for line in self._data[key]])
+
+		if not self._edited:
+			return raw[self._start:self._end]
+
+		if self._cut:
+			pieces = []
+			position = self._start
+
+			for start in sorted(self._cut):
+				pieces.append(raw[position:start])
+				position = raw.find('\n', start) + 1
+
+			pieces.append(raw[position:self._end])
+		else:
+			pieces = [raw[self._start:self._end]]
+
+		data = self._data
+		for key in self._edited:
+			if key in data:
+				for line in data[key]:
+					pieces.append(line)
+					pieces.append(separator)
+
+		return ''.join(pieces)
@@ -43,7 +43,8 @@ class HTTP (object):
 				self.separator = '\n'
 
 			self.request = Request(self.raw).parse()
-			self.headers = Headers(self.request.version,self.separator,self.expect).parse(transparent,self.request.remaining)
+			self.headers = Headers(self.request.version,self.separator,self.expect).parse(transparent,self.raw,self.request.offset)
+			fields = self.headers.fields
 
 			self.headerhost = self.extractHost()
 
@@ -73,24 +74,15 @@ class HTTP (object):
 				#	self.log.info('Invalid address in Client identifier header: %s' % client)
 
 			# encoding can contain trailers and other information see RFC2516 section 14.39
-			encoding = self.headers.get('transfer-encoding', [':'])[0].split(':', 1)[1].strip()
-			if not encoding:
-				encoding = self.headers.get('te', [':'])[0].split(':', 1)[1].strip()
+			encoding = fields['transfer-encoding'] or fields['te']
 
-			content_length = int(self.headers.get('content-length', [':0'])[0].split(':',1)[1].strip())
+			content_length = int(fields['content-length']) if self.headers.get('content-length',None) else 0
 			self.content_length = 'chunked' if 'chunked' in encoding else content_length
 
 			self.url = self.host + ((':%s' % self.port) if self.port != 80 else '') + self.request.path
 			self.url_noport = self.host + self.request.path
 
-			connection = self.headers.get('connection', [':'])[0].split(':',1)[1].strip()
-
-			if connection.lower() == 'upgrade':
-				upgrade = self.headers.get('upgrade', [':'])[0].split(':',1)[1].strip()
-			else:
-				upgrade = ''
-
-			self.upgrade = upgrade
+			self.upgrade = fields['upgrade'] if fields['connection'].lower() == 'upgrade' else ''
 
 		except KeyboardInterrupt:
 			raise
@@ -125,7 +117,7 @@ class HTTP (object):
 		self.path = path if path is not None else self.path
 
 		if path is not None:
-			self.request = Request(self.request.method + ' ' + path + ' HTTP/' + self.request.version).parse()
+			self.request = Request(self.request.method + ' ' + path + ' HTTP/' + self.request.version + '\n').parse()
 
 		if host is not None:
 			if host.count(':') > 1:
@@ -134,11 +126,14 @@ class HTTP (object):
 			if self.port != 80:
 				host = host + ':' + str(self.port)
 
-			self.header.replace('host','Host: ' + host)
+			self.headers.replace('host','Host: ' + host)
+
+		# the redirector rewrote the request, we do not forward what we received
+		self.headers.rewrite()
 
 
 	def extractHost(self):
-		hoststring = self.headers.get('host',[':'])[0].split(':',1)[1].strip()
+		hoststring = self.headers.fields['host']
 
 		if ':' in hoststring:
 			# check to see if we have an IPv6 address
@@ -153,7 +148,7 @@ class HTTP (object):
 
 	def __str__ (self):
 		if self.request.version in self.http_versions:
-			res = str(self.request) + self.separator + str(self.headers) + self.separator + self.separator
+			res = str(self.request) + self.separator + str(self.headers) + self.separator
 		else:
 			res = self.raw
 
@@ -8,23 +8,32 @@ Copyright (c) 2011-2013 Exa Networks. All rights reserved.
 
 class Request (object):
 	def __init__ (self,data):
-		request, remaining = data.split('\n',1)
+		# where the headers start in data, they are not copied
+		eol = data.find('\n')
+		if eol == -1:
+			raise ValueError('Malformed request')
+
+		request = data[:eol]
 		parts = request.split()
 		if len(parts) == 3:
 			self.raw = request.rstrip('\r')
 			method, self.uri, version = parts
 			self.use_raw = False
-			self.remaining = remaining
+			self.offset = eol + 1
 		elif len(parts) == 2:
-			http,rest = remaining.split('\n',1)
+			following = data.find('\n', eol + 1)
+			if following == -1:
+				raise ValueError('Malformed request')
+
+			http = data[eol+1:following]
 			if http.upper()[:5].startswith('HTTP/'):
 				version = http.strip().split('/',1)[-1]
 				self.raw = '%s\n%s' % (request,http)
-				self.remaining = rest
+				self.offset = following + 1
 			else:
 				version = '1.0'
 				self.raw = request
-				self.remaining = remaining
+				self.offset = eol + 1
 			method, self.uri = parts
 			self.use_raw = True
 		else:
@@ -60,31 +60,50 @@ _HTTP_NAMES = {
 }
 
 
-def file_header(code, size, name, protocol='1.1'):
-	date = time.strftime('%c %Z')
-	version = load().proxy.version
+_version = None  # our version, only known once the configuration is loaded
+_second = None   # when the prefixes were built
+_prefix = {}     # (code, protocol) : the first lines of our responses, valid for _second
+
+
+def _header(code, protocol):
+	"""the status line, Date and Server headers, built at most once a second"""
+	global _version, _second, _prefix
+
+	now = int(time.time())
+	if now != _second:
+		_second = now
+		_prefix = {}
+
+	prefix = _prefix.get((code, protocol), None)
+	if prefix is None:
+		if _version is None:
+			_version = str(load().proxy.version)
 
-	return '\r\n'.join([
-		'HTTP/%s %s %s' % (protocol, str(code), _HTTP_NAMES.get(code,'-')),
-		'Date: %s' % date,
-		'Server: exaproxy/%s (%s)' % (str(version), str(sys.platform)),
+		prefix = '\r\n'.join([
+			'HTTP/%s %s %s' % (protocol, code, _HTTP_NAMES.get(code,'-')),
+			'Date: %s' % time.strftime('%c %Z', time.localtime(now)),
+			'Server: exaproxy/%s (%s)' % (_version, str(sys.platform)),
+			''
+		])
+		_prefix[(code, protocol)] = prefix
+
+	return prefix
+
+def file_header(code, size, name, protocol='1.1'):
+	return _header(str(code), protocol) + '\r\n'.join([
 		'Content-Length: %d' % size,
 		'Connection: close',
 		'Content-Type: text/html',
 		'Cache-Control: no-store',
 		'Pragma: no-cache',
+		'',
 		''
 	])
 
 def http (code,message, protocol='1.1'):
 	encoding = 'html' if message[:5].lower().startswith('<html') else 'plain'
-	date = time.strftime('%c %Z')
-	version = load().proxy.version
 
-	return '\r\n'.join([
-		'HTTP/%s %s %s' % (protocol, str(code), _HTTP_NAMES.get(code,'-')),
-		'Date: %s' % date,
-		'Server: exaproxy/%s (%s)' % (str(version), str(sys.platform)),
+	return _header(str(code), protocol) + '\r\n'.join([
 		'Content-Length: %d' % len(message),
 		'Content-Type: text/%s' % encoding,
 		'Cache-Control: no-store',
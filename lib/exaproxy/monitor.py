@@ -8,6 +8,8 @@ Copyright (c) 2011-2013 Exa Networks. All rights reserved.
 
 from collections import deque
 
+from exaproxy.network.functions import netstat
+
 class _Container (object):
 	def __init__ (self,supervisor):
 		self.supervisor = supervisor
@@ -67,6 +69,9 @@ class Monitor (object):
 			'exaproxy.dns.ttl' : conf.dns.ttl,
 			'exaproxy.daemon.user' : conf.daemon.user,
 			'exaproxy.daemon.reactor' : conf.daemon.reactor,
+			'exaproxy.daemon.workers' : conf.daemon.workers,
+			'exaproxy.daemon.accept-budget' : conf.daemon.accept_budget,
+			'exaproxy.daemon.event-budget' : ' '.join('%s:%d' % _ for _ in sorted(conf.daemon.event_budget.items())),
 			'exaproxy.log.level.daemon' : conf.log.daemon,
 			'exaproxy.log.level.supervisor' : conf.log.supervisor,
 			'exaproxy.log.level.signal' : conf.log.signal,
@@ -94,9 +99,18 @@ class Monitor (object):
 			'exaproxy.tcp6.bind' : conf.tcp6.bind,
 			'exaproxy.http.connect' : conf.http.allow_connect,
 			'exaproxy.http.connections' : conf.http.connections,
+			'exaproxy.http.connect-timeout' : conf.http.connect_timeout,
+			'exaproxy.http.pool' : conf.http.pool,
+			'exaproxy.http.pool-timeout' : conf.http.pool_timeout,
+			'exaproxy.http.race-delay' : conf.http.race_delay,
 			'exaproxy.http.forward' : conf.http.forward,
 			'exaproxy.http.transparent' : conf.http.transparent,
 			'exaproxy.http.extensions' : ' '.join(str (_) for _ in conf.http.extensions),
+			'exaproxy.http.splice' : conf.http.splice,
+			'exaproxy.http.upload-high' : conf.http.upload_high,
+			'exaproxy.http.upload-low' : conf.http.upload_low,
+			'exaproxy.http.download-high' : conf.http.download_high,
+			'exaproxy.http.download-low' : conf.http.download_low,
 			'exaproxy.proxy.version' : conf.proxy.version,
 			'exaproxy.redirector.enable' : conf.redirector.enable,
 			'exaproxy.redirector.protocol' : conf.redirector.protocol,
@@ -117,18 +131,38 @@ class Monitor (object):
 		content = self._supervisor.content
 		client = self._supervisor.client
 		manager = self._supervisor.manager
+		relay = self._supervisor.relay
 		reactor = self._supervisor.reactor
+		servers = (self._supervisor.proxy, self._supervisor.icap, self._supervisor.web)
 
-		return {
+		client_buffered, client_saved = client.buffers()
+		content_buffered, content_saved = content.buffers()
+
+		statistics = reactor.statistics({
 			'pid.saved' : self._supervisor.pid._saved_pid,
 			'processes.forked' : len(manager.worker),
 			'processes.min' : manager.low,
 			'processes.max' : manager.high,
-			'clients.silent': len(client.norequest),
+			'clients.silent': client.silent,
 			'clients.speaking': len(client.byname),
 			'clients.requests': client.total_requested,
+			'clients.reused': client.total_reused,
+			'clients.pipelined': client.total_pipelined,
+			'clients.waiting': len(client.waiting),
 			'servers.opening': len(content.opening),
 			'servers.established': len(content.established),
+			'servers.idle': len(content.pool),
+			'servers.pool.hit': content.pool.hits,
+			'servers.pool.miss': content.pool.misses,
+			'servers.pool.dead': content.pool.dead,
+			'servers.pool.expired': content.pool.expired,
+			'servers.response.truncated': content.truncated,
+			'servers.race.attempts': content.attempts,
+			'servers.race.won4': content.won4,
+			'servers.race.won6': content.won6,
+			'servers.connect.failed': content.failed,
+			'servers.connect.failover': content.failover,
+			'servers.unreachable': len(content.failures),
 			'transfer.client4' : client.total_sent4,
 			'transfer.client6' : client.total_sent6,
 			'transfer.client' : client.total_sent4 + client.total_sent6,
@@ -137,8 +171,44 @@ class Monitor (object):
 			'transfer.content' : content.total_sent4 + content.total_sent6,
 			'load.loops' : reactor.nb_loops,
 			'load.events' : reactor.nb_events,
+			'timers.pending' : len(self._supervisor.wheel),
+			'timers.fired' : self._supervisor.wheel.fired,
 			'queue.size' : manager.queue.qsize(),
-		}
+			'accept.connections' : sum(server.accepted for server in servers),
+			'accept.wakeups' : sum(server.wakeups for server in servers),
+			'accept.exhausted' : sum(server.exhausted for server in servers),
+			'budget.bytes.client' : client.deferred,
+			'budget.bytes.download' : content.deferred,
+			'budget.bytes.relay' : relay.deferred,
+			'buffer.client.bytes' : client_buffered,
+			'buffer.client.saved' : client_saved,
+			'buffer.client.corked' : client.corked,
+			'buffer.client.uncorked' : client.uncorked,
+			'buffer.download.bytes' : content_buffered,
+			'buffer.download.saved' : content_saved,
+			'buffer.download.corked' : content.corked,
+			'buffer.download.uncorked' : content.uncorked,
+			'relay.tunnels' : len(relay.tunnels),
+			'relay.started' : relay.started,
+			'relay.refused' : relay.refused,
+			'relay.bytes' : relay.spliced,
+		})
+		content.sizes.statistics('servers.response', statistics)
+
+		# counters for the whole host, not for this process
+		for name, value in netstat(('ListenOverflows', 'ListenDrops')).iteritems():
+			statistics['system.%s' % name] = value
+
+		statistics = self._supervisor.processes.aggregate(statistics)
+
+		# a ratio can not be added up, it is worked out once the workers are counted
+		requests = statistics['clients.requests']
+		statistics['clients.reuse.percent'] = 100 * statistics['clients.reused'] / requests if requests else 0
+
+		races = statistics['servers.race.won4'] + statistics['servers.race.won6']
+		statistics['servers.race.ipv6.percent'] = 100 * statistics['servers.race.won6'] / races if races else 0
+
+		return statistics
 
 	def second (self):
 		self.seconds.append(self.statistics())
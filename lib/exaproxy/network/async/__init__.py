@@ -9,11 +9,11 @@ log = Logger('supervisor', configuration.log.supervisor)
 def Poller (configuration):
 	reactor = configuration.reactor
 	timeout = configuration.speed
-	if reactor not in ('epoll','select'):
+	if reactor not in ('epoll','epoll-et','select'):
 		log.warning('unknown reactor %s' % reactor)
-	if reactor == 'epoll' and hasattr(select, 'epoll'):
+	if reactor in ('epoll','epoll-et') and hasattr(select, 'epoll'):
 		from epoll import EPoller as Poller
-		return Poller(timeout)
+		return Poller(timeout, reactor == 'epoll-et')
 	else:
 		from selectpoll import SelectPoller as Poller
 		return Poller(timeout)
@@ -0,0 +1,310 @@
+# encoding: utf-8
+"""
+descriptors.py
+
+Created by agent on 2026-10-17.
+Copyright (c) 2011-2013  Exa Networks. All rights reserved.
+"""
+
+import socket
+
+from interface import IPoller
+
+# index of the values stored per file descriptor
+_SOCK, _READ, _WRITE, _RCORKED, _WCORKED, _MASK = range(6)
+
+
+class DescriptorPoller (IPoller):
+	"""The bookkeeping of the pollers watching every socket with a single system call.
+
+	Each file descriptor is registered once, and remembers which read and
+	which write event (category) it belongs to, so registering, removing or
+	corking a socket is a dictionary lookup and the result of the system
+	call can be dispatched without any further call. Corking only changes
+	the interest mask of the descriptor.
+
+	The subclasses give the object doing the system call (master), with the
+	register, modify, unregister and poll methods of select.epoll and
+	select.poll, the flags it uses and their own poll().
+
+	In edge triggered mode, a socket is only reported when new data arrives
+	(or space becomes available), the owner must therefore read or write it
+	until it would block, or ask for it to be reported again using rearm."""
+
+	IN = 0        # the descriptor has data to read
+	OUT = 0       # the descriptor has space to write
+	HANGUP = 0    # the descriptor is closed or in error, reported even when not asked for
+	INVALID = 0   # the descriptor is not open anymore and must be removed
+	EDGE = 0      # only report the descriptor when something new happens (edge triggered pollers)
+
+	level = ()    # the events which are level triggered even when the poller is edge triggered
+
+	def __init__(self, speed, master):
+		self.speed = speed
+		self.rearmed = []    # (name, position, sock) to report again without waiting
+
+		self.master = master
+		self.fds = {}        # fd : [sock, read name, write name, read corked, write corked, registered mask]
+		self.sockets = {}    # name : {sock : fd}
+		self.errors = {}     # sock : name, sockets we failed to register
+
+
+	def _register(self, name, sock, position):
+		sockets = self.sockets[name]
+		if sock in sockets:
+			return False
+
+		try:
+			fileno = sock.fileno()
+		except socket.error, e:
+			fileno = -1
+
+		if fileno < 0:
+			print "ERROR registering socket (%s): closed socket" % str(sock)
+			self._failed(name, sock)
+			return False
+
+		watched = self.fds.get(fileno)
+		if watched is not None and watched[_SOCK] is not sock:
+			# the descriptor was closed and reused without being removed from the poller
+			self._forget(fileno, watched)
+			watched = None
+
+		if watched is None:
+			watched = [sock, None, None, False, False, None]
+
+		previous = watched[position]
+		if previous is not None and previous != name:
+			# a socket can only be part of one read and one write event at a time
+			self.sockets[previous].pop(sock, None)
+
+		watched[position] = name
+		watched[position+2] = False
+
+		if not self._update(fileno, watched):
+			watched[position] = None
+			self._failed(name, sock)
+			return False
+
+		self.fds[fileno] = watched
+		sockets[sock] = fileno
+		return True
+
+	def _unregister(self, name, sock, position):
+		fileno = self.sockets[name].pop(sock, None)
+		self.errors.pop(sock, None)
+
+		if fileno is None:
+			return False
+
+		watched = self.fds.get(fileno)
+		if watched is None or watched[_SOCK] is not sock or watched[position] != name:
+			return False
+
+		watched[position] = None
+		watched[position+2] = False
+
+		if watched[_READ] is None and watched[_WRITE] is None:
+			self.fds.pop(fileno, None)
+
+		self._update(fileno, watched)
+		return True
+
+	def _cork(self, name, sock, position, corked):
+		fileno = self.sockets[name].get(sock)
+		if fileno is None:
+			return False
+
+		watched = self.fds[fileno]
+		if watched[position+2] is corked:
+			return False
+
+		watched[position+2] = corked
+		if not self._update(fileno, watched):
+			self._unregister(name, sock, position)
+			self._failed(name, sock)
+			return False
+
+		return True
+
+	def _update(self, fileno, watched):
+		mask = 0
+		if watched[_READ] is not None and not watched[_RCORKED]:
+			mask |= self.IN
+		if watched[_WRITE] is not None and not watched[_WCORKED]:
+			mask |= self.OUT
+		if self.edge and watched[_READ] not in self.level and watched[_WRITE] not in self.level:
+			mask |= self.EDGE
+
+		registered = watched[_MASK]
+		if watched[_READ] is None and watched[_WRITE] is None:
+			if registered is not None:
+				watched[_MASK] = None
+				try:
+					self.master.unregister(fileno)
+				except (IOError, OSError, ValueError, KeyError):
+					pass
+			return True
+
+		if mask == registered:
+			return True
+
+		try:
+			if registered is None:
+				self.master.register(fileno, mask)
+			else:
+				self.master.modify(fileno, mask)
+		except (IOError, OSError, ValueError), e:
+			print "ERROR registering socket (%s): %s" % (str(watched[_SOCK]), str(e))
+			return False
+
+		watched[_MASK] = mask
+		return True
+
+	def _forget(self, fileno, watched):
+		for position in (_READ, _WRITE):
+			name = watched[position]
+			if name is not None:
+				self.sockets[name].pop(watched[_SOCK], None)
+
+		self.fds.pop(fileno, None)
+		try:
+			self.master.unregister(fileno)
+		except (IOError, OSError, ValueError, KeyError):
+			pass
+
+	def _failed(self, name, sock):
+		if sock not in self.errors:
+			self.errors[sock] = name
+		else:
+			print "NOTE: trying to poll closed socket again (%s)" % name
+
+	def _clear(self, name, position):
+		for sock in self.sockets.get(name, {}).keys():
+			self._unregister(name, sock, position)
+		self.sockets[name] = {}
+
+
+	def addReadSocket(self, name, sock):
+		return self._register(name, sock, _READ)
+
+	def removeReadSocket(self, name, sock):
+		return self._unregister(name, sock, _READ)
+
+	def removeClosedReadSocket(self, name, sock):
+		pass
+
+	def corkReadSocket(self, name, sock):
+		return self._cork(name, sock, _READ, True)
+
+	def uncorkReadSocket(self, name, sock):
+		return self._cork(name, sock, _READ, False)
+
+	def rearmReadSocket(self, name, sock):
+		if self.edge:
+			self.rearmed.append((name, _READ, sock))
+
+	def setupRead(self, name):
+		if name not in self.sockets:
+			self.sockets[name] = {}
+
+	def clearRead(self, name):
+		self._clear(name, _READ)
+
+
+	def addWriteSocket(self, name, sock):
+		return self._register(name, sock, _WRITE)
+
+	def removeWriteSocket(self, name, sock):
+		return self._unregister(name, sock, _WRITE)
+
+	def removeClosedWriteSocket(self, name, sock):
+		pass
+
+	def corkWriteSocket(self, name, sock):
+		return self._cork(name, sock, _WRITE, True)
+
+	def uncorkWriteSocket(self, name, sock):
+		return self._cork(name, sock, _WRITE, False)
+
+	def rearmWriteSocket(self, name, sock):
+		if self.edge:
+			self.rearmed.append((name, _WRITE, sock))
+
+	def setupWrite(self, name):
+		if name not in self.sockets:
+			self.sockets[name] = {}
+
+	def clearWrite(self, name):
+		self._clear(name, _WRITE)
+
+
+	def _dispatch(self, res):
+		"""the sockets of each event, from the (fd, events) pairs returned by the system call"""
+		IN = self.IN
+		OUT = self.OUT
+		HANGUP = self.HANGUP
+		INVALID = self.INVALID
+
+		response = {}
+		fds = self.fds
+
+		for fd, events in res:
+			watched = fds.get(fd)
+			if watched is None:
+				continue
+
+			sock, read, write, rcorked, wcorked, mask = watched
+
+			if events & HANGUP:
+				if events & INVALID:
+					# the descriptor would be reported on every call
+					self._forget(fd, watched)
+
+				# reported even for corked sockets, make sure the owner notices the socket is gone
+				if mask & IN or not mask & (IN|OUT):
+					events |= IN
+				if mask & OUT or not mask & (IN|OUT):
+					events |= OUT
+
+			if events & IN and read is not None:
+				if read in response:
+					response[read].append(sock)
+				else:
+					response[read] = [sock]
+
+			if events & OUT and write is not None and (mask & OUT or read is None):
+				if write in response:
+					response[write].append(sock)
+				else:
+					response[write] = [sock]
+
+		if self.rearmed:
+			self._rearmed(response)
+
+		for sock, name in self.errors.iteritems():
+			response.setdefault(name, []).append(sock)
+
+		return response
+
+	def _rearmed(self, response):
+		rearmed, self.rearmed = self.rearmed, []
+		reported = {}
+
+		for name, position, sock in rearmed:
+			fileno = self.sockets[name].get(sock)
+			if fileno is None:
+				continue
+
+			# the socket may have been corked since it was rearmed
+			if self.fds[fileno][position+2]:
+				continue
+
+			if name not in reported:
+				reported[name] = set(response.get(name, ()))
+
+			if sock in reported[name]:
+				continue
+
+			reported[name].add(sock)
+			response.setdefault(name, []).append(sock)
@@ -10,248 +10,41 @@ Copyright (c) 2011-2013  Exa Networks. All rights reserved.
 
 import select
 import errno
-import socket
 
-from interface import IPoller
+from descriptors import DescriptorPoller
 
-from select import EPOLLIN, EPOLLOUT, EPOLLHUP
+from select import EPOLLIN, EPOLLOUT, EPOLLHUP, EPOLLERR, EPOLLET
 
 
-class EPoller (IPoller):
-	epoll = staticmethod(select.epoll)
-
-	def __init__(self, speed):
-		self.speed = speed
-
-		self.sockets = {}
-		self.pollers = {}
-		self.master = self.epoll()
-		self.errors = {}
-
-
-	def addReadSocket(self, name, sock):
-		sockets, poller, fdtosock, corked = self.sockets[name]
-		if sock not in sockets:
-			sockets[sock] = True
-			try:
-				fileno = sock.fileno()
-				poller.register(sock, EPOLLIN | EPOLLHUP)
-				res = True
-			except socket.error, e:
-				sockets.pop(sock)
-				res = False
-				print "ERROR registering socket (%s): %s" % (str(sock), str(e))
-
-				if sock not in self.errors:
-					self.errors[sock] = name
-				else:
-					print "NOTE: trying to poll closed socket again (addReadSocket)"
-
-			else:
-				fdtosock[fileno] = sock
-		else:
-			res = False
-
-		return res
-
-	def removeReadSocket(self, name, sock):
-		sockets, poller, fdtosock, corked = self.sockets[name]
-		if sock in sockets:
-			try:
-				fdtosock.pop(sock.fileno(), None)
-			except socket.error:
-				pass
-
-			sockets.pop(sock)
-			if sock not in corked:
-				poller.unregister(sock)
-			else:
-				corked.pop(sock)
-
-		if sock in self.errors:
-			self.errors.pop(sock)
-
-	def removeClosedReadSocket(self, name, sock):
-		pass
-
-	def corkReadSocket(self, name, sock):
-		sockets, poller, fdtosock, corked = self.sockets[name]
-		if sock in sockets and sock not in corked:
-			corked[sock] = True
-			poller.unregister(sock)
-			res = True
-		else:
-			res = False
-
-		return res
-
-	def uncorkReadSocket(self, name, sock):
-		sockets, poller, fdtosock, corked = self.sockets[name]
-		if sock in sockets:
-			if corked.pop(sock, None):
-				try:
-					poller.register(sock, EPOLLIN | EPOLLHUP)
-					res = True
-				except socket.error, e:
-					sockets.pop(sock)
-					res = False
-					print "ERROR reregistering socket (%s): %s" % (str(sock), str(e))
-
-					if sock not in self.errors:
-						self.errors[sock] = name
-					else:
-						print "NOTE: trying to poll closed socket again (uncorkReadSocket)"
-			else:
-				res = False
-		else:
-			res = False
-
-		return res
-
-	def setupRead(self, name):
-		if name not in self.sockets:
-			poller = self.epoll()
-			sockets = {}
-			fdtosock = {}
-			corked = {}
-			self.pollers[poller.fileno()] = name, poller, sockets, fdtosock
-
-			self.sockets[name] = sockets, poller, fdtosock, corked
-			self.master.register(poller, EPOLLIN)
-
-	def clearRead(self, name):
-		sockets, poller, fdtosock, corked = self.sockets.pop(name, ({}, None, None, None))
-		if sockets:
-			self.master.unregister(poller)
-			self.pollers.pop(poller.fileno(), None)
-			poller.close()
-			self.setupRead(name)
+class EPoller (DescriptorPoller):
+	"""A single epoll instance watching every socket, level or edge triggered.
 
+	Listening sockets and worker pipes are always level triggered as they
+	are only serviced one connection or one decision at a time."""
 
-	def addWriteSocket(self, name, sock):
-		sockets, poller, fdtosock, corked = self.sockets[name]
-		if sock not in sockets:
-			sockets[sock] = True
-			try:
-				fileno = sock.fileno()
-				poller.register(sock, EPOLLOUT | EPOLLHUP)
-				res = True
-			except socket.error, e:
-				sockets.pop(sock)
-				res = False
-				print "ERROR registering socket (%s): %s" % (str(sock), str(e))
-
-				if sock not in self.errors:
-					self.errors[sock] = name
-				else:
-					print "NOTE: trying to poll closed socket again (addWriteSocket)"
-			else:
-				fdtosock[fileno] = sock
-		else:
-			res = False
-
-		return res
-
-	def removeWriteSocket(self, name, sock):
-		sockets, poller, fdtosock, corked = self.sockets[name]
-		if sock in sockets:
-			try:
-				fdtosock.pop(sock.fileno(), None)
-			except socket.error:
-				pass
-
-			sockets.pop(sock)
-			if sock not in corked:
-				poller.unregister(sock)
-			else:
-				corked.pop(sock)
-
-		if sock in self.errors:
-			self.errors.pop(sock, None)
-
-	def removeClosedWriteSocket(self, name, sock):
-		pass
-
-	def corkWriteSocket(self, name, sock):
-		sockets, poller, fdtosock, corked = self.sockets[name]
-		if sock in sockets and sock not in corked:
-			poller.unregister(sock)
-			corked[sock] = True
-			res = True
-		else:
-			res = False
-
-		return res
-
-	def uncorkWriteSocket(self, name, sock):
-		sockets, poller, fdtosock, corked = self.sockets[name]
-		if sock in sockets:
-			if corked.pop(sock, None):
-				try:
-					poller.register(sock, EPOLLOUT | EPOLLHUP)
-					res = True
-				except socket.error, e:
-					sockets.pop(sock)
-					res = False
-					print "ERROR reregistering socket (%s): %s" % (str(sock), str(e))
-
-					if sock not in self.errors:
-						self.errors[sock] = name
-					else:
-						print "NOTE: trying to poll closed socket again (uncorkWriteSocket)"
-			else:
-				res = False
-		else:
-			res = False
-
-		return res
-
-	def setupWrite(self, name):
-		if name not in self.sockets:
-			poller = self.epoll()
-			sockets = {}
-			fdtosock = {}
-			corked = {}
-			self.pollers[poller.fileno()] = name, poller, sockets, fdtosock
-
-			self.sockets[name] = sockets, poller, fdtosock, corked
-			self.master.register(poller, EPOLLIN)
+	epoll = staticmethod(select.epoll)
+	level = set(('read_proxy', 'read_web', 'read_icap', 'read_workers'))
 
-	def clearWrite(self, name):
-		sockets, poller, fdtosock, corked = self.sockets.pop(name, ({}, None, None, None))
-		if sockets:
-			self.master.unregister(poller)
-			self.pollers.pop(poller.fileno(), None)
-			poller.close()
-			self.setupWrite(name)
+	IN = EPOLLIN
+	OUT = EPOLLOUT
+	HANGUP = EPOLLHUP|EPOLLERR
+	EDGE = EPOLLET
 
+	def __init__(self, speed, edge=False):
+		DescriptorPoller.__init__(self, speed, self.epoll())
+		self.edge = edge
 
-	def poll(self):
+	def poll(self, timeout=None):
 		try:
-			res = self.master.poll(self.speed)
+			# some sockets still have data waiting, do not sleep
+			if self.rearmed:
+				timeout = 0
+			elif timeout is None:
+				timeout = self.speed
+			res = self.master.poll(timeout)
 		except IOError, e:
 			if e.errno != errno.EINTR:
 				raise
-
 			res = []
-			response = {}
-		else:
-			response = dict((name, []) for (name, poller, sockets, fdtosock) in self.pollers.values())
-
-		for fd, events in res:
-			name, poller, sockets, fdtosock = self.pollers[fd]
-			events = poller.poll(0)
-
-			response[name] = [fdtosock[sock_fd] for (sock_fd, sock_events) in events]
-
-		for fd, name in self.errors.itervalues():
-			response.setdefault(name, []).append(fd)
-
-#			for sock_fd, sock_events in events:
-#				if sock_events & select.EPOLLHUP:
-#					print "REMOVING SOCKET BECAUSE WE WERE TOLD IT CLOSED", sock_fd
-#					sock = fdtosock.pop(sock_fd, None)
-#					poller.unregister(sock_fd)
-#					sockets.remove(sock)
 
-		return response
+		return self._dispatch(res)
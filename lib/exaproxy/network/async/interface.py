@@ -9,6 +9,8 @@ Copyright (c) 2011-2013  Exa Networks. All rights reserved.
 class IPoller:
 	"""Interface for pollers"""
 
+	edge = False  # edge triggered pollers only report a socket again once new data arrived
+
 	def addReadSocket(self, name, socket):
 		"""Start watching for data in the socket's recvbuf"""
 		raise NotImplementedError
@@ -27,6 +29,11 @@ class IPoller:
 		"""Start watching the socket for incoming data again"""
 		raise NotImplementedError
 
+	def rearmReadSocket(self, name, socket):
+		"""The socket was not read until it would block, report it again
+		   on the next poll (only required by edge triggered pollers)"""
+		raise NotImplementedError
+
 	def setupRead(self, name):
 		"""Define a new event that sockets can subscribe to"""
 		raise NotImplementedError
@@ -53,6 +60,11 @@ class IPoller:
 		"""Start watching for space in the socket's sendbuf again"""
 		raise NotImplementedError
 
+	def rearmWriteSocket(self, name, socket):
+		"""The socket was not written until it would block, report it again
+		   on the next poll (only required by edge triggered pollers)"""
+		raise NotImplementedError
+
 	def setupWrite(self, name):
 		"""Define a new event that sockets can subscribe to"""
 		raise NotImplementedError
@@ -61,7 +73,8 @@ class IPoller:
 		"""Flush all sockets currently watched for the event"""
 		raise NotImplementedError
 
-	def poll(self):
-		"""Wait for events we're watching for to occur and
-		   return a list of each eventful socket per event"""
+	def poll(self, timeout=None):
+		"""Wait for events we're watching for to occur, for at most timeout
+		   seconds (the configured speed if None), and return a list of each
+		   eventful socket per event"""
 		raise NotImplementedError
@@ -8,12 +8,12 @@ Copyright (c) 2011-2013  Exa Networks. All rights reserved.
 
 # http://code.google.com/speed/articles/web-metrics.html
 
+import math
 import select
-import socket
 import errno
 
 from exaproxy.network.errno_list import errno_block, errno_fatal
-from interface import IPoller
+from descriptors import DescriptorPoller
 
 from exaproxy.util.log.logger import Logger
 from exaproxy.configuration import load
@@ -21,33 +21,40 @@ from exaproxy.configuration import load
 configuration = load()
 log = Logger('select', configuration.log.server)
 
+# poll() flags, with the values select() results are translated to when poll() is not available
+POLLIN = getattr(select, 'POLLIN', 0x001)
+POLLOUT = getattr(select, 'POLLOUT', 0x004)
+POLLERR = getattr(select, 'POLLERR', 0x008)
+POLLHUP = getattr(select, 'POLLHUP', 0x010)
+POLLNVAL = getattr(select, 'POLLNVAL', 0x020)
+
+
 def poll_select(read, write, timeout=None):
 	try:
 		r, w, x = select.select(read, write, read + write, timeout)
-	except socket.error, e:
+	except select.error, e:
+		# interrupted by a signal
 		if e.args[0] in errno_block:
-			log.error('select not ready, errno %d: %s' % (e.args[0], errno.errorcode.get(e.args[0], '')))
 			return [], [], []
 
 		if e.args[0] in errno_fatal:
 			log.error('select problem, errno %d: %s' % (e.args[0], errno.errorcode.get(e.args[0], '')))
 			log.error('poller read  : %s' % str(read))
 			log.error('poller write : %s' % str(write))
-			log.error('read : %s' % str(read))
 		else:
 			log.critical('select problem, debug it. errno %d: %s' % (e.args[0], errno.errorcode.get(e.args[0], '')))
 
 		for f in read:
 			try:
-				poll([f], [], [f], 0.1)
-			except socket.error:
+				select.select([f], [], [f], 0)
+			except select.error:
 				print "CANNOT POLL (read): %s" % str(f)
 				log.error('can not poll (read) : %s' % str(f))
 
 		for f in write:
 			try:
-				poll([], [f], [f], 0.1)
-			except socket.error:
+				select.select([], [f], [f], 0)
+			except select.error:
 				print "CANNOT POLL (write): %s" % str(f)
 				log.error('can not poll (write) : %s' % str(f))
 
@@ -55,11 +62,6 @@ def poll_select(read, write, timeout=None):
 	except (ValueError, AttributeError, TypeError), e:
 		log.error("fatal error encountered during select - %s %s" % (type(e),str(e)))
 		raise e
-	except select.error, e:
-		if e.args[0] in errno_block:
-			return [], [], []
-		log.error("fatal error encountered during select - %s %s" % (type(e),str(e)))
-		raise e
 	except KeyboardInterrupt,e:
 		raise e
 	except Exception, e:
@@ -69,105 +71,69 @@ def poll_select(read, write, timeout=None):
 	return r, w, x
 
 
-class SelectPoller (IPoller):
-	poller = staticmethod(poll_select)
-
-	def __init__(self, speed):
-		self.speed = speed
-
-		self.read_sockets = {}
-		self.write_sockets = {}
+class _Select (object):
+	"""select() behind the interface of select.poll(), for the systems without poll()"""
 
-		self.read_modified = {}
-		self.write_modified = {}
+	def __init__ (self):
+		self.readers = set()
+		self.writers = set()
 
-		self.read_all = []
-		self.write_all = []
+	def register (self, fileno, mask):
+		self.modify(fileno, mask)
 
-	def addReadSocket(self, name, socket):
-		sockets = self.read_sockets[name]
-		if socket not in sockets:
-			sockets.append(socket)
-			self.read_modified[name] = True
-
-	def removeReadSocket(self, name, socket):
-		sockets = self.read_sockets[name]
-		if socket in sockets:
-			sockets.remove(socket)
-			self.read_modified[name] = True
-
-	def setupRead(self, name):
-		if name not in self.read_sockets:
-			self.read_sockets[name] = []
-
-	def clearRead(self, name):
-		had_sockets = bool(self.read_sockets[name])
-		self.read_sockets[name] = {}
-
-		if had_sockets:
-			self.read_modified[name] = True
-
-	def addWriteSocket(self, name, socket):
-		sockets = self.write_sockets[name]
-		if socket not in sockets:
-			sockets.append(socket)
-			self.write_modified[name] = True
-
-	def removeWriteSocket(self, name, socket):
-		sockets = self.write_sockets[name]
-		if socket in sockets:
-			sockets.remove(socket)
-			self.write_modified[name] = True
-
-	def setupWrite(self, name):
-		if name not in self.write_sockets:
-			self.write_sockets[name] = []
+	def modify (self, fileno, mask):
+		if mask & POLLIN:
+			self.readers.add(fileno)
+		else:
+			self.readers.discard(fileno)
 
-	def clearWrite(self, name):
-		had_sockets = bool(self.write_sockets[name])
-		self.write_sockets[name] = {}
+		if mask & POLLOUT:
+			self.writers.add(fileno)
+		else:
+			self.writers.discard(fileno)
 
-		if had_sockets:
-			self.write_modified[name] = True
+	def unregister (self, fileno):
+		self.readers.discard(fileno)
+		self.writers.discard(fileno)
 
-	corkReadSocket = removeReadSocket
-	uncorkReadSocket = addReadSocket
+	def poll (self, timeout):
+		r, w, x = poll_select(list(self.readers), list(self.writers), None if timeout is None else timeout / 1000.0)
 
-	corkWriteSocket = removeWriteSocket
-	uncorkWriteSocket = addWriteSocket
+		events = dict.fromkeys(r, POLLIN)
+		for fileno in w:
+			events[fileno] = events.get(fileno, 0) | POLLOUT
+		for fileno in x:
+			events[fileno] = events.get(fileno, 0) | POLLERR
 
-	def poll(self):
-		all_socks = {}
+		return events.items()
 
-		for name, socks in self.read_sockets.items():
-			socks, _, __ = self.poller(socks, [], 0)
-			if socks:
-				all_socks[name] = socks
 
-		for name, socks in self.write_sockets.items():
-			_, socks, __ = self.poller([], socks, 0)
-			if socks:
-				all_socks[name] = socks
+class SelectPoller (DescriptorPoller):
+	"""A single poll() call (select() where poll() is missing) watching every socket.
 
-		if all_socks:
-			return all_socks
+	Unlike epoll, poll keeps the descriptors which were closed without being
+	removed: they are reported as invalid, and forgotten then."""
 
-		if self.read_modified:
-			self.read_all = sum(self.read_sockets.values(), [])
-			self.read_modified = {}
+	poller = staticmethod(select.poll) if hasattr(select, 'poll') else _Select
 
-		if self.write_modified:
-			self.write_all = sum(self.write_sockets.values(), [])
-			self.write_modified = {}
+	IN = POLLIN
+	OUT = POLLOUT
+	HANGUP = POLLHUP|POLLERR|POLLNVAL
+	INVALID = POLLNVAL
 
-		r, w, x  = self.poller(self.read_all, self.write_all, self.speed)
+	def __init__(self, speed):
+		DescriptorPoller.__init__(self, speed, self.poller())
 
-		for name, socks in self.read_sockets.items():
-			polled, _, __ = self.poller(socks, [], 0)
-			if polled: all_socks[name] = polled
+	def poll(self, timeout=None):
+		if timeout is None:
+			timeout = self.speed
 
-		for name, socks in self.write_sockets.items():
-			polled, all_socks[name], __ = self.poller([], socks, 0)
-			if polled: all_socks[name] = polled
+		try:
+			# poll() wants milliseconds, never wake up before the timeout
+			res = self.master.poll(int(math.ceil(timeout * 1000)))
+		except select.error, e:
+			if e.args[0] != errno.EINTR:
+				raise
+			res = []
 
-		return all_socks
+		return self._dispatch(res)
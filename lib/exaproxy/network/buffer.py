@@ -0,0 +1,243 @@
+# encoding: utf-8
+"""
+buffer.py
+
+Created by agent on 2026-10-17.
+Copyright (c) 2011-2013  Exa Networks. All rights reserved.
+"""
+
+from collections import deque
+from itertools import islice
+
+import os
+import errno
+import socket
+import platform
+import ctypes
+import ctypes.util
+
+from .sendfile import sendfile
+
+
+class _iovec (ctypes.Structure):
+	# a str given to a c_char_p points at its characters, and is kept alive with the structure
+	_fields_ = [
+		('iov_base', ctypes.c_char_p),
+		('iov_len', ctypes.c_size_t),
+	]
+
+
+class _address (ctypes.Structure):
+	# the same memory, to move iov_base past what was already sent
+	_fields_ = [
+		('iov_base', ctypes.c_void_p),
+		('iov_len', ctypes.c_size_t),
+	]
+
+
+def _make_writev ():
+	"""a writev(2) wrapper taking a sequence of str, or None if it can not be used"""
+	# only CPython gives ctypes the characters of a str in place, other interpreters send with send
+	if platform.python_implementation() != 'CPython':
+		return None
+
+	try:
+		libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+		c_writev = libc.writev
+	except (OSError, AttributeError):
+		return None
+
+	c_writev.argtypes = [ctypes.c_int, ctypes.POINTER(_iovec), ctypes.c_int]
+	c_writev.restype = ctypes.c_ssize_t
+
+	def writev (fd, chunks, offset, count):
+		vector = (_iovec * count)()
+
+		# the kernel reads the data in place, nothing is copied in user space
+		for iov, chunk in zip(vector, islice(chunks, count)):
+			iov.iov_base = chunk
+			iov.iov_len = len(chunk)
+
+		if offset:
+			first = _address.from_buffer(vector)
+			first.iov_base += offset
+			first.iov_len -= offset
+
+		sent = c_writev(fd, vector, count)
+		if sent < 0:
+			error = ctypes.get_errno()
+			raise socket.error(error, os.strerror(error))
+		return sent
+
+	return writev
+
+writev = _make_writev()
+
+
+class BufferQueue (object):
+	"""Data waiting to be written to a socket, kept as the chunks we were given
+
+	Adding data or writing part of it never copies what is already queued,
+	the first chunk is sent from where the last write stopped, and when more
+	than one chunk is waiting, they are all written with one writev call.
+
+	saved counts the bytes a single str buffer would have copied around
+	(concatenating new data to it, or keeping what could not be sent).
+
+	A local file can be queued after the data, it is sent with sendfile
+	as the socket takes it and never read in memory."""
+
+	iov_max = 64  # chunks given to a single writev
+	iov_bytes = 256*1024  # no more chunks are given to writev once they hold this much, the socket would not take them
+
+	def __init__ (self, data=''):
+		self.chunks = deque()
+		self.offset = 0   # how much of the first chunk was already sent
+		self.size = 0     # bytes waiting to be sent
+		self.peak = 0     # the most bytes we ever had waiting
+		self.queued = 0L  # bytes ever added
+		self.saved = 0L   # bytes we did not have to copy
+		self.file = None  # a local file to send once the chunks are gone
+		self.position = 0 # how much of the file was already sent
+		self.remaining = 0  # how much of the file is left to send
+
+		if data:
+			self.append(data)
+
+	def __len__ (self):
+		return self.size + self.remaining
+
+	def __nonzero__ (self):
+		return self.size > 0 or self.remaining > 0
+
+	def __str__ (self):
+		if not self.chunks:
+			return ''
+		return ''.join(self.chunks)[self.offset:]
+
+	def attach (self, local):
+		"""send the content of local (a cached file) after the data, nothing can be appended to it"""
+		self.file = local
+		self.position = 0
+		self.remaining = local.size
+
+	def append (self, data):
+		if data:
+			size = self.size
+			if size:
+				self.saved += size
+			self.chunks.append(data)
+
+			length = len(data)
+			size += length
+			self.size = size
+			self.queued += length
+			if size > self.peak:
+				self.peak = size
+		return self.size
+
+	def prepend (self, data):
+		if data:
+			if self.offset:
+				self.chunks[0] = self.chunks[0][self.offset:]
+				self.offset = 0
+
+			self.saved += self.size
+			self.chunks.appendleft(data)
+			self._grow(len(data))
+		return self.size
+
+	def _grow (self, size):
+		self.size += size
+		self.queued += size
+		if self.size > self.peak:
+			self.peak = self.size
+
+	def consume (self, size):
+		"""forget the first size bytes, as they were sent"""
+		if not size:
+			return
+
+		self.size -= size
+		if self.size:
+			self.saved += self.size
+
+		chunks = self.chunks
+		size += self.offset
+
+		while chunks and size >= len(chunks[0]):
+			size -= len(chunks.popleft())
+
+		self.offset = size if chunks else 0
+
+	def send (self, sock):
+		"""write as much as the socket takes with one system call, socket.error is raised like for send
+		(with a file attached, the file also starts to be sent once all the data was written)"""
+		chunks = self.chunks
+
+		if len(chunks) == 1 and not self.remaining:
+			# most of the time the socket keeps up: what we were just given is sent as it is, and forgotten
+			chunk = chunks[0]
+			offset = self.offset
+			sent = sock.send(memoryview(chunk)[offset:] if offset else chunk)
+
+			offset += sent
+			if offset == len(chunk):
+				chunks.clear()
+				self.offset = 0
+				self.size = 0
+			elif sent:
+				self.offset = offset
+				self.size -= sent
+				self.saved += self.size
+			return sent
+
+		if not chunks:
+			return self._sendfile(sock) if self.remaining else 0
+
+		if len(chunks) > 1 and writev is not None:
+			# building the vector is what costs, only give what the socket could take
+			count = 0
+			size = -self.offset
+			for chunk in chunks:
+				count += 1
+				size += len(chunk)
+				if size >= self.iov_bytes or count == self.iov_max:
+					break
+
+			sent = writev(sock.fileno(), chunks, self.offset, count)
+		elif self.offset:
+			sent = sock.send(memoryview(chunks[0])[self.offset:])
+		else:
+			sent = sock.send(chunks[0])
+
+		self.consume(sent)
+
+		if self.remaining and not self.size:
+			try:
+				sent += self._sendfile(sock)
+			except socket.error, e:
+				if e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+					raise
+
+		return sent
+
+	def _sendfile (self, sock):
+		sent = sendfile(sock, self.file.fileno(), self.position, self.remaining)
+		if not sent:
+			# the file is shorter than when we told the client its size
+			raise socket.error(errno.EIO, os.strerror(errno.EIO))
+
+		self.position += sent
+		self.remaining -= sent
+		if not self.remaining:
+			self.file = None
+
+		return sent
+
+	def clear (self):
+		self.chunks.clear()
+		self.offset = 0
+		self.size = 0
+		self.file = None
+		self.remaining = 0
@@ -116,3 +116,17 @@ def connect (ip,port,bind,immediate=True):
 			s = None
 
 	return s
+
+def netstat (names, path='/proc/net/netstat'):
+	"""the value of some of the kernel TcpExt counters (linux only, otherwise an empty dict)"""
+	try:
+		with open(path) as fd:
+			tcpext = [line.split()[1:] for line in fd if line.startswith('TcpExt:')]
+	except IOError:
+		return {}
+
+	if len(tcpext) != 2:
+		return {}
+
+	counters = dict(zip(*tcpext))
+	return dict((name, int(counters[name])) for name in names if name in counters)
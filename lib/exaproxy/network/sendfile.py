@@ -0,0 +1,54 @@
+# encoding: utf-8
+"""
+sendfile.py
+
+Created by agent on 2026-10-17.
+Copyright (c) 2011-2013  Exa Networks. All rights reserved.
+"""
+
+import os
+import sys
+import socket
+import ctypes
+import ctypes.util
+
+READ_SIZE = 64*1024  # what we read at once from a file when sendfile is not available
+
+
+def _make_sendfile ():
+	"""a sendfile(2) wrapper, or None if the libc does not provide it (the BSD call is not compatible)"""
+	if not sys.platform.startswith('linux'):
+		return None
+
+	try:
+		libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+		c_sendfile = getattr(libc, 'sendfile64', None) or libc.sendfile
+	except (OSError, AttributeError):
+		return None
+
+	# ssize_t sendfile(int out_fd, int in_fd, off_t *offset, size_t count)
+	c_sendfile.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.POINTER(ctypes.c_int64), ctypes.c_size_t]
+	c_sendfile.restype = ctypes.c_ssize_t
+
+	def sendfile (sock, fd, offset, count):
+		"""send count bytes of fd from offset, socket.error is raised like for send
+
+		the data goes from the page cache to the socket without being copied in user space
+		giving the offset leaves the position of the file alone, so the fd can be shared"""
+		sent = c_sendfile(sock.fileno(), fd, ctypes.byref(ctypes.c_int64(offset)), count)
+		if sent < 0:
+			error = ctypes.get_errno()
+			raise socket.error(error, os.strerror(error))
+		return sent
+
+	return sendfile
+
+
+def _readsend (sock, fd, offset, count):
+	"""send count bytes of fd from offset, socket.error is raised like for send"""
+	os.lseek(fd, offset, os.SEEK_SET)
+	return sock.send(os.read(fd, min(count, READ_SIZE)))
+
+
+zerocopy = _make_sendfile()
+sendfile = zerocopy or _readsend
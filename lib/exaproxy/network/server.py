@@ -11,6 +11,7 @@ Copyright (c) 2011-2013  Exa Networks. All rights reserved.
 
 from .functions import listen
 import socket
+import errno
 
 from exaproxy.util.log.logger import Logger
 from exaproxy.configuration import load
@@ -30,6 +31,10 @@ class Server(object):
 		self.saturated = False  # we are receiving more connections than we can handle
 		self.binding = set()
 		self.serving = True  # We are currenrly listening
+		self.budget = configuration.daemon.accept_budget  # how many connections we accept per socket and loop (0: unlimited)
+		self.accepted = 0L   # connections accepted
+		self.wakeups = 0L    # times we were told a listening socket was readable
+		self.exhausted = 0L  # times we stopped accepting with connections possibly still queued
 		self.log = Logger('server', configuration.log.server)
 		self.log.info('server [%s] accepting up to %d clients' % (name, max_clients))
 
@@ -67,6 +72,8 @@ class Server(object):
 	def listen(self, ip, port, timeout, backlog):
 		s = self._listen(ip, port,timeout,backlog)
 		if s:
+			# we accept until the queue is empty, which we can only know if accept does not block
+			s.setblocking(0)
 			self.binding.add((ip,port,timeout,backlog))
 			self.socks[s] = (ip,port)
 
@@ -77,19 +84,39 @@ class Server(object):
 		return s
 
 	def accept(self, sock):
+		self.wakeups += 1
+		accepted = 0
+
 		try:
-			# should we check to make sure it's a socket we provided
-			s, (ip,port) = sock.accept()
-			s.setblocking(0)
-			# NOTE: we really should try to handle the entire queue at once
-			yield s, ip
-		except socket.error, e:
-			# It doesn't really matter if accept fails temporarily. We will
-			# try again next loop
-			self.log.debug('%s could not accept a new connection %s' % (self.name,str(e)))
-		else:
-			self.client_count += 1
+			# empty the queue, as long as we can have more clients and have not used our budget
+			while self.client_count < self.max_clients:
+				if self.budget and accepted >= self.budget:
+					# the socket is level triggered, we will be called again on the next loop
+					self.exhausted += 1
+					break
+
+				try:
+					# should we check to make sure it's a socket we provided
+					s, peer = sock.accept()
+				except socket.error, e:
+					if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+						break
+					# the connection went away before we could accept it
+					if e.args[0] in (errno.ECONNABORTED, errno.EINTR):
+						continue
+					# It doesn't really matter if accept fails temporarily. We will
+					# try again next loop
+					self.log.debug('%s could not accept a new connection %s' % (self.name,str(e)))
+					break
+
+				# python 2 has no accept4, the socket does not inherit O_NONBLOCK
+				s.setblocking(0)
+				accepted += 1
+				self.client_count += 1
+				yield s, peer[0]
 		finally:
+			self.accepted += accepted
+
 			if self.client_count >= self.max_clients:
 				self.saturated = True
 
@@ -0,0 +1,293 @@
+# encoding: utf-8
+"""
+processes.py
+
+Created by agent on 2026-10-17.
+Copyright (c) 2011-2013  Exa Networks. All rights reserved.
+"""
+
+import os
+import sys
+import json
+import time
+import fcntl
+import errno
+import signal
+import resource
+
+from exaproxy.util.log.logger import Logger
+
+# set by the master in the environment of the reactor processes it starts : "<worker id>:<statistics fd>"
+ENVIRONMENT = 'EXAPROXY_WORKER'
+
+FAST = 10         # seconds, a reactor process dying sooner after it was started failed to start
+BACKOFF = 1       # seconds before starting it again, doubled each time it fails to start in a row
+BACKOFF_MAX = 60  # the longest we wait before starting it again
+FAILURES = 5      # failed starts in a row before the master gives up and stops
+
+# the statistics of the workers added up by the master: what each process handles,
+# not its configuration (processes.min/max), pid or the host wide system.* counters
+SUMMED = (
+	'clients.', 'servers.', 'transfer.', 'load.', 'timers.', 'timing.', 'queue.',
+	'accept.', 'budget.', 'buffer.', 'relay.', 'processes.forked',
+)
+
+
+class Processes (object):
+	"""Start and supervise the reactor processes (daemon.workers > 1)
+
+	The master process forks and re-executes the program once per worker,
+	so each worker has its own poller, managers and redirector pool, and
+	they all listen on the same ports (SO_REUSEPORT). The master only
+	serves the web interface, restarts the workers which died and sums
+	the statistics each worker sends it every second through a pipe."""
+
+	def __init__ (self, configuration):
+		self.configuration = configuration
+		self.log = Logger('supervisor', configuration.log.supervisor)
+
+		self.number = configuration.daemon.workers
+		self.children = {}     # pid : (wid, fd, partial line)
+		self.statistics = {}   # wid : last statistics received
+		self.restarted = 0
+		self.started = {}      # wid : when the reactor process was last started
+		self.failures = {}     # wid : how many times in a row it failed to start
+		self.respawn = {}      # wid : when to start it again
+		self.failed = False    # a reactor process kept failing to start, the master must stop
+		self.stopping = False
+		self.unsent = ''       # part of our last report the master did not read yet
+
+		self.wid, self.report_fd = self._worker()
+		self.master = self.wid is None and self.number > 1
+
+	def _worker (self):
+		worker = os.environ.pop(ENVIRONMENT, '')
+		if not worker:
+			return None, None
+
+		try:
+			wid, fd = worker.split(':')
+			wid, fd = int(wid), int(fd)
+			# never block the reactor if the master is not reading
+			flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+			fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+		except (ValueError, IOError), e:
+			self.log.critical('invalid %s environment value (%s), ignoring' % (ENVIRONMENT, worker))
+			return None, None
+
+		return wid, fd
+
+	def _spawn (self, wid):
+		read_fd, write_fd = os.pipe()
+
+		try:
+			pid = os.fork()
+		except OSError, e:
+			self.log.critical('could not fork reactor process %d: %s' % (wid, str(e)))
+			os.close(read_fd)
+			os.close(write_fd)
+			return False
+
+		if pid == 0:
+			try:
+				# do not leak any of our sockets (epoll, listening web sockets, ...) in the worker
+				maxfd = resource.getrlimit(resource.RLIMIT_NOFILE)[1]
+				if maxfd == resource.RLIM_INFINITY:
+					maxfd = 1024
+
+				os.closerange(3, write_fd)
+				os.closerange(write_fd+1, maxfd)
+
+				env = dict(os.environ)
+				env[ENVIRONMENT] = '%d:%d' % (wid, write_fd)
+				env['exaproxy_daemon_workers'] = '1'
+				env['exaproxy_daemon_daemonize'] = 'false'
+				env['exaproxy_daemon_pidfile'] = "''"
+				env['exaproxy_daemon_identifier'] = '%s-%d' % (self.configuration.daemon.identifier, wid)
+				env['exaproxy_web_enable'] = 'false'
+
+				os.execve(sys.executable, [sys.executable, '-m', 'exaproxy.util.debug'] + sys.argv, env)
+			finally:
+				os._exit(1)
+
+		os.close(write_fd)
+		flags = fcntl.fcntl(read_fd, fcntl.F_GETFL)
+		fcntl.fcntl(read_fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+		self.children[pid] = wid, read_fd, ''
+		self.started[wid] = time.time()
+		self.log.info('started reactor process %d with pid %d' % (wid, pid))
+		return True
+
+	def start (self):
+		"""fork all our reactor processes (master only)"""
+		if not self.master:
+			return True
+
+		self.log.info('starting %d reactor processes' % self.number)
+		for wid in range(1, self.number+1):
+			if not self._spawn(wid):
+				return False
+
+		return True
+
+	def _reap (self):
+		for pid, (wid, fd, partial) in self.children.items():
+			try:
+				child, status = os.waitpid(pid, os.WNOHANG)
+			except OSError, e:
+				if e.errno != errno.ECHILD:
+					raise
+				child, status = pid, 0
+
+			if not child:
+				continue
+
+			os.close(fd)
+			del self.children[pid]
+			self.statistics.pop(wid, None)
+
+			if self.stopping:
+				self.log.info('reactor process %d (pid %d) exited' % (wid, pid))
+				continue
+
+			# a process which dies as it starts (invalid configuration, import error, ...) would otherwise be forked in a loop
+			now = time.time()
+			failures = self.failures.get(wid, 0) + 1 if now - self.started.get(wid, 0) < FAST else 0
+			self.failures[wid] = failures
+
+			if failures >= FAILURES:
+				self.log.critical('reactor process %d (pid %d) died with status %d, it failed to start %d times in a row, stopping' % (wid, pid, status, failures))
+				self.failed = True
+				continue
+
+			delay = min(BACKOFF_MAX, BACKOFF << (failures - 1)) if failures else 0
+			self.log.critical('reactor process %d (pid %d) died with status %d, restarting it in %d seconds' % (wid, pid, status, delay))
+			self.respawn[wid] = now + delay
+
+	def _respawn (self):
+		if self.stopping:
+			return
+
+		now = time.time()
+
+		for wid, when in self.respawn.items():
+			if when > now:
+				continue
+
+			del self.respawn[wid]
+			self.restarted += 1
+
+			if not self._spawn(wid):
+				# we could not fork, try again later
+				self.respawn[wid] = now + BACKOFF
+
+	def _read (self, pid):
+		wid, fd, partial = self.children[pid]
+
+		while True:
+			try:
+				data = os.read(fd, 65536)
+			except OSError, e:
+				if e.errno not in (errno.EAGAIN, errno.EINTR):
+					self.log.error('could not read statistics from reactor process %d: %s' % (wid, str(e)))
+				break
+
+			if not data:
+				break
+
+			partial += data
+
+		lines = partial.split('\n')
+		self.children[pid] = wid, fd, lines.pop()
+
+		# only the most recent report matters
+		for line in reversed(lines):
+			try:
+				self.statistics[wid] = json.loads(line)
+				break
+			except ValueError:
+				self.log.error('invalid statistics received from reactor process %d' % wid)
+
+	def collect (self):
+		"""read the statistics of the workers and restart the dead ones, returns False if one keeps failing to start (master only)"""
+		if not self.master:
+			return True
+
+		for pid in self.children.keys():
+			self._read(pid)
+
+		self._reap()
+		self._respawn()
+
+		return not self.failed
+
+	def report (self, statistics):
+		"""send our statistics to the master, returns False if the master is gone (worker only)"""
+		if self.report_fd is None:
+			return True
+
+		# finish sending the previous report before starting a new one
+		data = self.unsent if self.unsent else json.dumps(statistics) + '\n'
+
+		try:
+			sent = os.write(self.report_fd, data)
+			self.unsent = data[sent:]
+		except OSError, e:
+			if e.errno in (errno.EAGAIN, errno.EINTR):
+				# the master is busy, it will get the next one
+				return True
+			self.log.critical('could not report to the master process, exiting: %s' % str(e))
+			return False
+
+		return True
+
+	def aggregate (self, statistics):
+		"""add the statistics of all the workers to ours"""
+		if not self.master:
+			return statistics
+
+		for worker in self.statistics.itervalues():
+			for key, value in worker.iteritems():
+				if not key.startswith(SUMMED) or isinstance(value, bool) or not isinstance(value, (int, long, float)):
+					continue
+				statistics[key] = statistics.get(key, 0) + value
+
+		statistics['reactors.running'] = len(self.children)
+		statistics['reactors.restarted'] = self.restarted
+		return statistics
+
+	def forward (self, signum):
+		"""pass a signal received by the master to all the workers"""
+		for pid in self.children:
+			try:
+				os.kill(pid, signum)
+			except OSError:
+				pass
+
+	def softstop (self):
+		"""ask the workers to stop once their clients are gone, returns True once they all exited"""
+		if not self.master:
+			return True
+
+		if not self.stopping:
+			self.stopping = True
+			self.forward(signal.SIGQUIT)
+
+		self._reap()
+		return not self.children
+
+	def stop (self):
+		"""terminate all the workers and wait for them"""
+		self.stopping = True
+		self.forward(signal.SIGTERM)
+
+		for pid, (wid, fd, partial) in self.children.items():
+			try:
+				os.waitpid(pid, 0)
+			except OSError:
+				pass
+			os.close(fd)
+
+		self.children = {}
+		self.statistics = {}
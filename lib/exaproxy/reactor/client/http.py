@@ -7,260 +7,212 @@ Copyright (c) 2011-2013  Exa Networks. All rights reserved.
 """
 
 import socket
-import errno
 
 from exaproxy.network.functions import isipv4
 from exaproxy.network.errno_list import errno_block
+from exaproxy.network.buffer import BufferQueue
+from .reader import RequestReader, ChunkedReader
+from .reader import READING, BODY, DECISION, CLOSED
+from .writer import ResponseWriter
 
-def ishex (s):
-	return bool(s) and not bool(s.strip('0123456789abcdefABCDEF'))
 
-def count_quotes (data):
-	return data.count('"') - data.count('\\"')
+class HTTPReader (object):
+	"""The requests of a client, and what follows them, read as they arrive
 
-class HTTPClient (object):
-	eor = ['\r\n\r\n', '\n\n']
+	read returns (request, content): the next request with the end of the
+	body of the one before it, or '' and the part of a body read, or None
+	once the connection can not be used. After a request, the next read is
+	given what follows it (its mode and the size of its body)."""
 
-	def __init__(self, name, sock, peer, logger, max_buffer):
-		self.name = name
-		self.ipv4 = isipv4(sock.getsockname()[0])
-		self.sock = sock
-		self.peer = peer
-		self.reader = self._read(sock,max_buffer)
-		self.writer = self._write(sock)
-		self.w_buffer = ''
+	__slots__ = (
+		'sock', 'r_buffer', 'max_buffer', 'read_budget', 'log', 'pending',
+		'waiting', 'mode', 'nb_to_send', 'processing', 'content', 'chunked',
+	)
 
+	def __init__ (self, sock, r_buffer, max_buffer, read_budget, logger):
+		self.sock = sock
+		self.r_buffer = r_buffer
+		self.max_buffer = max_buffer
+		self.read_budget = read_budget  # edge triggered: read until it would block, up to this many bytes
+		self.pending = False            # edge triggered: the socket was not read until it would block
 		self.log = logger
-		self.blockupload = None
-
-		# start the _read coroutine
-		self.reader.next()
 
-	def checkRequest (self, r_buffer, size, seek=0):
-		for eor in self.eor:
-			pos = r_buffer[seek:].find(eor)
-			if pos == -1: continue
+		# mode can be one of : request, chunked, transfer, passthrough
+		# request : we are reading the request (read all you can until a separator)
+		# chunked : we are reading chunk-encoded data, until the last chunk and the trailer
+		# transfer : we are reading as much as requested in remaining
+		# passthrough : read as much as can to be relayed
 
-			buff = r_buffer[:seek+pos]
-			if not buff: continue
+		self.waiting = READING
+		self.mode = 'request'
+		self.nb_to_send = 0      # bytes of the body still to read (transfer)
+		self.processing = False  # what we have is parsed before reading more
+		self.content = ''        # the end of the body of the last request
+		self.chunked = None      # where the chunked body ends (chunked)
 
-			if not count_quotes(buff) % 2:  # we have matching pairs
-				return buff + eor, r_buffer[seek+pos+len(eor):], seek
+	def _recv (self, sock, r_buffer, read_size):
+		"""Read from the client, until the socket would block if edge triggered"""
+		self.pending = False
+		size = r_buffer.recv(sock, read_size)
 
-			seek += pos + len(eor)
+		if not size or not self.read_budget:
+			return size
 
-		if size and len(r_buffer) > size:
-			return None,None,None
+		received = size
 
-		return '', r_buffer, seek
+		while received < self.read_budget:
+			try:
+				size = r_buffer.recv(sock, read_size)
+			except socket.error, e:
+				if e.args[0] not in errno_block:
+					self.pending = True  # the error will be seen by the next read
+				break
 
+			if not size:
+				self.pending = True  # the connection close will be seen by the next read
+				break
 
-	def checkChunkSize (self, r_buffer):
-		# return a tuple : bool, length
-		# * the bool is : is there more chunk to come
-		# * the len contains the size of the chunk(s) extracted
-		#   a size of None means that we could not decode as it is invalid
+			received += size
+		else:
+			self.pending = True
 
-		total_len = 0
+		return received
 
-		while r_buffer:
-			if not '\n' in r_buffer:
-				if len(r_buffer) > 6:  # len('FFFF') + len(\r\n)
-					return True, None
-				return True, 0
+	def read (self, mode, remaining, read_size=64*1024):
+		waiting = self.waiting
 
-			header,r_buffer = r_buffer.split('\n', 1)
-			len_header = len(header) + 1
+		if waiting == DECISION:
+			# remaining is how much we expect to need to get the rest of the request
+			self.mode = mode
+			self.nb_to_send = remaining
 
-			if header.endswith('\r'):
-				header = header[:-1]
-				len_eol = 2
-			else:
-				len_eol = 1
+			if mode == 'chunked':
+				self.chunked = ChunkedReader()
 
-			if ';' in header:
-				header = header.split(';',1)[0]
+		elif waiting == BODY:
+			self.nb_to_send += remaining
 
-			if not ishex(header):
-				return True,None
+		elif waiting == CLOSED:
+			return None, None
 
-			len_chunk = int(header, 16)
+		self.waiting = READING
+		r_buffer = self.r_buffer
 
-			# 0xFFFF is not enough - coad is complaining :p
-			if len_chunk > 0x100000:
-				return True,None
+		try:
+			while True:
+				if not self.processing:
+					size = self._recv(self.sock, r_buffer, read_size)
+					if not size:
+						break  # read failed so we abort
+					self.log.debug("<< [%s]" % r_buffer.tail(size).replace('\t','\\t').replace('\r','\\r').replace('\n','\\n'))
+				else:
+					self.processing = False
 
-			if len_chunk == 0:
-				total_len += len_header
-				return False, total_len
-			else:
-				total = len_chunk + len_eol
-				total_len += total + len_header
-				r_buffer = r_buffer[total:]
+				mode = self.mode
 
-		return True,total_len
+				if mode == 'passthrough':
+					return '', r_buffer.take(len(r_buffer))
 
+				if self.nb_to_send:
+					if mode == 'transfer' :
+						length = min(len(r_buffer), self.nb_to_send)
 
-	def _read (self, sock, max_buffer, read_size=64*1024):
-		"""Coroutine managing data read from the client"""
-		# yield request, content
-		# request is the text that form the request header
-		# content any text which is related to the current request after the headers
+						# we still have data to read before we can send more.
+						if length < self.nb_to_send:
+							self.nb_to_send -= length
+							self.waiting = BODY
+							return '', r_buffer.take(length)
 
-		yield ''
+						# the end of the body is handed out with the request which may follow it
+						self.content = r_buffer.take(length)
+						self.nb_to_send = 0
+						self.mode = mode = 'request'
 
-		r_buffer = ''
-		nb_to_send = 0
-		seek = 0
-		processing = False
+				if mode == 'chunked':
+					# decode what we received, each byte only once
+					length = self.chunked.decode(r_buffer)
 
-		# mode can be one of : request, chunk, extension, relay
-		# request : we are reading the request (read all you can until a separator)
-		# extra-headers : we are reading data until a separator
-		# chunked : we are reading chunk-encoded darta
-		# transfer : we are reading as much as requested in remaining
-		# passthrough : read as much as can to be relayed
-
-		mode = 'request'
+					if length is None:
+						# could not read any chunk (data is invalid)
+						break
 
-		while True:
-			try:
-				while True:
-					if not processing:
-						data = sock.recv(read_size)
-						if not data:
-							break  # read failed so we abort
-						self.log.debug("<< [%s]" % data.replace('\t','\\t').replace('\r','\\r').replace('\n','\\n'))
-						r_buffer += data
-					else:
-						processing = False
-
-					if mode == 'passthrough':
-						yield '', r_buffer
-						r_buffer = ''
+					if not self.chunked.done:
+						if length:
+							return '', r_buffer.take(length)
 						continue
 
-					if nb_to_send:
-						if mode == 'transfer' :
-							r_len = len(r_buffer)
-							length = min(r_len, nb_to_send)
-
-							# do not yield yet if we are chunked since the end of the chunk may
-							# very well be in the rest of the data we just read
-							_, extra_size = yield '', r_buffer[:length]
-
-							r_buffer = r_buffer[length:]
-							nb_to_send = nb_to_send - length + extra_size
-
-							# we still have data to read before we can send more.
-							if nb_to_send != 0:
-								continue
-							mode = 'request'
-
-						if mode == 'chunked':
-							r_len = len(r_buffer)
-							length = min(r_len, nb_to_send)
-
-							# do not yield yet if we are chunked since the end of the chunk may
-							# very well be in the rest of the data we just read
-							if r_len <= nb_to_send:
-								_, extra_size = yield '', r_buffer[:length]
-
-								r_buffer = r_buffer[length:]
-								nb_to_send = nb_to_send - length + extra_size
-
-								# we still have data to read before we can send more.
-								if nb_to_send != 0:
-									continue
-
-					if mode == 'chunked':
-						# sum of the sizes of all chunks in our buffer
-						chunked, new_to_send = self.checkChunkSize(r_buffer[nb_to_send:])
-
-						if new_to_send is None:
-							# could not read any chunk (data is invalid)
-							break
-
-						nb_to_send += new_to_send
-						if chunked:
-							continue
-
-						mode = 'end-chunk'
-
-					# seek is only set if we already passed once and found we needed more data to check
-					if mode == 'end-chunk':
-						if r_buffer[nb_to_send:].startswith('\r\n'):
-							nb_to_send += 2
-							processing = True
-							mode = 'transfer'
-							continue
-						elif r_buffer[nb_to_send:].startswith('\n'):
-							nb_to_send += 1
-							processing = True
-							mode = 'transfer'
-							continue
-
-						if not r_buffer[nb_to_send:]:
-							yield '',''
-							continue
+					# the end of the body is handed out with the request which may follow it
+					self.content = r_buffer.take(length)
+					self.mode = mode = 'request'
 
-						mode = 'extra-headers'
-						seek = nb_to_send
+				if mode != 'request':
+					self.log.error('The programmers are monkeys - please give them bananas ..')
+					self.log.error('the mode was spelled : [%s]' % mode)
+					self.log.error('.. if it works, we are lucky - but it may work.')
+					self.mode = 'request'
 
-					if mode == 'extra-headers':
-						# seek is up to where we know there is no double CRLF
-						related, r_buffer, seek = self.checkRequest(r_buffer,max_buffer,seek)
+				# ignore EOL
+				r_buffer.lstrip()
 
-						if related is None:
-							# most likely could not find an header
-							break
+				# check to see if we have read an entire request
+				request = r_buffer.request(self.max_buffer)
 
-						yield '', related
+				if request is None:
+					# most likely could not find an header
+					break
 
-						if not related:
-							continue
+				content = self.content
+				self.content = ''
 
-						seek = 0
-						mode = 'transfer'
+				if not request:
+					return '', content
 
+				self.processing = True
+				self.waiting = DECISION
+				return request, content
 
-					if mode != 'request':
-						self.log.error('The programmers are monkeys - please give them bananas ..')
-						self.log.error('the mode was spelled : [%s]' % mode)
-						self.log.error('.. if it works, we are lucky - but it may work.')
-						mode = 'request'
+		except socket.error, e:
+			if e.args[0] in errno_block:
+				return '', ''
 
-					# ignore EOL
-					r_buffer = r_buffer.lstrip('\r\n')
+		self.waiting = CLOSED
+		return None, None
 
-					# check to see if we have read an entire request
-					request, r_buffer, seek = self.checkRequest(r_buffer, max_buffer, seek)
+	def close (self):
+		self.waiting = CLOSED
 
-					if request is None:
-						# most likely could not find an header
-						break
 
-					if not request:
-						yield '', ''
-						continue
-					seek = 0
-					processing = True
-
-					# nb_to_send is how much we expect to need to get the rest of the request
-					mode, nb_to_send = yield request, ''
+class HTTPClient (object):
+	__slots__ = (
+		'name', 'ipv4', 'sock', 'peer', 'reader', 'writer', 'r_buffer', 'w_buffer',
+		'passthrough', 'log', 'blockupload',
+		'source', 'state', 'buffered', 'corked',
+	)
 
-				# break out of the outer loop as soon as we leave the inner loop
-				# through normal execution
-				break
+	def __init__(self, name, sock, peer, logger, max_buffer, read_budget=0):
+		self.name = name
+		self.ipv4 = isipv4(sock.getsockname()[0])
+		self.sock = sock
+		self.peer = peer
+		self.r_buffer = RequestReader()
+		self.w_buffer = BufferQueue()
+		self.reader = HTTPReader(sock, self.r_buffer, max_buffer, read_budget, logger)
+		self.writer = ResponseWriter(sock, self.w_buffer, self.ipv4, read_budget, logger)
+		self.passthrough = False        # all the client sends is relayed as it is (CONNECT or upgrade)
 
-			except socket.error, e:
-				if e.args[0] in errno_block:
-					yield '', ''
-				else:
-					break
+		self.log = logger
+		self.blockupload = None
 
-		yield None,None
+		# kept by the client manager
+		self.source = None     # the service the client connected to: proxy, web or icap
+		self.state = None      # where the client is in its conversation with us
+		self.buffered = False  # we are waiting for the socket to be writable
+		self.corked = False    # we stopped reading from its web server, too much is waiting to be sent
 
+	@property
+	def pending (self):
+		"""edge triggered: the socket was not read until it would block"""
+		return self.reader.pending
 
 	def setPeer (self, peer):
 		"""Set the claimed ip address for this client.
@@ -268,118 +220,23 @@ class HTTPClient (object):
 		self.peer = peer
 
 	def readData(self):
-		request,content = self.reader.send(('transfer',0))
+		request,content = self.reader.read('transfer',0)
 		return self.name, self.peer, request, '', content
 
 	def readRelated(self, mode, remaining):
 		mode = mode or 'request'
-		request, content = self.reader.send((mode,remaining))
+		self.passthrough = mode == 'passthrough'
+		request, content = self.reader.read(mode,remaining)
 		return self.name, self.peer, request, '', content
 
-	def _write(self, sock):
-		"""Coroutine managing data sent to the client"""
-		filename = yield None
-
-		# check to see if we are returning data directly from a local file
-		if filename is not None:
-			try:
-				# NOTE: we must read from the file on demand rather than doing this
-				with open(filename) as fd:
-					self.w_buffer += fd.read()
-
-				found = True, False, 0, 0
-			except IOError:
-				found = None
-
-			data = yield found
-			self.w_buffer = data + self.w_buffer
-		else:
-			found = None
-
-		data = yield found
-		finished = False
-		w_buffer = self.w_buffer
-
-		while True:
-			try:
-				while True:
-					w_buffer = self.w_buffer
-					had_buffer = bool(w_buffer)
-
-					if data is not None:
-						w_buffer += data
-					else:
-						# We've finished downloading, even if the client hasn't yet
-						finished = True
-
-					if finished:
-						if not w_buffer:
-							break      # terminate the client connection
-						elif data:
-							self.log.error('Tried to send data to client after we told it to close. Dropping it.')
-
-					if not had_buffer or data == '':
-						sent = sock.send(w_buffer)
-						#if sent:
-						#	self.log.debug(">> [%s]" % w_buffer[:sent].replace('\t','\\t').replace('\r','\\r').replace('\n','\\n'))
-						w_buffer = w_buffer[sent:]
-					else:
-						sent = 0
-
-					self.w_buffer = w_buffer
-					buffered = bool(w_buffer) or finished
-					data = yield buffered, had_buffer, sent if self.ipv4 else 0, 0 if self.ipv4 else sent
-
-				# break out of the outer loop as soon as we leave the inner loop
-				# through normal execution
-				yield None
-				break
-
-			except socket.error, e:
-				self.w_buffer = w_buffer
-				if e.args[0] in errno_block:
-					self.log.debug('interrupted when trying to sent %d bytes, fine, will retry' % len(data))
-					self.log.debug('reason: errno %d: %s' % (e.args[0], errno.errorcode.get(e.args[0], '<no errno name>')))
-					data = yield bool(w_buffer) or finished, had_buffer, 0, 0
-				else:
-					self.log.debug('handled an unexpected error writing on socket')
-					self.log.debug('reason, errno %d: %s' % (e.args[0], errno.errorcode.get(e.args[0], '<no errno name>')))
-					yield None  # stop the client connection
-					break  # and don't come back
-
-		yield None
-
 	def writeData(self, data):
-		return self.writer.send(data)
-
+		return self.writer.write(data)
 
 	def startData(self, command, data):
-		# start the _write coroutine
-		self.writer.next()
-
-		if command == 'stream':
-			self.writer.send(None)  # no local file
-			res = self.writer.send(data)
-
-		elif command == 'close':
-			self.writer.send(None)  # no local file
-			self.writer.send(data)
-			res = self.writer.send(None)  # close the connection once the buffer is empty
-
-		elif command == 'file':
-			header, filename = data
-			res = self.writer.send(filename)  # use local file
-			self.writer.send(header)  # write the response headers before the file
-
-			self.writer.send(None)  # close the connection once the buffer is empty
-		else:
-			res = None
-
 		# buffered, had_buffer
-		return res
+		return self.writer.start(command, data)
 
 	def restartData(self, command, data):
-		self.writer = self._write(self.sock)
 		return self.startData(command, data)
 
 	def shutdown(self):
@@ -7,267 +7,221 @@ Copyright (c) 2011-2013  Exa Networks. All rights reserved.
 """
 
 import socket
-import errno
 
 from exaproxy.network.functions import isipv4
 from exaproxy.network.errno_list import errno_block
+from exaproxy.network.buffer import BufferQueue
+from .reader import RequestReader, ChunkedReader
+from .reader import READING, BODY, DECISION, CLOSED
+from .writer import ResponseWriter
 
-def ishex (s):
-	return bool(s) and not bool(s.strip('0123456789abcdefABCDEF'))
 
-def count_quotes (data):
-	return data.count('"') - data.count('\\"')
+class ICAPReader (object):
+	"""The requests of an ICAP client, and what follows them, read as they arrive
 
-class ICAPClient (object):
-	eor = ['\r\n\r\n', '\n\n']
+	read returns (icap_request, request, content): the next ICAP request and
+	the HTTP request it carries, with the end of the body of the one before
+	it, or '', '' and the part of a body read, or None once the connection can
+	not be used. After a request, the next read is given what follows it."""
 
-	def __init__(self, name, sock, peer, logger, max_buffer):
-		self.name = name
-		self.ipv4 = isipv4(sock.getsockname()[0])
-		self.sock = sock
-		self.peer = peer
-		self.reader = self._read(sock,max_buffer)
-		self.writer = self._write(sock)
-		self.w_buffer = ''
+	__slots__ = (
+		'sock', 'r_buffer', 'max_buffer', 'read_budget', 'log', 'pending',
+		'waiting', 'mode', 'nb_to_send', 'processing', 'content', 'chunked', 'icap_request',
+	)
 
+	def __init__ (self, sock, r_buffer, max_buffer, read_budget, logger):
+		self.sock = sock
+		self.r_buffer = r_buffer
+		self.max_buffer = max_buffer
+		self.read_budget = read_budget  # edge triggered: read until it would block, up to this many bytes
+		self.pending = False            # edge triggered: the socket was not read until it would block
 		self.log = logger
-		self.blockupload = None
-
-		# start the _read coroutine
-		self.reader.next()
 
-	def checkRequest (self, r_buffer, size, seek=0):
-		for eor in self.eor:
-			pos = r_buffer[seek:].find(eor)
-			if pos == -1: continue
-
-			buff = r_buffer[:seek+pos]
-			if not buff: continue
+		# mode can be one of : icap, request, chunked, transfer, passthrough
+		# icap : we are reading the icap headers
+		# request : we are reading the request (read all you can until a separator)
+		# chunked : we are reading chunk-encoded data, until the last chunk and the trailer
+		# transfer : we are reading as much as requested in remaining
+		# passthrough : read as much as can to be relayed
 
-			if not count_quotes(buff) % 2:  # we have matching pairs
-				return buff + eor, r_buffer[seek+pos+len(eor):], seek
+		self.waiting = READING
+		self.mode = 'icap'
+		self.nb_to_send = 0      # bytes of the body still to read (transfer)
+		self.processing = False  # what we have is parsed before reading more
+		self.content = ''        # the end of the body of the last request
+		self.chunked = None      # where the chunked body ends (chunked)
+		self.icap_request = ''   # the icap headers of the request we are reading (request)
 
-			seek += pos + len(eor)
+	def _recv (self, sock, r_buffer, read_size):
+		"""Read from the client, until the socket would block if edge triggered"""
+		self.pending = False
+		size = r_buffer.recv(sock, read_size)
 
-		if size and len(r_buffer) > size:
-			return None,None,None
+		if not size or not self.read_budget:
+			return size
 
-		return '', r_buffer, seek
+		received = size
 
+		while received < self.read_budget:
+			try:
+				size = r_buffer.recv(sock, read_size)
+			except socket.error, e:
+				if e.args[0] not in errno_block:
+					self.pending = True  # the error will be seen by the next read
+				break
 
-	def checkChunkSize (self, r_buffer):
-		# return a tuple : bool, length
-		# * the bool is : is there more chunk to come
-		# * the len contains the size of the chunk(s) extracted
-		#   a size of None means that we could not decode as it is invalid
+			if not size:
+				self.pending = True  # the connection close will be seen by the next read
+				break
 
-		total_len = 0
+			received += size
+		else:
+			self.pending = True
 
-		while r_buffer:
-			if not '\n' in r_buffer:
-				if len(r_buffer) > 6:  # len('FFFF') + len(\r\n)
-					return True, None
-				return True, 0
+		return received
 
-			header,r_buffer = r_buffer.split('\n', 1)
-			len_header = len(header) + 1
+	def read (self, mode, remaining, read_size=64*1024):
+		waiting = self.waiting
 
-			if header.endswith('\r'):
-				header = header[:-1]
-				len_eol = 2
-			else:
-				len_eol = 1
+		if waiting == DECISION:
+			# remaining is how much we expect to need to get the rest of the request
+			self.mode = mode
+			self.nb_to_send = remaining
 
-			if ';' in header:
-				header = header.split(';',1)[0]
+			if mode == 'chunked':
+				self.chunked = ChunkedReader()
 
-			if not ishex(header):
-				return True,None
+		elif waiting == BODY:
+			self.nb_to_send += remaining
 
-			len_chunk = int(header, 16)
+		elif waiting == CLOSED:
+			return None, None, None
 
-			# 0xFFFF is not enough - coad is complaining :p
-			if len_chunk > 0x100000:
-				return True,None
+		self.waiting = READING
+		r_buffer = self.r_buffer
 
-			if len_chunk == 0:
-				total_len += len_header
-				return False, total_len
-			else:
-				total = len_chunk + len_eol
-				total_len += total + len_header
-				r_buffer = r_buffer[total:]
+		try:
+			while True:
+				if not self.processing:
+					size = self._recv(self.sock, r_buffer, read_size)
+					if not size:
+						break  # read failed so we abort
+					self.log.debug("<< [%s]" % r_buffer.tail(size).replace('\t','\\t').replace('\r','\\r').replace('\n','\\n'))
+				else:
+					self.processing = False
 
-		return True,total_len
+				mode = self.mode
 
+				if mode == 'passthrough':
+					return '', '', r_buffer.take(len(r_buffer))
 
-	def _read (self, sock, max_buffer, read_size=64*1024):
-		"""Coroutine managing data read from the client"""
-		# yield request, content
-		# request is the text that form the request header
-		# content any text which is related to the current request after the headers
+				if self.nb_to_send:
+					if mode == 'transfer' :
+						length = min(len(r_buffer), self.nb_to_send)
 
-		yield ''
+						# we still have data to read before we can send more.
+						if length < self.nb_to_send:
+							self.nb_to_send -= length
+							self.waiting = BODY
+							return '', '', r_buffer.take(length)
 
-		r_buffer = ''
-		nb_to_send = 0
-		seek = 0
-		processing = False
+						# the end of the body is handed out with the request which may follow it
+						self.content = r_buffer.take(length)
+						self.nb_to_send = 0
+						self.mode = mode = 'icap'
 
-		# mode can be one of : request, chunk, extension, relay
-		# icap : we are reading the icap headers
-		# request : we are reading the request (read all you can until a separator)
-		# extra-headers : we are reading data until a separator
-		# chunked : we are reading chunk-encoded darta
-		# transfer : we are reading as much as requested in remaining
-		# passthrough : read as much as can to be relayed
+				if mode == 'chunked':
+					# decode what we received, each byte only once
+					length = self.chunked.decode(r_buffer)
 
-		mode = 'icap'
+					if length is None:
+						# could not read any chunk (data is invalid)
+						break
 
-		while True:
-			try:
-				while True:
-					if not processing:
-						data = sock.recv(read_size)
-						if not data:
-							break  # read failed so we abort
-						self.log.debug("<< [%s]" % data.replace('\t','\\t').replace('\r','\\r').replace('\n','\\n'))
-						r_buffer += data
-					else:
-						processing = False
-
-					if mode == 'passthrough':
-						yield '', '', r_buffer
-						r_buffer = ''
+					if not self.chunked.done:
+						if length:
+							return '', '', r_buffer.take(length)
 						continue
 
-					if nb_to_send:
-						if mode == 'transfer' :
-							r_len = len(r_buffer)
-							length = min(r_len, nb_to_send)
-
-							# do not yield yet if we are chunked since the end of the chunk may
-							# very well be in the rest of the data we just read
-							_, extra_size = yield '', '', r_buffer[:length]
-
-							r_buffer = r_buffer[length:]
-							nb_to_send = nb_to_send - length + extra_size
-
-							# we still have data to read before we can send more.
-							if nb_to_send != 0:
-								continue
-							mode = 'icap'
-
-						if mode == 'chunked':
-							r_len = len(r_buffer)
-							length = min(r_len, nb_to_send)
-
-							# do not yield yet if we are chunked since the end of the chunk may
-							# very well be in the rest of the data we just read
-							if r_len <= nb_to_send:
-								_, extra_size = yield '', '', r_buffer[:length]
-
-								r_buffer = r_buffer[length:]
-								nb_to_send = nb_to_send - length + extra_size
-
-								# we still have data to read before we can send more.
-								if nb_to_send != 0:
-									continue
-
-					if mode == 'chunked':
-						# sum of the sizes of all chunks in our buffer
-						chunked, new_to_send = self.checkChunkSize(r_buffer[nb_to_send:])
-
-						if new_to_send is None:
-							# could not read any chunk (data is invalid)
-							break
-
-						nb_to_send += new_to_send
-						if chunked:
-							continue
-
-						mode = 'end-chunk'
+					# the end of the body is handed out with the request which may follow it
+					self.content = r_buffer.take(length)
+					self.mode = mode = 'icap'
 
-					# seek is only set if we already passed once and found we needed more data to check
-					if mode == 'end-chunk':
-						if r_buffer[nb_to_send:].startswith('\r\n'):
-							nb_to_send += 2
-							processing = True
-							mode = 'transfer'
-							continue
-						elif r_buffer[nb_to_send:].startswith('\n'):
-							nb_to_send += 1
-							processing = True
-							mode = 'transfer'
-							continue
+				if mode not in ('icap', 'request'):
+					self.log.error('The programmers are monkeys - please give them bananas ..')
+					self.log.error('the mode was spelled : [%s]' % mode)
+					self.log.error('.. if it works, we are lucky - but it may work.')
+					self.mode = mode = 'icap'
 
-						if not r_buffer[nb_to_send:]:
-							yield '','',''
-							continue
+				# ignore EOL
+				r_buffer.lstrip()
 
-						mode = 'extra-headers'
-						seek = nb_to_send
+				# check to see if we have read an entire request
+				request = r_buffer.request(self.max_buffer)
 
-					if mode == 'extra-headers':
-						# seek is up to where we know there is no double CRLF
-						related, r_buffer, seek = self.checkRequest(r_buffer,max_buffer,seek)
-
-						if related is None:
-							# most likely could not find an header
-							break
+				if request is None:
+					# most likely could not find an header
+					break
 
-						yield '', '', related
+				if request and mode == 'icap':
+					self.icap_request = request
+					request = r_buffer.request(self.max_buffer)
+					self.mode = 'request'
 
-						if not related:
-							continue
+				content = self.content
+				self.content = ''
 
-						seek = 0
-						mode = 'transfer'
+				if not request:
+					return '', '', content
 
-					if mode not in ('icap', 'request'):
-						self.log.error('The programmers are monkeys - please give them bananas ..')
-						self.log.error('the mode was spelled : [%s]' % mode)
-						self.log.error('.. if it works, we are lucky - but it may work.')
-						mode = 'icap'
+				icap_request = self.icap_request
+				self.icap_request = ''
 
-					# ignore EOL
-					r_buffer = r_buffer.lstrip('\r\n')
+				self.processing = True
+				self.waiting = DECISION
+				return icap_request, request, content
 
-					# check to see if we have read an entire request
-					request, r_buffer, seek = self.checkRequest(r_buffer, max_buffer, seek)
+		except socket.error, e:
+			if e.args[0] in errno_block:
+				return '', '', ''
 
-					if request is None:
-						# most likely could not find an header
-						break
+		self.waiting = CLOSED
+		return None, None, None
 
-					if request and mode == 'icap':
-						icap_request = request
-						request, r_buffer, seek = self.checkRequest(r_buffer, max_buffer, 0)
-						mode = 'request'
-
-					if not request:
-						yield '', '', ''
-						continue
+	def close (self):
+		self.waiting = CLOSED
 
-					seek = 0
-					processing = True
 
-					# nb_to_send is how much we expect to need to get the rest of the request
-					mode, nb_to_send = yield icap_request, request, ''
-					icap_request = ''
+class ICAPClient (object):
+	__slots__ = (
+		'name', 'ipv4', 'sock', 'peer', 'reader', 'writer', 'r_buffer', 'w_buffer',
+		'log', 'blockupload',
+		'source', 'state', 'buffered', 'corked',
+	)
 
-				# break out of the outer loop as soon as we leave the inner loop
-				# through normal execution
-				break
+	def __init__(self, name, sock, peer, logger, max_buffer, read_budget=0):
+		self.name = name
+		self.ipv4 = isipv4(sock.getsockname()[0])
+		self.sock = sock
+		self.peer = peer
+		self.r_buffer = RequestReader()
+		self.w_buffer = BufferQueue()
+		self.reader = ICAPReader(sock, self.r_buffer, max_buffer, read_budget, logger)
+		self.writer = ResponseWriter(sock, self.w_buffer, self.ipv4, read_budget, logger)
 
-			except socket.error, e:
-				if e.args[0] in errno_block:
-					yield '', '', ''
-				else:
-					break
+		self.log = logger
+		self.blockupload = None
 
-		yield None,None,None
+		# kept by the client manager
+		self.source = None     # the service the client connected to: proxy, web or icap
+		self.state = None      # where the client is in its conversation with us
+		self.buffered = False  # we are waiting for the socket to be writable
+		self.corked = False    # we stopped reading from its web server, too much is waiting to be sent
 
+	@property
+	def pending (self):
+		"""edge triggered: the socket was not read until it would block"""
+		return self.reader.pending
 
 	def setPeer (self, peer):
 		"""Set the claimed ip address for this client.
@@ -275,118 +229,22 @@ class ICAPClient (object):
 		self.peer = peer
 
 	def readData(self):
-		icap_header, http_header, content = self.reader.send(('transfer',0))
+		icap_header, http_header, content = self.reader.read('transfer',0)
 		return self.name, self.peer, icap_header, http_header, content
 
 	def readRelated(self, mode, remaining):
 		mode = mode or 'icap'
-		icap_header, http_header, content = self.reader.send((mode,remaining))
+		icap_header, http_header, content = self.reader.read(mode,remaining)
 		return self.name, self.peer, icap_header, http_header, content
 
-	def _write(self, sock):
-		"""Coroutine managing data sent to the client"""
-		filename = yield None
-
-		# check to see if we are returning data directly from a local file
-		if filename is not None:
-			try:
-				# NOTE: we must read from the file on demand rather than doing this
-				with open(filename) as fd:
-					self.w_buffer += fd.read()
-
-				found = True, False, 0, 0
-			except IOError:
-				found = None
-
-			data = yield found
-			self.w_buffer = data + self.w_buffer
-		else:
-			found = None
-
-		data = yield found
-		finished = False
-		w_buffer = self.w_buffer
-
-		while True:
-			try:
-				while True:
-					w_buffer = self.w_buffer
-					had_buffer = bool(w_buffer)
-
-					if data is not None:
-						w_buffer += data
-					else:
-						# We've finished downloading, even if the client hasn't yet
-						finished = True
-
-					if finished:
-						if not w_buffer:
-							break      # terminate the client connection
-						elif data:
-							self.log.error('Tried to send data to client after we told it to close. Dropping it.')
-
-					if not had_buffer or data == '':
-						sent = sock.send(w_buffer)
-						#if sent:
-						#	self.log.debug(">> [%s]" % w_buffer[:sent].replace('\t','\\t').replace('\r','\\r').replace('\n','\\n'))
-						w_buffer = w_buffer[sent:]
-					else:
-						sent = 0
-
-					self.w_buffer = w_buffer
-					buffered = bool(w_buffer) or finished
-					data = yield buffered, had_buffer, sent if self.ipv4 else 0, 0 if self.ipv4 else sent
-
-				# break out of the outer loop as soon as we leave the inner loop
-				# through normal execution
-				yield None
-				break
-
-			except socket.error, e:
-				self.w_buffer = w_buffer
-				if e.args[0] in errno_block:
-					self.log.debug('interrupted when trying to sent %d bytes, fine, will retry' % len(data))
-					self.log.debug('reason: errno %d: %s' % (e.args[0], errno.errorcode.get(e.args[0], '<no errno name>')))
-					data = yield bool(w_buffer) or finished, had_buffer, 0, 0
-				else:
-					self.log.debug('handled an unexpected error writing on socket')
-					self.log.debug('reason, errno %d: %s' % (e.args[0], errno.errorcode.get(e.args[0], '<no errno name>')))
-					yield None  # stop the client connection
-					break  # and don't come back
-
-		yield None
-
 	def writeData(self, data):
-		return self.writer.send(data)
-
+		return self.writer.write(data)
 
 	def startData(self, command, data):
-		# start the _write coroutine
-		self.writer.next()
-
-		if command == 'stream':
-			self.writer.send(None)  # no local file
-			res = self.writer.send(data)
-
-		elif command == 'close':
-			self.writer.send(None)  # no local file
-			self.writer.send(data)
-			res = self.writer.send(None)  # close the connection once the buffer is empty
-
-		elif command == 'file':
-			header, filename = data
-			res = self.writer.send(filename)  # use local file
-			self.writer.send(header)  # write the response headers before the file
-
-			self.writer.send(None)  # close the connection once the buffer is empty
-		else:
-			res = None
-
 		# buffered, had_buffer
-		return res
+		return self.writer.start(command, data)
 
 	def restartData(self, command, data):
-		self.writer = self._write(self.sock)
 		return self.startData(command, data)
 
 	def shutdown(self):
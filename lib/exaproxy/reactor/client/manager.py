@@ -7,89 +7,128 @@ Copyright (c) 2011-2013  Exa Networks. All rights reserved.
 """
 
 from exaproxy.util.log.logger import Logger
-from exaproxy.util.cache import TimeCache
 from .http import HTTPClient
 from .icap import ICAPClient
 
 from exaproxy.http.proxy import ProxyProtocol
 
+# where a client is in its conversation with us
+SILENT = 0    # it did not send its first request yet
+DECIDING = 1  # its first request is being classified, we do not read from it
+SPEAKING = 2  # we answered it, what it sends is read and relayed
+
 class ClientManager (object):
 	unproxy = ProxyProtocol().parseRequest
 
-	def __init__(self, poller, configuration):
+	def __init__(self, poller, configuration, wheel):
 		self.total_sent4 = 0L
 		self.total_sent6 = 0L
 		self.total_requested = 0L
-		self.norequest = TimeCache(configuration.http.idle_connect)
-		self.bysock = {}
-		self.byname = {}
-		self.buffered = []
+		self.total_reused = 0L     # requests which came on a connection already used for another one
+		self.total_pipelined = 0L  # requests which had to wait for the response to the one before
+		self.bysock = {}   # sock : client, whatever its state
+		self.byname = {}   # name : client, whatever its state
+		self.silent = 0    # clients which did not send their first request yet
+		self.waiting = {}  # name : decisions for requests we can only answer once the response before them is complete
 		self._nextid = 0
 		self.poller = poller
+		self.wheel = wheel
 		self.log = Logger('client', configuration.log.client)
+		self.http_idle = configuration.http.idle_connect
+		self.icap_idle = configuration.icap.idle_connect
 		self.proxied = configuration.http.proxied
 		self.http_max_buffer = configuration.http.header_size
 		self.icap_max_buffer = configuration.icap.header_size
+		self.read_budget = configuration.daemon.read_budget if poller.edge else 0
+		self.deferred = 0L  # reads left for the next loop as the client used its read budget
+		self.saved = 0L     # bytes the write queues of the closed clients did not have to copy
+
+		# we stop reading from a web server once more than download_high bytes wait to be sent to its client, and read again at download_low
+		self.download_high = configuration.http.download_high
+		self.download_low = min(configuration.http.download_low, self.download_high)
+		self.corked = 0L    # times we stopped reading from a web server
+		self.uncorked = 0L  # times we read from it again
 
 	def __contains__(self, item):
 		return item in self.byname
 
+	def buffers(self):
+		"""bytes waiting to be sent to the clients, and bytes the write queues did not have to copy"""
+		size, saved = 0, self.saved
+
+		for client in self.byname.itervalues():
+			size += len(client.w_buffer)
+			saved += client.w_buffer.saved
+
+		return size, saved
+
+	def buffered(self):
+		"""the bytes waiting to be sent to each client which has some, by name"""
+		return dict((name, len(client.w_buffer)) for (name, client) in self.byname.iteritems() if client.w_buffer)
+
 	def getnextid(self):
 		self._nextid += 1
 		return str(self._nextid)
 
-	def expire (self,number=100):
-		count = 0
-		for sock in self.norequest.expired(number):
-			client = self.norequest.get(sock,[None,])[0]
-			if client:
-				self.cleanup(sock,client.name)
-				count += 1
+	def expired (self, sock):
+		"""the client did not send its request in time"""
+		client = self.bysock.get(sock, None)
+		if client is not None and client.state == SILENT:
+			self.log.info('client %s did not send a request in time, closing' % client.name)
+			self.cleanup(sock, client.name)
+			return client.source
 
-		return count
+		return None
 
-	def httpConnection (self, sock, peer, source):
-		name = self.getnextid()
-		client = HTTPClient(name, sock, peer, self.log, self.http_max_buffer)
+	def _accept (self, client, source, idle):
+		client.source = source
+		client.state = SILENT
 
-		self.norequest[sock] = client, source
-		self.byname[name] = client, source
+		self.bysock[client.sock] = client
+		self.byname[client.name] = client
+		self.silent += 1
+
+		if idle > 0:
+			self.wheel.schedule(('client', client.sock), idle)
 
 		# watch for the opening request
 		self.poller.addReadSocket('opening_client', client.sock)
 
-		#self.log.info('new id %s (socket %s) in clients : %s' % (name, sock, sock in self.bysock))
+	def httpConnection (self, sock, peer, source):
+		name = self.getnextid()
+		client = HTTPClient(name, sock, peer, self.log, self.http_max_buffer, self.read_budget)
+		self._accept(client, source, self.http_idle)
 		return peer
 
 	def icapConnection (self, sock, peer, source):
 		name = self.getnextid()
-		client = ICAPClient(name, sock, peer, self.log, self.icap_max_buffer)
-	
-		self.norequest[sock] = client, source
-		self.byname[name] = client, source
-
-		# watch for the opening request
-		self.poller.addReadSocket('opening_client', client.sock)
-
-		#self.log.info('new id %s (socket %s) in clients : %s' % (name, sock, sock in self.bysock))
+		client = ICAPClient(name, sock, peer, self.log, self.icap_max_buffer, self.read_budget)
+		self._accept(client, source, self.icap_idle)
 		return peer
 
 	def readRequest (self, sock):
 		"""Read only the initial HTTP headers sent by the client"""
 
-		client, source = self.norequest.get(sock, (None, None))
-		if client:
+		client = self.bysock.get(sock, None)
+		if client is not None and client.state == SILENT:
+			source = client.source
 			name, peer, request, subrequest, content = client.readData()
 			if request:
 				self.total_requested += 1
 				# headers can be read only once
-				self.norequest.pop(sock, (None, None))
+				client.state = DECIDING
+				self.silent -= 1
+				self.wheel.cancel(('client', sock))
 
 				# we have now read the client's opening request
 				self.poller.removeReadSocket('opening_client', client.sock)
 
 			elif request is None:
 				self.cleanup(sock, client.name)
+
+			elif client.pending:
+				self.deferred += 1
+				self.poller.rearmReadSocket('opening_client', client.sock)
 		else:
 			self.log.error('trying to read headers from a client that does not exist %s' % sock)
 			name, peer, request, subrequest, content, source = None, None, None, None, None, None
@@ -106,11 +145,13 @@ class ClientManager (object):
 
 
 	def readDataBySocket(self, sock):
-		client, source = self.bysock.get(sock, (None, None))
-		if client:
+		client = self.bysock.get(sock, None)
+		if client is not None and client.state == SPEAKING:
+			source = client.source
 			name, peer, request, subrequest, content = client.readData()
 			if request:
 				self.total_requested += 1
+				self.total_reused += 1
 				# Parsing of the new request will be handled asynchronously. Ensure that
 				# we do not read anything from the client until a request has been sent
 				# to the remote webserver.
@@ -120,20 +161,25 @@ class ClientManager (object):
 
 			elif request is None:
 				self.cleanup(sock, client.name)
+
+			elif client.pending:
+				self.deferred += 1
+				self.poller.rearmReadSocket('read_client', sock)
 		else:
 			self.log.error('trying to read from a client that does not exist %s' % sock)
-			name, peer, request, subrequest, content = None, None, None, None, None
+			name, peer, request, subrequest, content, source = None, None, None, None, None, None
 
 
 		return name, peer, request, subrequest, content, source
 
 
 	def readDataByName(self, name):
-		client, source = self.byname.get(name, (None, None))
+		client = self.byname.get(name, None)
 		if client:
 			name, peer, request, subrequest, content = client.readData()
 			if request:
 				self.total_requested += 1
+				self.total_reused += 1
 				# Parsing of the new request will be handled asynchronously. Ensure that
 				# we do not read anything from the client until a request has been sent
 				# to the remote webserver.
@@ -143,6 +189,10 @@ class ClientManager (object):
 
 			elif request is None:
 				self.cleanup(client.sock, name)
+
+			elif client.pending:
+				self.deferred += 1
+				self.poller.rearmReadSocket('read_client', client.sock)
 		else:
 			self.log.error('trying to read from a client that does not exist %s' % name)
 			name, peer, request, subrequest, content = None, None, None, None, None
@@ -151,53 +201,37 @@ class ClientManager (object):
 		return name, peer, request, subrequest, content
 
 	def sendDataBySocket(self, sock, data):
-		client, source = self.bysock.get(sock, (None, None))
+		client = self.bysock.get(sock, None)
 		if client:
 			name = client.name
+			source = client.source
 			res = client.writeData(data)
 
 			if res is None:
 				# close the client connection
 				self.cleanup(sock, client.name)
 
-				buffered, had_buffer, sent4, sent6 = None, None, 0, 0
 				result = None
 				buffer_change = None
 			else:
 				buffered, had_buffer, sent4, sent6 = res
 				self.total_sent4 += sent4
 				self.total_sent6 += sent6
-				result = buffered
-
-
-			if buffered:
-				if sock not in self.buffered:
-					self.buffered.append(sock)
-					buffer_change = True
-
-					# watch for the socket's send buffer becoming less than full
-					self.poller.addWriteSocket('write_client', client.sock)
-				else:
-					buffer_change = False
 
-			elif had_buffer and sock in self.buffered:
-				self.buffered.remove(sock)
-				buffer_change = True
+				self._writing(client, buffered, had_buffer)
 
-				# we no longer care about writing to the client
-				self.poller.removeWriteSocket('write_client', client.sock)
-
-			else:
-				buffer_change = False
+				buffer_change = self._throttle(client)
+				result = client.corked
 		else:
 			result = None
 			buffer_change = None
 			name = None
+			source = None
 
 		return result, buffer_change, name, source
 
 	def sendDataByName(self, name, data):
-		client, source = self.byname.get(name, (None, None))
+		client = self.byname.get(name, None)
 		if client:
 			res = client.writeData(data)
 
@@ -205,40 +239,62 @@ class ClientManager (object):
 				# we cannot write to the client so clean it up
 				self.cleanup(client.sock, name)
 
-				buffered, had_buffer, sent4, sent6 = None, None, 0, 0
 				result = None
 				buffer_change = None
 			else:
 				buffered, had_buffer, sent4, sent6 = res
 				self.total_sent4 += sent4
 				self.total_sent6 += sent6
-				result = buffered
-
-			if buffered:
-				if client.sock not in self.buffered:
-					self.buffered.append(client.sock)
-					buffer_change = True
 
-					# watch for the socket's send buffer becoming less than full
-					self.poller.addWriteSocket('write_client', client.sock)
-				else:
-					buffer_change = False
-
-			elif had_buffer and client.sock in self.buffered:
-				self.buffered.remove(client.sock)
-				buffer_change = True
-
-				# we no longer care about writing to the client
-				self.poller.removeWriteSocket('write_client', client.sock)
+				self._writing(client, buffered, had_buffer)
 
-			else:
-				buffer_change = False
+				# corked again if it already was, the response may come from another connection than the last one
+				buffer_change = self._throttle(client) or client.corked
+				result = client.corked
 		else:
 			result = None
 			buffer_change = None
 
 		return result, buffer_change, client
 
+	def _writing(self, client, buffered, had_buffer):
+		"""watch the socket of the client for writes while we have something to send it"""
+		if buffered:
+			if not client.buffered:
+				client.buffered = True
+
+				# watch for the socket's send buffer becoming less than full
+				self.poller.addWriteSocket('write_client', client.sock)
+
+			if not client.w_buffer:
+				# only the close is left, edge triggered pollers would not report the socket again
+				self.poller.rearmWriteSocket('write_client', client.sock)
+
+		elif had_buffer and client.buffered:
+			client.buffered = False
+
+			# we no longer care about writing to the client
+			self.poller.removeWriteSocket('write_client', client.sock)
+
+	def _throttle(self, client):
+		"""True if the web server of the client is to be corked or uncorked, using what is left to send to the client"""
+		size = len(client.w_buffer)
+
+		if client.corked:
+			if size > self.download_low:
+				return False
+
+			client.corked = False
+			self.uncorked += 1
+			return True
+
+		if size <= self.download_high:
+			return False
+
+		client.corked = True
+		self.corked += 1
+		return True
+
 
 	def startData(self, name, data, remaining):
 		# NOTE: soo ugly but fast to code
@@ -256,23 +312,26 @@ class ClientManager (object):
 		else:
 			mode = 'passthrough'
 
-		client, source = self.byname.get(name, (None, None))
+		client = self.byname.get(name, None)
 		if client:
+			source = client.source
 			try:
 				command, d = data
 			except (ValueError, TypeError):
 				self.log.error('invalid command sent to client %s' % name)
 				res = None
 			else:
-				if client.sock not in self.bysock:
+				if client.state != SPEAKING:
+					# make sure we don't somehow count it as silent still
+					if client.state == SILENT:
+						self.silent -= 1
+
 					# Start checking for content sent by the client
-					self.bysock[client.sock] = client, source
+					client.state = SPEAKING
 
 					# watch for the client sending new data
 					self.poller.addReadSocket('read_client', client.sock)
-
-					# make sure we don't somehow end up with this still here
-					self.norequest.pop(client.sock, (None,None))
+					self.wheel.cancel(('client', client.sock))
 
 					# NOTE: always done already in readRequest
 					self.poller.removeReadSocket('opening_client', client.sock)
@@ -294,10 +353,10 @@ class ClientManager (object):
 				name, peer, request, subrequest, content = client.readRelated(mode,nb_to_read)
 				if request:
 					self.total_requested += 1
-					self.log.info('reading multiple requests')
-					self.cleanup(client.sock, name)
-					buffered, had_buffer = None, None
-					content = None
+					self.total_reused += 1
+					# a pipelined request, it can be classified while we answer this one
+					# but we do not read anything more from the client until it is answered
+					self.poller.corkReadSocket('read_client', client.sock)
 
 				elif request is None:
 					self.cleanup(client.sock, name)
@@ -309,70 +368,94 @@ class ClientManager (object):
 				self.cleanup(client.sock, name)
 
 				buffered, had_buffer = None, None
-				content = None
+				peer, request, subrequest, content = None, None, None, None
 
 			if buffered:
-				if client.sock not in self.buffered:
-					self.buffered.append(client.sock)
+				if not client.buffered:
+					client.buffered = True
 
 					# watch for the socket's send buffer becoming less than full
 					self.poller.addWriteSocket('write_client', client.sock)
 
-			elif had_buffer and client.sock in self.buffered:
-				self.buffered.remove(client.sock)
+			elif had_buffer and client.buffered:
+				client.buffered = False
 
 				# we no longer care about writing to the client
 				self.poller.removeWriteSocket('write_client', client.sock)
 		else:
-			content = None
+			peer, request, subrequest, content, source = None, None, None, None, None
+
+		return client, peer, request, subrequest, content, source
+
+	def wait(self, name, decision):
+		"""keep the decision until the response to the request before it is complete"""
+		self.total_pipelined += 1
+		self.waiting.setdefault(name, []).append(decision)
 
-		return client, content, source
+	def release(self, name):
+		"""the decisions kept for the client, in the order the requests were made"""
+		return self.waiting.pop(name, [])
 
 
+	def relayable(self, name):
+		"""the client, if all it sends is relayed as it is and we have nothing of it left to send"""
+		client = self.byname.get(name, None)
+		if client is None or client.source != 'proxy' or not client.passthrough:
+			return None
+
+		if client.state != SPEAKING or client.buffered:
+			return None
+
+		if client.w_buffer or client.r_buffer:
+			return None
+
+		return client
+
 	def corkUploadByName(self, name):
-		client, source = self.byname.get(name, (None, None))
+		client = self.byname.get(name, None)
 		if client:
 			self.poller.corkReadSocket('read_client', client.sock)
 
 	def uncorkUploadByName(self, name):
-		client, source = self.byname.get(name, (None, None))
+		client = self.byname.get(name, None)
 		if client:
-			if client.sock in self.bysock:
+			if client.state == SPEAKING:
 				self.poller.uncorkReadSocket('read_client', client.sock)
 
 	def cleanup(self, sock, name):
 		self.log.debug('cleanup for socket %s' % sock)
-		client, source = self.bysock.get(sock, (None,None))
-		client, source = (client,None) if client else self.norequest.get(sock, (None,None))
-		client, source = (client,None) if client else self.byname.get(name, (None,None))
+		client = self.bysock.pop(sock, None)
+		client = self.byname.pop(name, None) or client
 
-		self.bysock.pop(sock, None)
-		self.norequest.pop(sock, (None,None))
-		self.byname.pop(name, None)
+		self.waiting.pop(name, None)
+		self.wheel.cancel(('client', sock))
 
 		if client:
+			if client.state == SILENT:
+				self.silent -= 1
+
+			client.state = None
+			client.buffered = False
+
 			self.poller.removeWriteSocket('write_client', client.sock)
 			self.poller.removeReadSocket('read_client', client.sock)
 			self.poller.removeReadSocket('opening_client', client.sock)
 
+			self.saved += client.w_buffer.saved
 			client.shutdown()
 		else:
 			self.log.error('COULD NOT CLEAN UP SOCKET %s' % sock)
 
-		if sock in self.buffered:
-			self.buffered.remove(sock)
-
 	def softstop (self):
-		if len(self.byname) > 0 or len(self.norequest) > 0:
+		if len(self.byname) > 0:
 			return False
 		self.log.critical('no more client connection, exiting.')
 		return True
 
 	def stop(self):
-		for client, source in self.bysock.itervalues():
-			client.shutdown()
-
-		for client, source in self.norequest.itervalues():
+		for client in self.byname.itervalues():
+			if client.state == SILENT:
+				self.wheel.cancel(('client', client.sock))
 			client.shutdown()
 
 		self.poller.clearRead('read_client')
@@ -380,6 +463,6 @@ class ClientManager (object):
 		self.poller.clearWrite('write_client')
 
 		self.bysock = {}
-		self.norequest = {}
 		self.byname = {}
-		self.buffered = []
+		self.silent = 0
+		self.waiting = {}
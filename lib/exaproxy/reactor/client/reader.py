@@ -0,0 +1,325 @@
+# encoding: utf-8
+"""
+reader.py
+
+Created by agent on 2026-10-17.
+Copyright (c) 2011-2013  Exa Networks. All rights reserved.
+"""
+
+# what the buffers of the clients are extended with, to make room for what is received
+_zeros = memoryview('\0' * (64*1024))
+
+# http://tools.ietf.org/html/rfc7230#section-4.1
+
+MAX_CHUNK = 0x100000  # the largest chunk we accept (0xFFFF is not enough - coad is complaining :p)
+MAX_LINE = 4*1024     # the longest chunk size or trailer line we accept
+SMALL = 1024          # chunks up to this size are likely followed by others read with them
+WINDOW = 16*1024      # how much data after a small chunk is looked at for the next ones
+
+SIZE = 0      # reading the size line of a chunk (and its extensions)
+DATA = 1      # reading the data of a chunk
+DATA_END = 2  # reading the end of line after the data of a chunk
+TRAILER = 3   # reading the trailer after the last chunk
+DONE = 4      # the body is complete
+
+# where the request readers of the clients are between two reads
+READING = 0   # reading what the client sends
+BODY = 1      # a part of a body was handed out, the next read can make the body longer
+DECISION = 2  # a request was handed out, the next read says what follows it
+CLOSED = 3    # the connection can not be used anymore
+
+
+class RequestReader (object):
+	"""Data received from a client, waiting to be parsed and handed out
+
+	Data is received with recv_into in the free space at the end of a
+	bytearray, which is consumed from the front. The positions already
+	searched are remembered, so each byte is only scanned once for the end
+	of the headers (or for a chunk size) however many segments they arrive
+	in. What is handed out is copied once, as str, the type the rest of the
+	proxy works on: a memoryview would stop the bytearray from being resized
+	for as long as it is kept, and the write queues pass str to writev."""
+
+	compact = 64*1024  # consumed bytes kept at the front of the buffer before they are released
+	keep = 16*1024     # free space kept once everything was handed out, more is released (idle clients)
+	room = 4*1024      # the least free space we receive into
+
+	def __init__ (self):
+		self.data = bytearray()
+		self.start = 0     # the first byte not handed out
+		self.end = 0       # the end of what was received, the rest of data is free space
+		self.wanted = self.room  # the free space the next recv would like
+		self.scanned = 0   # up to where we know the headers do not end (from start)
+		self.counted = 0   # up to where we counted the quotes of the headers (from start)
+		self.quotes = 0    # how many quotes we counted
+
+	def __len__ (self):
+		return self.end - self.start
+
+	def recv (self, sock, size):
+		"""receive at most size bytes from sock, returns how many (0 if the connection was closed)"""
+		data = self.data
+		end = self.end
+		free = len(data) - end
+
+		# the room made follows what the client sends, an idle client does not keep size bytes around
+		wanted = self.wanted if self.wanted < size else size
+		if free < wanted >> 1 or not free:
+			missing = wanted - free
+			data.extend(_zeros[:missing] if missing <= len(_zeros) else '\0' * missing)
+			free = wanted
+
+		if free > size:
+			free = size
+
+		received = sock.recv_into(memoryview(data)[end:] if end else data, free)
+		self.end = end + received
+
+		# when all the room was used, more is most likely waiting
+		self.wanted = size if received == free else received << 1 if received > self.room >> 1 else self.room
+		return received
+
+	def feed (self, received):
+		"""add data received by other means (tests and benchmarks)"""
+		del self.data[self.end:]
+		self.data += received
+		self.end = len(self.data)
+
+	def tail (self, size):
+		"""the last size bytes received, as str"""
+		return buffer(self.data, self.end - size, size)[:] if size else ''
+
+	def take (self, size):
+		"""remove and return the first size bytes, as str"""
+		data = self.data
+		start = self.start
+		end = start + size
+
+		if end >= self.end:
+			taken = buffer(data, start, self.end - start)[:]
+			self.start = 0
+			self.end = 0
+			if len(data) > self.keep:
+				del data[:]
+		else:
+			taken = buffer(data, start, size)[:]
+			self.start = end
+
+			if end >= self.compact:
+				del data[:end]
+				self.start = 0
+				self.end -= end
+
+		scanned = self.scanned - size
+		counted = self.counted - size
+		self.scanned = scanned if scanned > 0 else 0
+		self.counted = counted if counted > 0 else 0
+		return taken
+
+	def startswith (self, prefix, offset=0):
+		start = self.start + offset
+		return self.data[start:min(start+len(prefix), self.end)] == prefix
+
+	def lstrip (self):
+		"""skip the end of lines left before a new request"""
+		data = self.data
+		start = self.start
+		end = self.end
+
+		while start < end and data[start] in (10, 13):
+			start += 1
+
+		if start != self.start:
+			self.take(start - self.start)
+
+	def seek (self, offset):
+		"""look for the end of the headers from offset, what is before it is part of what request returns"""
+		# the line ending the data before the headers may be the one before an empty line
+		self.scanned = max(0, offset - 1)
+		self.counted = offset
+		self.quotes = 0
+
+	def request (self, size=0):
+		"""the headers up to and including the empty line ending them, '' if incomplete, None if larger than size"""
+		data = self.data
+		start = self.start
+		end = self.end
+
+		position = start + self.scanned
+
+		while True:
+			# an empty line is either \n\n or \n\r\n
+			lf = data.find('\n\n', position, end)
+			crlf = data.find('\n\r\n', position, end)
+
+			if lf == -1 and crlf == -1:
+				break
+
+			if crlf == -1 or (lf != -1 and lf < crlf):
+				eol, length = lf, 2
+			else:
+				eol, length = crlf, 3
+
+			# the end of the headers, if our quotes are matching pairs
+			counted = start + self.counted
+			if eol > counted:
+				self.quotes += data.count('"', counted, eol) - data.count('\\"', counted, eol)
+				self.counted = eol - start
+
+			if not self.quotes % 2:
+				self.seek(0)
+				return self.take(eol + length - start)
+
+			position = eol + 1
+
+		# the end of the headers may be split between what we have and what is coming
+		self.scanned = max(position - start, end - start - 2)
+
+		if size and end - start > size:
+			return None
+
+		return ''
+
+
+def _small (data, position, end):
+	"""where the chunks read in full from position end
+
+	Uploads made of small chunks carry many of them in each read, their
+	size lines are parsed from one str copy of what follows. Anything else
+	(the last chunk, a line ending with \\n alone, a chunk not read yet) is
+	left to decode."""
+	window = str(data[position:min(end, position + WINDOW)])
+	offset = 0
+
+	while True:
+		eol = window.find('\n', offset)
+		if eol <= offset or window[eol-1] != '\r':
+			break
+
+		size = window[offset:eol-1]
+		if ';' in size:
+			# the extensions may follow some white space
+			size = size.partition(';')[0].rstrip(' \t')
+
+		if not size or size.strip('0123456789abcdefABCDEF'):
+			break
+
+		remaining = int(size, 16)
+		if not remaining or remaining > MAX_CHUNK:
+			break
+
+		after = eol + 1 + remaining
+		if window[after:after+2] != '\r\n':
+			break
+
+		offset = after + 2
+
+	return position + offset
+
+
+class ChunkedReader (object):
+	"""Where a chunked request body ends, in the data of a RequestReader
+
+	The data is decoded in place, by offset, and only once: chunk data is
+	skipped by counting, only the size lines (whose extensions are ignored)
+	and the trailer are looked at. Everything decoded is part of the body
+	and can be handed out as it is, but for a line not yet complete which
+	is left in the reader, with how much of it was already searched."""
+
+	def __init__ (self):
+		self.state = SIZE
+		self.remaining = 0  # bytes of the chunk data still to come
+		self.scanned = 0    # bytes of the line left in the reader which have no end of line
+
+	@property
+	def done (self):
+		return self.state == DONE
+
+	def decode (self, reader):
+		"""how many bytes at the front of reader are part of the body, None if it is invalid"""
+		start = reader.start
+		end = reader.end
+
+		# small segments mostly arrive in the middle of the data of a large chunk
+		if self.state == DATA and end - start < self.remaining:
+			self.remaining -= end - start
+			return end - start
+
+		data = reader.data
+		position = start
+		state = self.state
+
+		scanned = self.scanned
+		plain = True  # the small chunks may have no extension
+
+		while position < end and state != DONE:
+			if state == DATA:
+				available = end - position
+				if available < self.remaining:
+					self.remaining -= available
+					position = end
+					break
+
+				position += self.remaining
+				self.remaining = 0
+				state = DATA_END
+				continue
+
+			eol = data.find('\n', position + scanned, end)
+			if eol == -1:
+				scanned = end - position
+				if scanned > MAX_LINE:
+					return None
+				break
+
+			line = position
+			position = eol + 1
+			scanned = 0
+
+			if state == SIZE:
+				size = str(data[line:eol-1 if eol > line and data[eol-1] == 13 else eol])
+				if ';' in size:
+					# the extensions may follow some white space
+					size = size.partition(';')[0].rstrip(' \t')
+
+				if not size or size.strip('0123456789abcdefABCDEF'):
+					return None
+
+				remaining = int(size, 16)
+				if remaining > MAX_CHUNK:
+					return None
+
+				if not remaining:
+					state = TRAILER
+					continue
+
+				# most of the time, the data and the end of line after it were read with the size
+				after = position + remaining
+				if after + 2 <= end and data[after] == 13 and data[after+1] == 10:
+					position = after + 2
+					if remaining <= SMALL and plain:
+						# once a copy was made for nothing, do not make it again with this data
+						after = _small(data, position, end)
+						plain = after > position
+						position = after
+					continue
+
+				self.remaining = remaining
+				state = DATA
+
+			# the line must be empty, \r\n or \n
+			elif eol - line > 1 or (eol > line and data[line] != 13):
+				if state == DATA_END:
+					return None
+
+				# a trailer field, passed on as it is
+
+			elif state == DATA_END:
+				state = SIZE
+
+			else:
+				state = DONE
+
+		self.scanned = scanned
+		self.state = state
+		return position - start
@@ -0,0 +1,121 @@
+# encoding: utf-8
+"""
+writer.py
+
+Created by agent on 2026-10-17.
+Copyright (c) 2011-2013  Exa Networks. All rights reserved.
+"""
+
+import socket
+import errno
+
+from exaproxy.network.errno_list import errno_block
+
+
+class ResponseWriter (object):
+	"""What we send to a client, sent as it can take it
+
+	write returns (buffered, had_buffer, sent4, sent6): if data is left to
+	send (or the connection is to be closed once it is sent), if data was
+	left before this write, and the bytes sent over IPv4 and IPv6. It returns
+	None once the connection should be closed, and for anything written to
+	it after that, until start is called for the next response."""
+
+	__slots__ = ('sock', 'w_buffer', 'ipv4', 'read_budget', 'log', 'finished', 'closed')
+
+	def __init__ (self, sock, w_buffer, ipv4, read_budget, logger):
+		self.sock = sock
+		self.w_buffer = w_buffer
+		self.ipv4 = ipv4
+		self.read_budget = read_budget  # edge triggered: send until it would block
+		self.log = logger
+		self.finished = False  # we were told the response is complete, close once it is sent
+		self.closed = False    # the connection should be closed, nothing more is sent
+
+	def _send (self, sock, w_buffer):
+		"""Send to the client, until the socket would block if edge triggered"""
+		sent = w_buffer.send(sock)
+
+		if not self.read_budget:
+			return sent
+
+		total = sent
+		while sent and w_buffer:
+			try:
+				sent = w_buffer.send(sock)
+			except socket.error:
+				break  # would block, any other error will be seen by the next write
+			total += sent
+
+		return total
+
+	def start (self, command, data):
+		"""the beginning of a response, returns what write would"""
+		self.finished = False
+		self.closed = False
+
+		if command == 'stream':
+			return self.write(data)
+
+		if command == 'close':
+			self.write(data)
+			return self.write(None)  # close the connection once the buffer is empty
+
+		if command == 'file':
+			header, local = data
+
+			# the headers go after what is left of a previous response
+			self.w_buffer.append(header)
+			# then the file, sent as the client reads it, without being read in memory
+			self.w_buffer.attach(local)
+
+			self.write(None)  # close the connection once the buffer is empty
+			return True, False, 0, 0
+
+		return None
+
+	def write (self, data):
+		"""queue data and send what the socket takes, None is the end of the response"""
+		if self.closed:
+			return None
+
+		w_buffer = self.w_buffer
+		had_buffer = bool(w_buffer)
+
+		if data is not None:
+			w_buffer.append(data)
+		else:
+			# We've finished downloading, even if the client hasn't yet
+			self.finished = True
+
+		if self.finished:
+			if not w_buffer:
+				self.closed = True
+				return None  # terminate the client connection
+
+			if data:
+				self.log.error('Tried to send data to client after we told it to close. Dropping it.')
+
+		try:
+			if not had_buffer or data == '':
+				sent = self._send(self.sock, w_buffer)
+			else:
+				sent = 0
+
+		except socket.error, e:
+			if e.args[0] in errno_block:
+				self.log.debug('interrupted when trying to sent %d bytes, fine, will retry' % len(w_buffer))
+				self.log.debug('reason: errno %d: %s' % (e.args[0], errno.errorcode.get(e.args[0], '<no errno name>')))
+				return bool(w_buffer) or self.finished, had_buffer, 0, 0
+
+			self.log.debug('handled an unexpected error writing on socket')
+			self.log.debug('reason, errno %d: %s' % (e.args[0], errno.errorcode.get(e.args[0], '<no errno name>')))
+			self.closed = True
+			return None  # stop the client connection
+
+		if self.ipv4:
+			return bool(w_buffer) or self.finished, had_buffer, sent, 0
+		return bool(w_buffer) or self.finished, had_buffer, 0, sent
+
+	def close (self):
+		self.closed = True
@@ -0,0 +1,115 @@
+# encoding: utf-8
+"""
+local.py
+
+Created by agent on 2026-10-17.
+Copyright (c) 2011-2013  Exa Networks. All rights reserved.
+"""
+
+import os
+import re
+import time
+
+# the %(name)s fields of our templates, and the %% escapes
+_field = re.compile(r'%(?:\(([^)]*)\)s|%)')
+
+
+def signature (stat):
+	"""what tells us a file changed on disk"""
+	return stat.st_mtime, stat.st_size, stat.st_ino
+
+
+class LocalFile (object):
+	"""A file we serve, kept open so it can be sent to any number of clients at once"""
+
+	def __init__ (self, filename):
+		self.fd = open(filename, 'rb')
+		stat = os.fstat(self.fd.fileno())
+
+		self.signature = signature(stat)
+		self.size = stat.st_size
+		self.mtime = stat.st_mtime
+
+	def fileno (self):
+		return self.fd.fileno()
+
+
+class LocalPage (object):
+	"""A template we render, read once and split around its fields so no parsing is done per response"""
+
+	def __init__ (self, filename):
+		with open(filename, 'rb') as fd:
+			stat = os.fstat(fd.fileno())
+			self.template = fd.read()
+
+		self.signature = signature(stat)
+		self.parts = []   # the text of the page, with a None where a field goes
+		self.fields = []  # (position in parts, name of the field)
+
+		start = 0
+		for match in _field.finditer(self.template):
+			text = self.template[start:match.start()]
+			name = match.group(1)
+			start = match.end()
+
+			# any other conversion python formatting understands, we let python do it
+			if '%' in text:
+				self.parts = None
+				return
+
+			if name is None:
+				self.parts.append(text + '%')
+				continue
+
+			self.parts.append(text)
+			self.fields.append((len(self.parts), name))
+			self.parts.append(None)
+
+		if '%' in self.template[start:]:
+			self.parts = None
+			return
+
+		self.parts.append(self.template[start:])
+
+	def render (self, data):
+		"""the page with the fields filled from data, KeyError, ValueError or TypeError are raised for invalid templates"""
+		if self.parts is None:
+			return self.template % data
+
+		parts = list(self.parts)
+		for position, name in self.fields:
+			parts[position] = str(data[name])
+		return ''.join(parts)
+
+
+class LocalCache (object):
+	"""The files we serve, loaded once and loaded again when they change on disk
+
+	The disk is checked at most once a second for each file. A file replaced
+	in the cache is only closed once the last client sending it is done
+	with it, as it is then garbage collected."""
+
+	def __init__ (self, factory):
+		self.factory = factory  # LocalFile or LocalPage
+		self.cache = {}         # filename : (second checked, LocalFile or LocalPage)
+
+	def __len__ (self):
+		return len(self.cache)
+
+	def get (self, filename):
+		"""the loaded file, IOError or OSError is raised if it can not be read"""
+		now = int(time.time())
+
+		checked, local = self.cache.get(filename, (None, None))
+		if checked == now:
+			return local
+
+		stat = os.stat(filename)
+		if local is None or local.signature != signature(stat):
+			local = self.factory(filename)
+
+		self.cache[filename] = now, local
+		return local
+
+	def clear (self):
+		self.cache = {}
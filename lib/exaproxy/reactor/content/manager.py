@@ -7,11 +7,19 @@ Copyright (c) 2011-2013  Exa Networks. All rights reserved.
 """
 
 import os
+import socket
+
+from collections import OrderedDict
 
 from exaproxy.network.functions import isipv4,isipv6
 from exaproxy.util.log.logger import Logger
+from exaproxy.util.histogram import Sizes
 from exaproxy.http.response import http, file_header
 from .worker import Content
+from .local import LocalCache, LocalFile, LocalPage
+from .pool import Pool
+
+MAX_FAILURES = 1024  # the destinations which failed to connect we remember
 
 class ParsingError (Exception):
 	pass
@@ -25,17 +33,58 @@ class ContentManager(object):
 		self.opening = {}
 		self.established = {}
 		self.byclientid = {}
-		self.buffered = []
-		self.retry = []
 		self.configuration = configuration
 		self.supervisor = supervisor
 
 		self.poller = supervisor.poller
+		self.wheel = supervisor.wheel
+		self.connect_timeout = configuration.http.connect_timeout
 		self.log = Logger('download', configuration.log.download)
+		self.read_budget = configuration.daemon.read_budget if self.poller.edge else 0
+		self.deferred = 0L  # reads left for the next loop as the server used its read budget
+		self.saved = 0L     # bytes the write queues of the closed downloads did not have to copy
+		self.pool = Pool(self.wheel, configuration.http.pool, configuration.http.pool_timeout)
+		self.sizes = Sizes()  # the size of the complete responses received from the servers
+		self.truncated = 0L   # responses cut short by the server closing the connection
+
+		# we stop reading from a client once more than upload_high bytes wait to be sent to its server, and read again at upload_low
+		self.upload_high = configuration.http.upload_high
+		self.upload_low = min(configuration.http.upload_low, self.upload_high)
+		self.corked = 0L    # times we stopped reading from a client
+		self.uncorked = 0L  # times we read from it again
+
+		# with more than one address, the next is tried when the last failed, or did not connect in time (Happy Eyeballs)
+		self.race_delay = configuration.http.race_delay / 1000.0
+		self.alternatives = {}  # client_id : [address, ...] not yet tried
+		self.racing = {}        # client_id : [sock, ...] the attempts started after the one of the downloader
+		self.racers = {}        # sock : the address this attempt connects to
+		self.contested = set()  # client_id of the downloaders with more than one address to connect to
+		self.attempts = 0L      # connections started to another address of a server
+		self.won4 = 0L          # servers with more than one address reached over IPv4
+		self.won6 = 0L          # servers with more than one address reached over IPv6
+
+		self.failures = OrderedDict()  # (address, port) : connections which failed in a row, the most recent last
+		self.failed = 0L               # connections which failed or timed out
+		self.failover = 0L             # connections started to another address as the last one failed
 
 		self.location = os.path.realpath(os.path.normpath(configuration.web.html))
 		self.page = supervisor.page
-		self._header = {}
+		self.files = LocalCache(LocalFile)  # the files we send as they are
+		self.pages = LocalCache(LocalPage)  # the templates we fill for each response
+
+	def buffers(self):
+		"""bytes waiting to be sent to the servers, and bytes the write queues did not have to copy"""
+		size, saved = 0, self.saved
+
+		for downloader in self.byclientid.itervalues():
+			size += len(downloader.w_buffer)
+			saved += downloader.w_buffer.saved
+
+		return size, saved
+
+	def buffered(self):
+		"""the bytes waiting to be sent to each server which has some, by client_id"""
+		return dict((client_id, len(downloader.w_buffer)) for (client_id, downloader) in self.byclientid.iteritems() if downloader.w_buffer)
 
 	def hasClient(self, client_id):
 		return client_id in self.byclientid
@@ -45,27 +94,18 @@ class ContentManager(object):
 		if not filename.startswith(self.location + os.path.sep):
 			filename = ''
 
-		if os.path.isfile(filename):
-			try:
-				stat = os.stat(filename)
-			except IOError:
+		try:
+			local = self.files.get(filename)
+		except (IOError, OSError):
+			if os.path.isfile(filename):
 				# NOTE: we are always returning an HTTP/1.1 response
 				content = 'close', http(501, 'local file is inaccessible %s' % str(filename))
 			else:
-				if filename in self._header :
-					cache_time, header = self._header[filename]
-				else:
-					cache_time, header = None, None
-
-				if cache_time is None or cache_time < stat.st_mtime:
-					header = file_header(code, stat.st_size, filename)
-					self._header[filename] = stat.st_size, header
-
-				content = 'file', (header, filename)
+				self.log.debug('local file is missing for %s: %s' % (str(name), str(filename)))
+				# NOTE: we are always returning an HTTP/1.1 response
+				content = 'close', http(501, 'could not serve missing file %s' % str(filename))
 		else:
-			self.log.debug('local file is missing for %s: %s' % (str(name), str(filename)))
-			# NOTE: we are always returning an HTTP/1.1 response
-			content = 'close', http(501, 'could not serve missing file %s' % str(filename))
+			content = 'file', (file_header(code, local.size, filename), local)
 
 		return content
 
@@ -74,59 +114,100 @@ class ContentManager(object):
 		if not filename.startswith(self.location + os.path.sep):
 			filename = ''
 
-		if os.path.isfile(filename):
-			try:
-				with open(filename) as fd:
-					body = fd.read() % data
-
-				# NOTE: we are always returning an HTTP/1.1 response
-				content = 'close', http(code, body)
-			except IOError:
-				self.log.debug('local file is missing for %s: %s' % (str(reason), str(filename)))
-				# NOTE: we are always returning an HTTP/1.1 response
-				content = 'close', http(501, 'could not serve missing file  %s' % str(reason))
-		else:
+		try:
+			body = self.pages.get(filename).render(data)
+		except (IOError, OSError):
 			self.log.debug('local file is missing for %s: %s' % (str(reason), str(filename)))
-				# NOTE: we are always returning an HTTP/1.1 response
+			# NOTE: we are always returning an HTTP/1.1 response
 			content = 'close', http(501, 'could not serve missing file  %s' % str(reason))
+		except (KeyError, ValueError, TypeError), e:
+			self.log.error('local file %s is not a valid template: %s' % (str(filename), str(e)))
+			# NOTE: we are always returning an HTTP/1.1 response
+			content = 'close', http(501, 'could not serve invalid file  %s' % str(reason))
+		else:
+			# NOTE: we are always returning an HTTP/1.1 response
+			content = 'close', http(code, body)
 
 		return content
 
 
+	def _bind(self, host):
+		if isipv4(host):
+			return self.configuration.tcp4.bind
+
+		if isipv6(host):
+			return self.configuration.tcp6.bind
+
+		# should really never happen
+		self.log.critical('the host IP address is neither IPv4 or IPv6 .. what year is it ?')
+		return None
+
+	def _allowed(self, host, port):
+		# supervisor.local is replaced when interface are changed, so do not cache or reference it in this class
+		if host in self.supervisor.local:
+			for h,p in self.configuration.security.local:
+				if (h == '*' or h == host) and (p == '*' or p == port):
+					break
+			else:
+				# we did not break
+				return False
+
+		return True
+
 	def getDownloader(self, client_id, host, port, command, request):
+		# the resolver can give us more than one address for the server
+		addresses = host.split()
+
 		downloader = self.byclientid.get(client_id, None)
 		if downloader:
-			# NOTE: with pipeline, consequent request could go to other sites if the browser knows we are a proxy
-			# NOTE: therefore the second request could reach the first site
-			# NOTE: and we could kill the connection before the data is fully back to the client
-			# NOTE: in practice modern browser are too clever and test for it !
-			if host != downloader.host or port != downloader.port:
+			# NOTE: a pipelined request is only given to us once the response before it is complete
+			# NOTE: (or when we can not tell where it ends), so the connection can be replaced
+			if downloader.host not in addresses or port != downloader.port or command != 'download':
+				self.endClientDownload(client_id)
+				downloader = None
+			# the server told us it is closing the connection
+			elif downloader.answering is False and not downloader.framing.keepalive:
 				self.endClientDownload(client_id)
 				downloader = None
 			else:
 				newdownloader = False
 
-		if isipv4(host):
-			bind = self.configuration.tcp4.bind
-		elif isipv6(host):
-			bind = self.configuration.tcp6.bind
-		else:
-			# should really never happen
-			self.log.critical('the host IP address is neither IPv4 or IPv6 .. what year is it ?')
-			return None, False
-
 		if downloader is None:
-			# supervisor.local is replaced when interface are changed, so do not cache or reference it in this class
-			if host in self.supervisor.local:
-				for h,p in self.configuration.security.local:
-					if (h == '*' or h == host) and (p == '*' or p == port):
+			addresses = [_ for _ in addresses if self._bind(_) is not None and self._allowed(_, port)]
+			if not addresses:
+				return None, False
+
+			# the addresses which failed us recently are tried last
+			addresses.sort(key=lambda _: (_, port) in self.failures)
+
+			if command == 'download':
+				downloader = self.pool.get(addresses, port)
+
+			if downloader is not None:
+				downloader.client_id = client_id
+				self.established[downloader.sock] = downloader
+				self.byclientid[client_id] = downloader
+
+				# registed interest in data becoming available to read
+				self.poller.addReadSocket('read_download', downloader.sock)
+				newdownloader = False
+			else:
+				host = addresses.pop(0)
+				downloader = self.downloader_factory(client_id, host, port, self._bind(host), command, request, self.log, self.read_budget, self.sizes)
+				newdownloader = True
+
+				# we could not even start connecting to this address (refused, or no route to it)
+				while downloader.sock is None:
+					self._failure(host, port)
+					if not addresses:
 						break
-				else:
-					# we did not break
-					return None, False
 
-			downloader = self.downloader_factory(client_id, host, port, bind, command, request, self.log)
-			newdownloader = True
+					host = addresses.pop(0)
+					downloader = self.downloader_factory(client_id, host, port, self._bind(host), command, request, self.log, self.read_budget, self.sizes)
+
+				if addresses:
+					self.alternatives[client_id] = addresses
+					self.contested.add(client_id)
 
 		if downloader.sock is None:
 			return None, False
@@ -248,55 +329,201 @@ class ContentManager(object):
 			content = None
 			length = 0
 
+		if downloader is not None and command == 'download':
+			# the response to this request follows the last one on the connection
+			downloader.expect(request, length)
+
 		if newdownloader is True:
 			self.opening[downloader.sock] = downloader
 			self.byclientid[downloader.client_id] = downloader
 
-			buffered = None
+			corked = None
 			buffer_change = None
 
 			# register interest in the socket becoming available
 			self.poller.addWriteSocket('opening_download', downloader.sock)
 
+			# do not wait for ever for the server to answer
+			if self.connect_timeout > 0:
+				self.wheel.schedule(('download', downloader.sock), self.connect_timeout)
+
+			# try the next address if this one is slow to connect
+			if downloader.client_id in self.alternatives and self.race_delay > 0:
+				self.wheel.schedule(('race', downloader.client_id), self.race_delay)
+
 		elif downloader is not None:
 			buffered,sent4,sent6 = downloader.writeData(request)
 			self.total_sent4 += sent4
 			self.total_sent6 += sent6
 			if buffered:
-				if downloader.sock not in self.buffered:
-					self.buffered.append(downloader.sock)
-					buffer_change = True
+				if not downloader.buffered:
+					downloader.buffered = True
 					# watch for the socket's send buffer becoming less than full
 					self.poller.addWriteSocket('write_download', downloader.sock)
-				else:
-					buffer_change = False
-			elif downloader.sock in self.buffered:
-				self.buffered.remove(downloader.sock)
-				buffer_change = True
+			elif downloader.buffered:
+				downloader.buffered = False
 
 				# we no longer care that we can write to the server
 				self.poller.removeWriteSocket('write_download', downloader.sock)
-			else:
-				buffer_change = False
+
+			buffer_change = self._throttle(downloader, len(downloader.w_buffer) if buffered is not None else 0)
+			corked = downloader.corked
 
 		elif client_id in self.byclientid:
-			buffered = None
+			corked = None
 			buffer_change = None
 
 			# we have replaced the downloader with local content
 			self.endClientDownload(client_id)
 
 		else:
-			buffered = None
+			corked = None
 			buffer_change = None
 
-		return content, length, buffered, buffer_change
+		return content, length, corked, buffer_change
+
+
+	def _attempt(self, downloader):
+		"""connect downloader to the next address of the server as well, returns False if there is none left"""
+		client_id = downloader.client_id
+		alternatives = self.alternatives.get(client_id, [])
+		sock = None
+
+		while alternatives and sock is None:
+			host = alternatives.pop(0)
+			sock = downloader.attempt(host, self._bind(host))
+
+			if sock is None:
+				# we could not even start connecting to this address (refused, or no route to it)
+				self._failure(host, downloader.port)
+
+		if not alternatives:
+			self.alternatives.pop(client_id, None)
+
+		if sock is None:
+			return False
+
+		self.attempts += 1
+		self.opening[sock] = downloader
+		self.racers[sock] = host
+		self.racing.setdefault(client_id, []).append(sock)
 
+		# register interest in the socket becoming available
+		self.poller.addWriteSocket('opening_download', sock)
+
+		if self.connect_timeout > 0:
+			self.wheel.schedule(('download', sock), self.connect_timeout)
+
+		if client_id in self.alternatives and self.race_delay > 0:
+			self.wheel.schedule(('race', client_id), self.race_delay)
+
+		return True
+
+	def _abandon(self, sock):
+		"""close a connection attempt which lost the race, or failed"""
+		self.opening.pop(sock, None)
+		self.racers.pop(sock, None)
+		self.wheel.cancel(('download', sock))
+		self.poller.removeWriteSocket('opening_download', sock)
+
+		try:
+			sock.close()
+		except socket.error:
+			pass
+
+	def _failure(self, host, port):
+		"""the connection to this destination failed or timed out"""
+		key = host, port
+		self.failed += 1
+
+		failures = self.failures.pop(key, 0)
+		if len(self.failures) >= MAX_FAILURES:
+			self.failures.popitem(last=False)
+		self.failures[key] = failures + 1
+
+	def _racing(self, downloader, sock):
+		"""forget a connection attempt which failed, returns False if it was the last one"""
+		client_id = downloader.client_id
+		self._failure(self.racers.get(sock, downloader.host), downloader.port)
+
+		# start the next attempt now, without waiting for the race delay
+		if client_id in self.alternatives:
+			self.wheel.cancel(('race', client_id))
+			if self._attempt(downloader):
+				self.failover += 1
+
+		racing = self.racing.get(client_id, [])
+		if not racing:
+			return False
+
+		if sock is downloader.sock:
+			# the downloader takes over one of the other attempts
+			other = racing.pop(0)
+			downloader.settle(other, self.racers.pop(other))
+		else:
+			racing.remove(sock)
+
+		if not racing:
+			self.racing.pop(client_id)
+
+		self._abandon(sock)
+		return True
+
+	def _won(self, downloader, sock):
+		"""the connection attempt completed first, close the others"""
+		client_id = downloader.client_id
+
+		if sock is not downloader.sock:
+			self.racing[client_id].remove(sock)
+			self._abandon(downloader.sock)
+			downloader.settle(sock, self.racers.pop(sock))
+
+		for other in self.racing.pop(client_id, []):
+			self._abandon(other)
+
+		self.alternatives.pop(client_id, None)
+		self.contested.discard(client_id)
+		self.wheel.cancel(('race', client_id))
+
+		if downloader.ipv4:
+			self.won4 += 1
+		else:
+			self.won6 += 1
+
+	def _forfeit(self, client_id):
+		"""the client is gone, stop any race for it"""
+		for sock in self.racing.pop(client_id, []):
+			self._abandon(sock)
+
+		self.alternatives.pop(client_id, None)
+		self.contested.discard(client_id)
+		self.wheel.cancel(('race', client_id))
+
+	def race(self, client_id):
+		"""the connection to the server did not complete in time, try its next address as well"""
+		downloader = self.byclientid.get(client_id, None)
+		if downloader is not None and downloader.sock in self.opening:
+			self._attempt(downloader)
 
 	def startDownload(self, sock):
+		downloader = self.opening.get(sock, None)
+		recorded = False
+
+		if downloader and downloader.client_id in self.contested:
+			if sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR):
+				# this address did not work, let the other attempts carry on
+				# if it was the last one, writing to the socket fails as it would have
+				if self._racing(downloader, sock):
+					return None, None, None
+				self._forfeit(downloader.client_id)
+				recorded = True
+			else:
+				self._won(downloader, sock)
+
 		# shift the downloader to the other connected sockets
 		downloader = self.opening.pop(sock, None)
 		if downloader:
+			self.wheel.cancel(('download', sock))
 			self.poller.removeWriteSocket('write_download', downloader.sock)
 
 			self.established[sock] = downloader
@@ -305,6 +532,10 @@ class ContentManager(object):
 			# check to see if we were unable to connect
 			if res is not True:
 				_,response = self.readLocalContent('400', 'noconnect.html')
+				if not recorded:
+					self._failure(downloader.host, downloader.port)
+			else:
+				self.failures.pop((downloader.host, downloader.port), None)
 
 			# we're no longer interested in the socket connecting since it's connected
 			self.poller.removeWriteSocket('opening_download', downloader.sock)
@@ -312,19 +543,37 @@ class ContentManager(object):
 			# registed interest in data becoming available to read
 			self.poller.addReadSocket('read_download', downloader.sock)
 
-			if downloader.sock in self.buffered:
+			if downloader.buffered:
 				# watch for the socket's send buffer becoming less than full
 				self.poller.addWriteSocket('write_download', downloader.sock)
 
-			buffer_change = downloader.sock in self.buffered
+			# what the client sent while we connected may have been sent, read from it again
+			buffer_change = self._throttle(downloader, len(downloader.w_buffer) if res is True else 0)
 
 		else:
 			client_id, response, buffer_change = None, None, None
 
 		return client_id, response, buffer_change
 
-	def retryDownload(self, client_id, command, args):
-		return None
+	def expired(self, sock):
+		"""the connection to the web server did not complete in time"""
+		downloader = self.opening.get(sock, None)
+		if downloader and downloader.client_id in self.contested:
+			# another address of the server may still answer
+			if self._racing(downloader, sock):
+				return None, None
+		elif downloader:
+			self._failure(downloader.host, downloader.port)
+
+		if downloader:
+			client_id = downloader.client_id
+			self.log.info('connection to %s:%s for client %s timed out' % (downloader.host, downloader.port, client_id))
+			self._terminate(sock, client_id)
+			_,response = self.readLocalContent('504', 'noconnect.html')
+		else:
+			client_id, response = None, None
+
+		return client_id, response
 
 	def readData(self, sock):
 		downloader = self.established.get(sock, None)
@@ -333,7 +582,14 @@ class ContentManager(object):
 			data = downloader.readData()
 
 			if data is None:
+				if not downloader.framing.closed():
+					self.truncated += 1
+					self.log.debug('response from %s:%s for client %s was truncated' % (downloader.host, downloader.port, client_id))
 				self._terminate(sock, client_id)
+
+			elif downloader.pending:
+				self.deferred += 1
+				self.poller.rearmReadSocket('read_download', sock)
 		else:
 			client_id, data = None, None
 
@@ -348,34 +604,33 @@ class ContentManager(object):
 			client_id = downloader.client_id
 
 			if buffered:
-				if sock not in self.buffered:
-					self.buffered.append(sock)
-					buffer_change = True
+				if not downloader.buffered:
+					downloader.buffered = True
 
 					# watch for the socket's send buffer becoming less than full
 					self.poller.addWriteSocket('write_download', sock)
-				else:
-					buffer_change = False
 
-			elif sock in self.buffered:
-				self.buffered.remove(sock)
-				buffer_change = True
+			elif downloader.buffered:
+				downloader.buffered = False
 
 				# we no longer care that we can write to the server
 				self.poller.removeWriteSocket('write_download', sock)
-			else:
-				buffer_change = False
+
+			buffer_change = self._throttle(downloader, len(downloader.w_buffer) if buffered is not None else 0)
+			corked = downloader.corked
 
 		else:
-			buffered = None
+			corked = None
 			buffer_change = None
 			client_id = None
 
-		return buffered, buffer_change, client_id
+		return corked, buffer_change, client_id
 
 	def sendClientData(self, client_id, data):
 		downloader = self.byclientid.get(client_id, None)
 		if downloader:
+			downloader.uploading(data)
+
 			if downloader.sock in self.established:
 				buffered,sent4,sent6 = downloader.writeData(data)
 				self.total_sent4 += sent4
@@ -383,55 +638,87 @@ class ContentManager(object):
 
 
 				if buffered:
-					if downloader.sock not in self.buffered:
-						self.buffered.append(downloader.sock)
-						buffer_change = True
+					if not downloader.buffered:
+						downloader.buffered = True
 
 						# watch for the socket's send buffer becoming less than full
 						self.poller.addWriteSocket('write_download', downloader.sock)
-					else:
-						buffer_change = True
 
-				elif downloader.sock in self.buffered:
-					self.buffered.remove(downloader.sock)
-					buffer_change = True
+				elif downloader.buffered:
+					downloader.buffered = False
 
 					# we no longer care that we can write to the server
 					self.poller.removeWriteSocket('write_download', downloader.sock)
-				else:
-					buffer_change = False
+
+				# corked again if it already was, the client may have been read to get its next request
+				buffer_change = self._throttle(downloader, len(downloader.w_buffer) if buffered is not None else 0) or downloader.corked
+				corked = downloader.corked
 
 
 			elif downloader.sock in self.opening:
-				buffered = downloader.bufferData(data)
-				if downloader.sock not in self.buffered:
-					self.buffered.append(downloader.sock)
-					buffer_change = True
+				downloader.bufferData(data)
+				downloader.buffered = True
 
-				else:
-					buffer_change = False
+				buffer_change = self._throttle(downloader, len(downloader.w_buffer))
+				corked = downloader.corked
 
 
 			else:  # what is going on if we reach this point
 				self._terminate(downloader.sock, client_id)
-				buffered = None
+				corked = None
 				buffer_change = None
 		else:
-			buffered = None
+			corked = None
 			buffer_change = None
 
-		return buffered, buffer_change
+		return corked, buffer_change
+
+	def _throttle(self, downloader, size):
+		"""True if the client of the downloader is to be corked or uncorked, with size bytes left to send to the server"""
+		if downloader.corked:
+			if size > self.upload_low:
+				return False
+
+			downloader.corked = False
+			self.uncorked += 1
+			return True
+
+		if size <= self.upload_high:
+			return False
+
+		downloader.corked = True
+		self.corked += 1
+		return True
 
 
 	def endClientDownload(self, client_id):
 		downloader = self.byclientid.get(client_id, None)
 		if downloader:
-			res = self._terminate(downloader.sock, client_id)
+			if downloader.sock in self.established and downloader.reusable():
+				res = self._park(downloader.sock, client_id)
+			else:
+				res = self._terminate(downloader.sock, client_id)
 		else:
 			res = False
 
 		return res
 
+	def answering(self, client_id):
+		"""is a response still on its way to the client, the next one must wait for it"""
+		downloader = self.byclientid.get(client_id, None)
+		return downloader is not None and downloader.answering is True
+
+	def relayable(self, client_id):
+		"""the downloader of the client, if it is connected and we have nothing of it left to send"""
+		downloader = self.byclientid.get(client_id, None)
+		if downloader is None or downloader.sock not in self.established:
+			return None
+
+		if downloader.buffered or downloader.w_buffer:
+			return None
+
+		return downloader
+
 	def corkClientDownload(self, client_id):
 		downloader = self.byclientid.get(client_id, None)
 		if downloader:
@@ -443,6 +730,28 @@ class ContentManager(object):
 			if downloader.sock in self.established:
 				self.poller.uncorkReadSocket('read_download', downloader.sock)
 
+	def _park(self, sock, client_id):
+		"""the client is done with the connection, keep it for the next request to the same server"""
+		downloader = self.established.pop(sock)
+		self.byclientid.pop(client_id, None)
+
+		# we do not read from idle connections, the pool checks them before use
+		self.poller.removeReadSocket('read_download', sock)
+
+		if downloader.buffered:
+			downloader.buffered = False
+			self.poller.removeWriteSocket('write_download', sock)
+
+		# the next client of the connection starts uncorked
+		downloader.corked = False
+
+		self.saved += downloader.w_buffer.saved
+		downloader.w_buffer.saved = 0
+		downloader.client_id = None
+
+		self.pool.add(downloader)
+		return True
+
 	def _terminate(self, sock, client_id):
 		downloader = self.established.get(sock, None)
 		if downloader is None:
@@ -451,6 +760,8 @@ class ContentManager(object):
 			if downloader:
 				# we no longer care about the socket connecting
 				self.poller.removeWriteSocket('opening_download', downloader.sock)
+				self.wheel.cancel(('download', sock))
+				self._forfeit(client_id)
 		else:
 			# we no longer care about the socket being readable
 			self.poller.removeReadSocket('read_download', downloader.sock)
@@ -460,12 +771,13 @@ class ContentManager(object):
 			self.opening.pop(sock, None)
 			self.byclientid.pop(client_id, None)
 
-			if sock in self.buffered:
-				self.buffered.remove(sock)
+			if downloader.buffered:
+				downloader.buffered = False
 
 				# we no longer care about the socket's send buffer becoming less than full
 				self.poller.removeWriteSocket('write_download', downloader.sock)
 
+			self.saved += downloader.w_buffer.saved
 			downloader.shutdown()
 
 			res = True
@@ -483,10 +795,18 @@ class ContentManager(object):
 			for downloader in gen:
 				downloader.shutdown()
 
+		for sock in self.opening:
+			self.wheel.cancel(('download', sock))
+
+		for client_id in list(self.contested):
+			self._forfeit(client_id)
+
 		self.established = {}
 		self.opening = {}
 		self.byclientid = {}
-		self.buffered = []
+		self.pool.clear()
+		self.files.clear()
+		self.pages.clear()
 
 		self.poller.clearRead('read_download')
 		self.poller.clearWrite('write_download')
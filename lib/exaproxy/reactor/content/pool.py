@@ -0,0 +1,111 @@
+# encoding: utf-8
+"""
+pool.py
+
+Created by agent on 2026-10-17.
+Copyright (c) 2011-2013  Exa Networks. All rights reserved.
+"""
+
+import socket
+
+from exaproxy.network.errno_list import errno_block
+
+
+def alive (sock):
+	"""the server did not close the connection nor send anything we did not ask for"""
+	try:
+		sock.recv(1, socket.MSG_PEEK)
+	except socket.error, e:
+		return e.args[0] in errno_block
+	return False
+
+
+class Pool (object):
+	"""Idle connections to web servers, given to the next request for the same address and port
+
+	Only connections whose last response was complete are kept. The most
+	recently used connection is given first, it is the least likely to have
+	been closed by the server, and the oldest one is closed to make room."""
+
+	def __init__ (self, wheel, size, timeout):
+		self.wheel = wheel
+		self.size = size        # idle connections kept for each address and port (0: none)
+		self.timeout = timeout  # seconds an idle connection is kept (0: unlimited)
+
+		self.idle = {}          # (host, port) : [downloader, ...] the oldest first
+		self.bysock = {}        # sock : downloader
+
+		self.hits = 0L          # requests sent on an idle connection
+		self.misses = 0L        # requests for which a connection had to be opened
+		self.dead = 0L          # idle connections found closed when we wanted them
+		self.expired = 0L       # idle connections closed as they were not used in time
+
+	def __len__ (self):
+		return len(self.bysock)
+
+	def __contains__ (self, sock):
+		return sock in self.bysock
+
+	def _remove (self, downloader):
+		key = downloader.host, downloader.port
+
+		idle = self.idle[key]
+		idle.remove(downloader)
+		if not idle:
+			del self.idle[key]
+
+		del self.bysock[downloader.sock]
+		self.wheel.cancel(('pool', downloader.sock))
+
+	def add (self, downloader):
+		"""keep the connection of downloader for later, returns False if it was closed instead"""
+		if not self.size:
+			downloader.shutdown()
+			return False
+
+		key = downloader.host, downloader.port
+
+		if len(self.idle.get(key, ())) >= self.size:
+			oldest = self.idle[key][0]
+			self._remove(oldest)
+			oldest.shutdown()
+
+		self.idle.setdefault(key, []).append(downloader)
+		self.bysock[downloader.sock] = downloader
+
+		if self.timeout > 0:
+			self.wheel.schedule(('pool', downloader.sock), self.timeout)
+
+		return True
+
+	def get (self, hosts, port):
+		"""an idle connection to one of the addresses of the server which is still usable, or None"""
+		for host in hosts:
+			idle = self.idle.get((host, port))
+
+			while idle:
+				downloader = idle[-1]
+				self._remove(downloader)
+
+				if alive(downloader.sock):
+					self.hits += 1
+					return downloader
+
+				self.dead += 1
+				downloader.shutdown()
+
+		self.misses += 1
+		return None
+
+	def expire (self, sock):
+		"""the connection was idle for too long"""
+		downloader = self.bysock.get(sock, None)
+		if downloader:
+			self.expired += 1
+			self._remove(downloader)
+			downloader.shutdown()
+
+	def clear (self):
+		for downloader in self.bysock.values():
+			self._remove(downloader)
+			downloader.shutdown()
@@ -9,6 +9,8 @@ Copyright (c) 2011-2013  Exa Networks. All rights reserved.
 from exaproxy.network.functions import connect,isipv4
 from exaproxy.network.errno_list import errno_block
 from exaproxy.network.errno_list import errno_unavailable
+from exaproxy.network.buffer import BufferQueue
+from exaproxy.http.framing import Framing
 
 import socket
 import errno
@@ -21,17 +23,47 @@ DEFAULT_READ_BUFFER_SIZE = 64*1024
 
 
 class Content (object):
+	__slots__ = (
+		'client_id', 'sock', 'host', 'port', 'method', 'w_buffer', 'log', 'ipv4',
+		'read_budget', 'pending', 'framing', 'body', 'buffered', 'corked',
+	)
+
 	_connect = staticmethod(connect)
 
-	def __init__(self, client_id, host, port, bind, method, request, logger):
+	def __init__(self, client_id, host, port, bind, method, request, logger, read_budget=0, sizes=None):
 		self.client_id = client_id
 		self.sock = self._connect(host, port, bind)
 		self.host = host
 		self.port = port
 		self.method = method
-		self.w_buffer = request
+		self.w_buffer = BufferQueue(request)
 		self.log = logger
 		self.ipv4 = isipv4(host)
+		self.read_budget = read_budget  # edge triggered: read until it would block, up to this many bytes
+		self.pending = False            # edge triggered: the socket was not read until it would block
+
+		self.framing = Framing(sizes)  # where the responses of the server end
+		self.body = None               # bytes of the request body still to send, None if we can not tell
+		self.buffered = False          # kept by the content manager: we are waiting for the socket to be writable
+		self.corked = False            # kept by the content manager: we stopped reading from the client, too much is waiting
+
+		if method == 'connect':
+			self.framing.lost()
+
+	@property
+	def answering(self):
+		"""True: a response is coming and we know where it ends, False: it is complete, None: we can not tell"""
+		return self.framing.answering
+
+	def attempt(self, host, bind):
+		"""another connection to the server, at another of its addresses, None if it could not be started"""
+		return self._connect(host, self.port, bind)
+
+	def settle(self, sock, host):
+		"""use the connection made to host, it completed first"""
+		self.sock = sock
+		self.host = host
+		self.ipv4 = isipv4(host)
 
 	def startConversation(self):
 		"""Send our buffered request to get the conversation flowing
@@ -45,13 +77,33 @@ class Content (object):
 		response='HTTP/1.1 200 Connection Established\r\n\r\n' if self.method == 'connect' else ''
 		return self.client_id, res is not None, response
 
+	def expect(self, request, length):
+		"""we are sending request (with length bytes of body), follow its response to know when it is complete"""
+		self.framing.expect(request.startswith('HEAD '))
+		self.body = length if isinstance(length, (int, long)) and length >= 0 else None
+
+	def uploading(self, data):
+		"""the client sent more of its request body"""
+		if self.body:
+			self.body = max(0, self.body - len(data))
+
+	def reusable(self):
+		"""nothing is left of the last request or response, the connection can carry another one"""
+		framing = self.framing
+		return framing.answering is False and framing.keepalive and self.body == 0 and not self.w_buffer and not self.pending
+
 	def readData(self, buflen=DEFAULT_READ_BUFFER_SIZE):
 		"""Read data that we have already received from the remote server"""
 
 		try:
 			# without this the exception can barf with data not defined on error
 			data = ''
+			self.pending = False
 			data = self.sock.recv(buflen) or None
+			if data and self.read_budget:
+				data = self._drain(data, buflen)
+			if data and self.framing.answering is not None:
+				self.framing.feed(data)
 			#if data:
 			#	self.log.debug("<< [%s]" % data.replace('\t','\\t').replace('\r','\\r').replace('\n','\\n'))
 		except socket.error, e:
@@ -66,22 +118,61 @@ class Content (object):
 
 		return data
 
+	def _drain(self, data, buflen):
+		"""Keep reading until the socket would block or our budget is exhausted"""
+
+		received = [data]
+		size = len(data)
+
+		while size < self.read_budget:
+			try:
+				data = self.sock.recv(buflen)
+			except socket.error, e:
+				if e.args[0] not in errno_block:
+					self.pending = True  # the error will be seen by the next read
+				break
+
+			if not data:
+				self.pending = True  # the connection close will be seen by the next read
+				break
+
+			received.append(data)
+			size += len(data)
+		else:
+			self.pending = True
+
+		return ''.join(received)
+
+	def _send(self, w_buffer):
+		"""Send as much as we can, until the socket would block if edge triggered"""
+
+		sent = w_buffer.send(self.sock)
+		if not self.read_budget:
+			return sent
+
+		total = sent
+		while sent and w_buffer:
+			try:
+				sent = w_buffer.send(self.sock)
+			except socket.error:
+				break  # would block, any other error will be seen by the next write
+			total += sent
+
+		return total
+
 	def writeData(self, data):
 		"""Write data to the remote server"""
 
-		w_buffer = self.w_buffer + data
+		w_buffer = self.w_buffer
+		w_buffer.append(data)
 
 		try:
-			sent = self.sock.send(w_buffer)
-			#if sent:
-			#	self.log.debug(">> [%s]" % w_buffer[:sent].replace('\t','\\t').replace('\r','\\r').replace('\n','\\n'))
+			sent = self._send(w_buffer)
 			#self.log.info('sent %s of %s bytes of data. %s bytes were unbuffered : %s' % (sent, len(w_buffer), len(data), self.sock))
-			self.w_buffer = w_buffer[sent:]
-			res = bool(self.w_buffer)
+			res = bool(w_buffer)
 
 		except socket.error, e:
 			sent = 0
-			self.w_buffer = w_buffer
 
 			if e.args[0] in errno_block:
 				#self.log.error('Write failed as it would have blocked. Why were we woken up? Error %d: %s' % (e.args[0], errno.errorcode.get(e.args[0], '')))
@@ -95,7 +186,7 @@ class Content (object):
 
 	def bufferData(self, data):
 		"""Buffer data to be sent later"""
-		self.w_buffer += data
+		self.w_buffer.append(data)
 		return bool(self.w_buffer)
 
 	def shutdown(self):
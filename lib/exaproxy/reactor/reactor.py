@@ -9,10 +9,26 @@ Copyright (c) 2011-2013  Exa Networks. All rights reserved.
 # http://code.google.com/speed/articles/web-metrics.html
 
 from exaproxy.util.log.logger import Logger
+from exaproxy.util.histogram import Histogram
+from exaproxy.util.clock import monotonic
 
 
 class Reactor(object):
-	def __init__(self, configuration, web, proxy, icap, decider, content, client, resolver, logger, usage, poller):
+	cache_interval = 0.1  # how often we look for DNS cache entries to expire
+	clock = staticmethod(monotonic)
+
+	# the parts of the loop we time, in the order they are run
+	phases = (
+		'timers', 'accept', 'opening_client', 'read_client', 'write_client', 'read_download',
+		'read_workers', 'read_resolver', 'decisions', 'write_download', 'opening_download',
+		'write_resolver', 'read_relay', 'write_relay', 'log',
+	)
+
+	# the events which can be given a budget, and the poller side they are on
+	readable = ('opening_client', 'read_client', 'read_download', 'read_workers', 'read_resolver', 'read_relay')
+	writable = ('write_client', 'write_download', 'opening_download', 'write_resolver', 'write_relay')
+
+	def __init__(self, configuration, web, proxy, icap, decider, content, client, resolver, relay, logger, usage, poller, scheduler, wheel):
 		self.web = web            # Manage listening web sockets
 		self.proxy = proxy        # Manage listening proxy sockets
 		self.icap = icap          # Manage listening icap sockets
@@ -20,38 +36,203 @@ class Reactor(object):
 		self.content = content    # The Content Download manager
 		self.client = client      # Currently open client connections
 		self.resolver = resolver  # The DNS query manager
+		self.relay = relay        # Tunnels relayed by the kernel
 		self.poller = poller      # Interface to the poller
+		self.scheduler = scheduler  # Timers we must run in between polls
+		self.wheel = wheel        # Deadlines of the clients, DNS queries and connections
 		self.logger = logger      # Log writing interfaces
 		self.usage = usage        # Request logging
 		self.running = True       # Until we stop we run :)
 		self.nb_events = 0L       # Number of events received
 		self.nb_loops = 0L        # Number of loop iteration
 		self.events = []          # events so we can report them once in a while
+		self.timing = dict((phase, Histogram()) for phase in self.phases)  # time spent in each part of the loop
+		self.lag = Histogram()    # time from the poller returning to the end of the loop
+		self.budgets = {}         # event : how many sockets (or decisions) we handle per loop
+		self.deferred = {}        # event : sockets we did not handle last loop, handled first the next time
+		self.backlog = []         # decisions we did not have the budget to process last loop
+		self.budget_hits = {}     # event : how many loops used all the budget
+		self.budget_deferred = {} # event : how many sockets (or decisions) were left for the next loop
 
 		self.log = Logger('supervisor', configuration.log.supervisor)
 
-	def run(self):
-		self.running = True
+		for name, budget in configuration.daemon.event_budget.iteritems():
+			if name not in self.readable and name not in self.writable and name != 'decisions':
+				self.log.critical('ignoring budget for unknown event %s' % name)
+				continue
 
-		poller = self.poller
+			if budget > 0:
+				self.budgets[name] = budget
+				self.budget_hits[name] = 0L
+				self.budget_deferred[name] = 0L
+
+		self.scheduler.every(self.cache_interval, self.resolver.expireCache)
+
+	def timeout(self):
+		# we still have decisions to process, do not wait
+		if self.backlog:
+			return 0
+
+		# how long we can wait for events before running timers or expiring deadlines
+		timeout = self.scheduler.timeout()
+		expire = self.wheel.timeout()
+
+		if timeout is None or (expire is not None and expire < timeout):
+			return expire
+		return timeout
+
+	def expire(self, decisions):
+		expired = self.wheel.expired()
+
+		for (owner, key), data in expired:
+			# DNS query which timed out, to be processed like any decision
+			if owner == 'resolver':
+				response = self.resolver.expired(key, data)
+				if response:
+					decisions.append(response)
+
+			# client which never sent its request
+			elif owner == 'client':
+				source = self.client.expired(key)
+				if source == 'proxy':
+					self.proxy.notifyClose(key)
+				elif source == 'icap':
+					self.icap.notifyClose(key)
+				elif source == 'web':
+					self.web.notifyClose(key)
+
+			# web server which did not accept our connection
+			elif owner == 'download':
+				client_id, response = self.content.expired(key)
+				if client_id in self.client:
+					status, buffer_change, client = self.client.sendDataByName(client_id, response)
+					if status is not None:
+						status, buffer_change, client = self.client.sendDataByName(client_id, None)
+
+					if status is None and client is not None:
+						# We just closed our connection to the client and need to count the disconnect.
+						self.proxy.notifyClose(client_id)
+
+			# web server connection which was not used again in time
+			elif owner == 'pool':
+				self.content.pool.expire(key)
+
+			# web server with another address, the connection to the last one is slow
+			elif owner == 'race':
+				self.content.race(key)
+
+			# IPv4 answer which waited for the IPv6 one long enough
+			elif owner == 'resolution':
+				response = self.resolver.resolved(key)
+				if response:
+					decisions.append(response)
+
+		return len(expired)
+
+	def _ready(self, events, name):
+		"""the sockets to handle for this event in this loop, within its budget"""
+		# only the sockets left by the loop just before are favoured, they may since have been closed (or reused)
+		deferred = self.deferred.pop(name, None)
+
+		ready = events.get(name)
+		if not ready:
+			return ()
+
+		budget = self.budgets.get(name)
+		if budget is None:
+			return ready
+
+		if deferred:
+			# the sockets which waited the last time go first
+			ready = [_ for _ in ready if _ in deferred] + [_ for _ in ready if _ not in deferred]
+
+		if len(ready) <= budget:
+			return ready
+
+		ready, later = ready[:budget], ready[budget:]
+		self.deferred[name] = set(later)
+		self.budget_hits[name] += 1
+		self.budget_deferred[name] += len(later)
+
+		# the poller only reports edge triggered sockets again if asked to
+		rearm = self.poller.rearmReadSocket if name in self.readable else self.poller.rearmWriteSocket
+		for sock in later:
+			rearm(name, sock)
+
+		return ready
+
+	def _decisions(self, decisions):
+		"""the decisions to process in this loop, within the budget"""
+		if self.backlog:
+			# the client may have gone away while the decision was waiting
+			decisions = [_ for _ in self.backlog if _[0] in self.client] + decisions
+
+		budget = self.budgets.get('decisions')
+		if budget is None or len(decisions) <= budget:
+			self.backlog = []
+			return decisions
+
+		decisions, self.backlog = decisions[:budget], decisions[budget:]
+		self.budget_hits['decisions'] += 1
+		self.budget_deferred['decisions'] += len(self.backlog)
+		return decisions
+
+	def _relay(self, client_id):
+		"""let the kernel relay a tunnel, once we have nothing of ours left to send either way"""
+		if not self.relay.maximum or client_id in self.relay:
+			return
+
+		client = self.client.relayable(client_id)
+		if client is None:
+			return
 
-#		count = 0
-#		s_times = []
-#		w_times = []
+		downloader = self.content.relayable(client_id)
+		if downloader is None:
+			return
 
-		decisions = []
+		self.relay.start(client_id, client, downloader)
 
-		# Manually timeout queries
-		timedout = self.resolver.cleanup()
-		for client_id, command, decision in timedout:
-			decisions.append((client_id, command, decision))
+	def _unrelay(self, client_id):
+		"""one side of a relayed tunnel went away, close both"""
+		self.relay.end(client_id)
+		self.content.endClientDownload(client_id)
 
-		self.resolver.expireCache()
+		status, buffer_change, client = self.client.sendDataByName(client_id, None)
+		if status is None and client is not None:
+			self.proxy.notifyClose(client_id)
+
+	def _timed(self, phase, start):
+		now = self.clock()
+		self.timing[phase].add(now - start)
+		return now
+
+	def statistics(self, statistics):
+		for phase, histogram in self.timing.iteritems():
+			histogram.statistics('timing.%s' % phase, statistics)
+
+		for name in self.budgets:
+			statistics['budget.%s.hit' % name] = self.budget_hits[name]
+			statistics['budget.%s.deferred' % name] = self.budget_deferred[name]
+
+		return self.lag.statistics('timing.lag', statistics)
+
+	def run(self):
+		poller = self.poller
+		scheduler = self.scheduler
+		timed = self._timed
+		clock = self.clock
 
 		while self.running:
-			# wait until we have something to do
-			events = poller.poll()
+			# wait until we have something to do, or a timer is due
+			events = poller.poll(self.timeout())
 			self.events = events
+			start = last = clock()
+
+			decisions = []
+
+			# regular work and timeouts
+			if scheduler.run() + self.expire(decisions):
+				last = timed('timers', last)
 
 			self.nb_loops += 1
 			for name,ev in events.items():
@@ -72,8 +253,11 @@ class Reactor(object):
 				for s, peer in self.web.accept(sock):
 					self.client.httpConnection(s, peer, 'web')
 
+			if events.get('read_proxy') or events.get('read_icap') or events.get('read_web'):
+				last = timed('accept', last)
+
 			# incoming opening requests from clients
-			for client in events.get('opening_client',[]):
+			for client in self._ready(events, 'opening_client'):
 				client_id, peer, request, subrequest, data, source = self.client.readRequest(client)
 
 				if request:
@@ -91,8 +275,11 @@ class Reactor(object):
 						self.web.notifyClose(client)
 
 
+			if events.get('opening_client'):
+				last = timed('opening_client', last)
+
 			# incoming data from clients
-			for client in events.get('read_client',[]):
+			for client in self._ready(events, 'read_client'):
 				client_id, peer, request, subrequest, data, source = self.client.readDataBySocket(client)
 				if request:
 					# we have a new request - decide what to do with it
@@ -116,8 +303,11 @@ class Reactor(object):
 						self.web.notifyClose(client)
 
 
+			if events.get('read_client'):
+				last = timed('read_client', last)
+
 			# clients we can write buffered data to
-			for client in events.get('write_client',[]):
+			for client in self._ready(events, 'write_client'):
 				status, buffer_change, name, source = self.client.sendDataBySocket(client, '')
 
 				if status is None and name is not None:
@@ -129,15 +319,22 @@ class Reactor(object):
 
 				if buffer_change:
 					# status should be False - we're here because we flushed buffered data
-					if not status:    # No buffer
+					if not status:    # Under the low watermark
 						self.content.uncorkClientDownload(name)
 
-					else:         # Buffering
+					else:         # Over the high watermark
 						self.content.corkClientDownload(name)
 
+				if status is False:
+					# the tunnel can be relayed by the kernel once we have nothing left to send
+					self._relay(name)
+
+
+			if events.get('write_client'):
+				last = timed('write_client', last)
 
 			# incoming data - web pages
-			for fetcher in events.get('read_download',[]):
+			for fetcher in self._ready(events, 'read_download'):
 				client_id, page_data = self.content.readData(fetcher)
 
 				# send received data to the client that requested it
@@ -154,16 +351,23 @@ class Reactor(object):
 						self.content.endClientDownload(client_id)
 
 				elif buffer_change:
-					# status should be true here - we don't read from the server when buffering
-					if status:      # Buffering
+					# status should be true here - we don't read from the server over the high watermark
+					if status:      # Over the high watermark
 						self.content.corkClientDownload(client_id)
 
-					else:            # No buffer
+					else:            # Under the low watermark
 						self.content.uncorkClientDownload(client_id)
 
+				# the response is complete, the requests pipelined after it can now be answered
+				if page_data and client_id in self.client.waiting and not self.content.answering(client_id):
+					decisions.extend(self.client.release(client_id))
+
+
+			if events.get('read_download'):
+				last = timed('read_download', last)
 
 			# decisions made by the child processes
-			for worker in events.get('read_workers',[]):
+			for worker in self._ready(events, 'read_workers'):
 				client_id, command, decision = self.decider.getDecision(worker)
 
 				# check that the client didn't get bored and go away
@@ -181,15 +385,28 @@ class Reactor(object):
 					else:
 						decisions.append((client_id, command, decision))
 
+			if events.get('read_workers'):
+				last = timed('read_workers', last)
+
 			# decisions with a resolved hostname
-			for resolver in events.get('read_resolver', []):
+			for resolver in self._ready(events, 'read_resolver'):
 				response = self.resolver.getResponse(resolver)
 				if response:
 					client_id, command, decision = response
 					decisions.append((client_id, command, decision))
 
+			if events.get('read_resolver'):
+				last = timed('read_resolver', last)
+
 			# all decisions we are currently able to process
+			decisions = self._decisions(decisions)
+
 			for client_id, command, decision in decisions:
+				# answer the requests of a client in order, the response to the one before is still coming
+				if self.content.answering(client_id):
+					self.client.wait(client_id, (client_id, command, decision))
+					continue
+
 				# send the possibibly rewritten request to the server
 				response, length, status, buffer_change = self.content.getContent(client_id, command, decision)
 
@@ -201,7 +418,11 @@ class Reactor(object):
 
 				# Signal to the client that we'll be streaming data to it or
 				# give it the location of the local content to return.
-				client, data, source = self.client.startData(client_id, response, length)
+				client, peer, request, subrequest, data, source = self.client.startData(client_id, response, length)
+
+				if request:
+					# a pipelined request was read with this one - decide what to do with it
+					self.decider.request(client_id, peer, request, subrequest, source)
 
 				# Check for any data beyond the initial headers that we may already
 				# have read and cached
@@ -222,8 +443,11 @@ class Reactor(object):
 						self.web.notifyClose(client)
 
 
+			if decisions:
+				last = timed('decisions', last)
+
 			# remote servers we can write buffered data to
-			for download in events.get('write_download',[]):
+			for download in self._ready(events, 'write_download'):
 				status, buffer_change, client_id = self.content.sendSocketData(download, '')
 
 				if buffer_change:
@@ -232,9 +456,16 @@ class Reactor(object):
 					else:
 						self.client.uncorkUploadByName(client_id)
 
+				if status is False:
+					# the tunnel can be relayed by the kernel once we have nothing left to send
+					self._relay(client_id)
+
+
+			if events.get('write_download'):
+				last = timed('write_download', last)
 
 			# fully connected connections to remote web servers
-			for fetcher in events.get('opening_download',[]):
+			for fetcher in self._ready(events, 'opening_download'):
 				client_id, response, buffer_change = self.content.startDownload(fetcher)
 				if buffer_change:
 					self.client.uncorkUploadByName(client_id)
@@ -257,20 +488,39 @@ class Reactor(object):
 							else:
 								self.content.uncorkClientDownload(client_id)
 
+					self._relay(client_id)
+
 
+			if events.get('opening_download'):
+				last = timed('opening_download', last)
 
 			# DNS servers we still have data to write to (should be TCP only)
-			for resolver in events.get('write_resolver', []):
+			for resolver in self._ready(events, 'write_resolver'):
 				self.resolver.continueSending(resolver)
 
-			decisions = []
+			if events.get('write_resolver'):
+				last = timed('write_resolver', last)
+
+			# tunnels relayed by the kernel
+			for sock in self._ready(events, 'read_relay'):
+				client_id = self.relay.forward(sock)
+				if client_id is not None:
+					self._unrelay(client_id)
 
-#			# retry connecting - opportunistic
-#			for client_id, decision in retry_download:
-#				# if we have a temporary error, the others are likely to be too
-#				if not self.content.retryDownload(client_id, decision):
-#					break
+			if events.get('read_relay'):
+				last = timed('read_relay', last)
 
+			# tunnels with data waiting in their pipe
+			for sock in self._ready(events, 'write_relay'):
+				client_id = self.relay.flush(sock)
+				if client_id is not None:
+					self._unrelay(client_id)
+
+			if events.get('write_relay'):
+				last = timed('write_relay', last)
 
 			self.logger.writeMessages()
 			self.usage.writeMessages()
+
+			last = timed('log', last)
+			self.lag.add(last - start)
@@ -94,7 +94,7 @@ class Redirector (Thread):
 	def __init__ (self, configuration, name, request_box, program):
 		self.configuration = configuration
 		self.icap_parser = self.ICAPParser(configuration)
-		self.enabled = configuration.redirector.enable
+		self.enabled = configuration.redirector.enable and program is not None  # no program: the web interface only
 		self.protocol = configuration.redirector.protocol
 		self._transparent = configuration.http.transparent
 		self.log = Logger('worker ' + str(name), configuration.log.worker)
@@ -185,7 +185,10 @@ class Redirector (Thread):
 	def transparent (self, message, peer):
 		headers = message.headers
 		# http://homepage.ntlworld.com./jonathan.deboynepollard/FGA/web-proxy-connection-header.html
-		headers.pop('proxy-connection',None)
+		proxy_connection = headers.pop('proxy-connection',None)
+		# what the client asked of us, HTTP/1.0 clients can only keep the connection alive this way
+		if proxy_connection and not headers.get('connection',None):
+			headers.set('connection','Connection:' + proxy_connection[0].split(':',1)[1])
 		# NOTE: To be RFC compliant we need to add a Via field http://tools.ietf.org/html/rfc2616#section-14.45 on the reply too
 		# NOTE: At the moment we only add it from the client to the server (which is what really matters)
 		if not self._transparent:
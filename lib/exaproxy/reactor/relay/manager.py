@@ -0,0 +1,160 @@
+# encoding: utf-8
+"""
+manager.py
+
+Created by agent on 2026-10-17.
+Copyright (c) 2011-2013  Exa Networks. All rights reserved.
+"""
+
+from exaproxy.util.log.logger import Logger
+from exaproxy.network.splice import spliceable
+from .tunnel import Tunnel
+
+
+class RelayManager (object):
+	"""CONNECT tunnels (and upgraded connections) relayed with splice
+
+	Once we have nothing of our own left to send either way, the data
+	of a tunnel is moved from one socket to the other through a pipe,
+	never being copied to (or looked at in) user space. The client and
+	content managers still own the sockets and close them at the end."""
+
+	def __init__ (self, poller, configuration, client, content):
+		self.poller = poller
+		self.client = client    # counts what we send to the clients
+		self.content = content  # counts what we send to the servers
+		self.log = Logger('relay', configuration.log.download)
+		self.read_budget = configuration.daemon.read_budget if poller.edge else 0
+
+		self.maximum = configuration.http.splice
+		if self.maximum and not spliceable():
+			self.log.info('splice is not available on this system, tunnels are relayed in user space')
+			self.maximum = 0
+
+		self.tunnels = {}   # client_id : tunnel
+		self.bysock = {}    # sock : tunnel
+		self.started = 0L   # tunnels we relayed
+		self.refused = 0L   # tunnels we could not relay (too many, or no pipe available)
+		self.spliced = 0L   # bytes relayed
+		self.deferred = 0L  # reads left for the next loop as the connection used its read budget
+
+	def __contains__ (self, client_id):
+		return client_id in self.tunnels
+
+	def start (self, client_id, client, downloader):
+		"""relay the tunnel between client and downloader, False if it stays in user space"""
+		if len(self.tunnels) >= self.maximum:
+			self.refused += 1
+			return False
+
+		try:
+			tunnel = Tunnel(client_id, client.sock, client.ipv4, downloader.sock, downloader.ipv4)
+		except OSError, e:
+			self.refused += 1
+			self.log.info('could not create the pipes to relay client %s: %s' % (client_id, str(e)))
+			return False
+
+		self.tunnels[client_id] = tunnel
+		self.bysock[tunnel.client] = tunnel
+		self.bysock[tunnel.server] = tunnel
+		self.started += 1
+
+		# a socket is only part of one read event at a time
+		self.poller.removeReadSocket('read_client', tunnel.client)
+		self.poller.removeReadSocket('read_download', tunnel.server)
+		self.poller.addReadSocket('read_relay', tunnel.client)
+		self.poller.addReadSocket('read_relay', tunnel.server)
+		return True
+
+	def _count (self, tunnel, pipe, sent):
+		manager = self.content if pipe is tunnel.upload else self.client
+		if pipe.ipv4:
+			manager.total_sent4 += sent
+		else:
+			manager.total_sent6 += sent
+		self.spliced += sent
+
+	def forward (self, sock):
+		"""relay what sock sent, returns the client_id of the tunnel if it must be closed"""
+		tunnel = self.bysock.get(sock, None)
+		if tunnel is None:
+			return None
+
+		pipe = tunnel.reading(sock)
+		if pipe.pending:
+			return None
+
+		received = 0
+
+		while True:
+			moved = pipe.fill()
+			if moved is None:
+				return tunnel.client_id
+
+			if not moved:
+				break
+
+			received += moved
+
+			sent = pipe.flush()
+			if sent is None:
+				return tunnel.client_id
+
+			self._count(tunnel, pipe, sent)
+
+			if pipe.pending:
+				# stop reading until the destination took what we have
+				self.poller.corkReadSocket('read_relay', sock)
+				self.poller.addWriteSocket('write_relay', pipe.destination)
+				break
+
+			if received >= self.read_budget:
+				if self.read_budget:
+					self.deferred += 1
+					self.poller.rearmReadSocket('read_relay', sock)
+				break
+
+		return None
+
+	def flush (self, sock):
+		"""write what is waiting for sock, returns the client_id of the tunnel if it must be closed"""
+		tunnel = self.bysock.get(sock, None)
+		if tunnel is None:
+			return None
+
+		pipe = tunnel.writing(sock)
+		sent = pipe.flush()
+		if sent is None:
+			return tunnel.client_id
+
+		self._count(tunnel, pipe, sent)
+
+		if not pipe.pending:
+			self.poller.removeWriteSocket('write_relay', sock)
+			self.poller.uncorkReadSocket('read_relay', pipe.source)
+
+		return None
+
+	def end (self, client_id):
+		"""stop relaying, the sockets are left for the client and content managers to close"""
+		tunnel = self.tunnels.pop(client_id, None)
+		if tunnel is None:
+			return False
+
+		for sock in (tunnel.client, tunnel.server):
+			self.bysock.pop(sock, None)
+			self.poller.removeReadSocket('read_relay', sock)
+			self.poller.removeWriteSocket('write_relay', sock)
+
+		tunnel.close()
+		return True
+
+	def stop (self):
+		for tunnel in self.tunnels.itervalues():
+			tunnel.close()
+
+		self.poller.clearRead('read_relay')
+		self.poller.clearWrite('write_relay')
+
+		self.tunnels = {}
+		self.bysock = {}
@@ -0,0 +1,87 @@
+# encoding: utf-8
+"""
+tunnel.py
+
+Created by agent on 2026-10-17.
+Copyright (c) 2011-2013  Exa Networks. All rights reserved.
+"""
+
+import os
+import socket
+
+from exaproxy.network.splice import splice, pipe
+from exaproxy.network.errno_list import errno_block
+
+PIPE_SIZE = 256*1024  # what we ask each pipe to hold, moving more per system call than the default 64KB
+
+
+class Pipe (object):
+	"""One direction of a tunnel, the data read from the source waits in the kernel until written to the destination"""
+
+	def __init__ (self, source, destination, ipv4):
+		self.source = source
+		self.destination = destination
+		self.ipv4 = ipv4  # the destination is an IPv4 connection
+		self.pending = 0  # bytes in the pipe not yet written to the destination
+		self.read, self.write, self.size = pipe(PIPE_SIZE)
+
+	def fill (self):
+		"""move what the source has into the pipe, returns how many bytes, 0 if it would block, None if the source is gone"""
+		try:
+			moved = splice(self.source.fileno(), self.write, self.size)
+		except socket.error, e:
+			if e.args[0] in errno_block:
+				return 0
+			return None
+
+		self.pending += moved
+		return moved or None
+
+	def flush (self):
+		"""move what is in the pipe to the destination, returns how many bytes, None if the destination is gone"""
+		sent = 0
+
+		while self.pending:
+			try:
+				moved = splice(self.read, self.destination.fileno(), self.pending)
+			except socket.error, e:
+				if e.args[0] in errno_block:
+					break
+				return None
+
+			self.pending -= moved
+			sent += moved
+
+		return sent
+
+	def close (self):
+		os.close(self.read)
+		os.close(self.write)
+
+
+class Tunnel (object):
+	"""A client and the server it is connected to, relayed without the data coming to user space"""
+
+	def __init__ (self, client_id, client, client_ipv4, server, server_ipv4):
+		self.client_id = client_id
+		self.client = client
+		self.server = server
+
+		self.upload = Pipe(client, server, server_ipv4)
+		try:
+			self.download = Pipe(server, client, client_ipv4)
+		except OSError:
+			self.upload.close()
+			raise
+
+	def reading (self, sock):
+		"""the direction sock is the source of"""
+		return self.upload if sock is self.client else self.download
+
+	def writing (self, sock):
+		"""the direction sock is the destination of"""
+		return self.download if sock is self.client else self.upload
+
+	def close (self):
+		self.upload.close()
+		self.download.close()
@@ -3,14 +3,18 @@ import time
 from collections import deque
 
 from .worker import DNSResolver
-from exaproxy.network.functions import isip
+from exaproxy.network.functions import isip, isipv4
 from exaproxy.util.log.logger import Logger
 
+# http://tools.ietf.org/html/rfc8305#section-3
+RESOLUTION_DELAY = 0.05  # how long an IPv4 answer waits for the IPv6 one before being used alone
+
 class ResolverManager (object):
 	resolverFactory = DNSResolver
 
-	def __init__ (self, poller, configuration, max_workers):
+	def __init__ (self, poller, configuration, max_workers, wheel):
 		self.poller = poller
+		self.wheel = wheel
 		self.configuration = configuration
 
 		self.resolver_factory = self.resolverFactory(configuration)
@@ -37,9 +41,6 @@ class ResolverManager (object):
 		# which at the default of 900 seconds of cache is 22 new host per seonds
 		self.max_entries  = 1024*20
 
-		# track the current queries and when they were started
-		self.active = []
-
 		self.cache = {}
 		self.cached = deque()
 
@@ -51,6 +52,13 @@ class ResolverManager (object):
 		self.log = Logger('resolver', configuration.log.resolver)
 		self.chained = {}
 
+		# with both IPv4 and IPv6 enabled, an AAAA query is sent with each A query (Happy Eyeballs)
+		self.dual = configuration.tcp4.out and configuration.tcp6.out
+		self.companions = {}  # (w_id, identifier) : client_id, the AAAA queries sent with the A ones
+		self.companion = {}   # client_id : (w_id, identifier) of its AAAA query still unanswered
+		self.ipv6 = {}        # client_id : the IPv6 addresses the AAAA query found (None if it did not)
+		self.delayed = {}     # client_id : the IPv4 answer waiting for the IPv6 one
+
 	def cacheDestination (self, hostname, ip):
 		if hostname not in self.cache:
 			expire_time = time.time() + self.configuration.dns.ttl
@@ -79,45 +87,42 @@ class ResolverManager (object):
 					self.cache.pop(hostname, None)
 
 
-	def cleanup(self):
-		now = time.time()
-		cutoff = now - self.configuration.dns.timeout
-		count = 0
-
-		for timestamp, client_id, sock in self.active:
-			if timestamp > cutoff:
-				break
+	def _watch (self, client_id, sock):
+		# (re)start the clock for the query made for this client
+		self.wheel.schedule(('resolver', client_id), self.configuration.dns.timeout, sock)
 
-			count += 1
-			cli_data = self.clients.pop(client_id, None)
-			worker = self.workers.get(sock)
-			tcpudp = 'udp' if worker is self.worker else 'tcp'
+	def expired (self, client_id, sock):
+		"""the query for this client timed out, retry it or give up"""
+		cli_data = self.clients.pop(client_id, None)
+		worker = self.workers.get(sock)
+		tcpudp = 'udp' if worker is self.worker else 'tcp'
+		response = None
 
-			if cli_data is not None:
-				w_id, identifier, active_time, resolve_count = cli_data
-				data = self.resolving.pop((w_id, identifier), None)
-				if not data:
-					data = self.sending.pop(sock, None)
+		if cli_data is not None:
+			w_id, identifier, active_time, resolve_count = cli_data
+			data = self.resolving.pop((w_id, identifier), None)
+			if not data:
+				data = self.sending.pop(sock, None)
 
-				if data:
-					client_id, original, hostname, command, decision = data
-					self.log.error('timeout when requesting address for %s using the %s client - attempt %s' % (hostname, tcpudp, resolve_count))
+			if data:
+				client_id, original, hostname, command, decision = data
+				self.log.error('timeout when requesting address for %s using the %s client - attempt %s' % (hostname, tcpudp, resolve_count))
 
-					if resolve_count < self.configuration.dns.retries and worker is self.worker:
-						self.log.info('going to retransmit request for %s - attempt %s of %s' % (hostname, resolve_count+1, self.configuration.dns.retries))
-						self.startResolving(client_id, command, decision, resolve_count+1, identifier=identifier)
-						continue
+				if resolve_count < self.configuration.dns.retries and worker is self.worker:
+					self.log.info('going to retransmit request for %s - attempt %s of %s' % (hostname, resolve_count+1, self.configuration.dns.retries))
+					self.startResolving(client_id, command, decision, resolve_count+1, identifier=identifier)
+					return None
 
-					self.log.error('given up trying to resolve %s after %s attempts' % (hostname, self.configuration.dns.retries))
-					yield client_id, 'rewrite', '\0'.join(('503', 'dns.html', '', '', '', hostname, 'peer'))
+				self.log.error('given up trying to resolve %s after %s attempts' % (hostname, self.configuration.dns.retries))
+				response = client_id, 'rewrite', '\0'.join(('503', 'dns.html', '', '', '', hostname, 'peer'))
+				self._forget(client_id)
 
-			if worker is not None:
-				if worker is not self.worker:
-					worker.close()
-					self.workers.pop(sock)
+		if worker is not None:
+			if worker is not self.worker:
+				worker.close()
+				self.workers.pop(sock)
 
-		if count:
-			self.active = self.active[count:]
+		return response
 
 	def resolves(self, command, decision):
 		if command in ('download', 'connect'):
@@ -189,7 +194,13 @@ class ResolverManager (object):
 
 				self.resolving[(self.worker.w_id, identifier)] = client_id, hostname, hostname, command, decision
 				self.clients[client_id] = (self.worker.w_id, identifier, active_time, resolve_count)
-				self.active.append((active_time, client_id, self.worker.socket))
+				self._watch(client_id, self.worker.socket)
+
+				# ask for the IPv6 address at the same time, not once we know there is no IPv4 one
+				if self.dual and resolve_count == 1:
+					companion, _ = self.worker.resolveHost(hostname, qtype='AAAA')
+					self.companions[(self.worker.w_id, companion)] = client_id
+					self.companion[client_id] = (self.worker.w_id, companion)
 		else:
 			identifier = None
 			response = None
@@ -230,7 +241,7 @@ class ResolverManager (object):
 			active_time = time.time()
 			self.resolving[(worker.w_id, identifier)] = client_id, hostname, hostname, command, decision
 			self.clients[client_id] = (worker.w_id, identifier, active_time, resolve_count)
-			self.active.append((active_time, client_id, self.worker.socket))
+			self._watch(client_id, self.worker.socket)
 
 			if all_sent:
 				self.poller.addReadSocket('read_resolver', worker.socket)
@@ -248,10 +259,17 @@ class ResolverManager (object):
 		worker = self.workers.get(sock)
 
 		if worker:
-			result = worker.getResponse(self.chained)
+			result = worker.getResponse(self.chained, self.companions)
 
 			if result:
 				identifier, forhost, ip, completed, newidentifier, newhost, newcomplete = result
+
+				client_id = self.companions.pop((worker.w_id, identifier), None)
+				if client_id is not None:
+					# edge triggered: one datagram is read per loop, until the socket would block
+					self.poller.rearmReadSocket('read_resolver', sock)
+					return self._companion(client_id, ip if completed else None)
+
 				data = self.resolving.pop((worker.w_id, identifier), None)
 
 				chain_count = self.chained.pop(identifier, 0)
@@ -261,20 +279,26 @@ class ResolverManager (object):
 				if not data:
 					self.log.info('ignoring response for %s (%s) with identifier %s' % (forhost, ip, identifier))
 
+			elif result is False:
+				# nothing was waiting on the socket
+				data = None
+
 			else:
 				# unable to parse response
 				self.log.error('unable to parse response')
 				data = None
 
+			# edge triggered: one datagram is read per loop, until the socket would block
+			if worker is self.worker and result is not False:
+				self.poller.rearmReadSocket('read_resolver', sock)
+
 			if data:
 				client_id, original, hostname, command, decision = data
 				clidata = self.clients.pop(client_id, None)
 
 				if completed:
 					if clidata is not None:
-						key = clidata[2], client_id, worker.socket
-						if key in self.active:
-							self.active.remove(key)
+						self.wheel.cancel(('resolver', client_id))
 
 				# check to see if we received an incomplete response
 				if not completed:
@@ -288,7 +312,7 @@ class ResolverManager (object):
 						active_time = time.time()
 						self.resolving[(worker.w_id, newidentifier)] = client_id, original, newhost, command, decision
 						self.clients[client_id] = (worker.w_id, newidentifier, active_time, 1)
-						self.active.append((active_time, client_id, worker.socket))
+						self._watch(client_id, worker.socket)
 
 					response = None
 
@@ -310,11 +334,18 @@ class ResolverManager (object):
 					active_time = time.time()
 					self.resolving[(worker.w_id, identifier)] = client_id, original, hostname, command, decision
 					self.clients[client_id] = (worker.w_id, identifier, active_time, resolve_count)
-					self.active.append((active_time, client_id, worker.socket))
+					self._watch(client_id, worker.socket)
+					response = None
+
+				# success, but the IPv6 address may be on its way
+				elif ip is not None and client_id in self.companion and isipv4(ip.split()[0]):
+					self.delayed[client_id] = original, command, decision, ip
+					self.wheel.schedule(('resolution', client_id), RESOLUTION_DELAY)
 					response = None
 
 				# success
 				elif ip is not None:
+					ip = self._addresses(client_id, ip)
 					resolved = self.resolveDecision(command, decision, ip)
 					response = client_id, command, resolved
 					self.cacheDestination(original, ip)
@@ -323,6 +354,7 @@ class ResolverManager (object):
 				else:
 					newdecision = '\0'.join(('503', 'dns.html', 'http', '', '', hostname, 'peer'))
 					response = client_id, 'rewrite', newdecision
+					self._forget(client_id)
 					#self.cacheDestination(original, ip)
 			else:
 				response = None
@@ -341,6 +373,56 @@ class ResolverManager (object):
 		return response
 
 
+	def _addresses(self, client_id, ip):
+		"""all the addresses found for the client, alternating families from IPv6 (RFC 8305), and forget about it"""
+		ipv6 = self.ipv6.get(client_id, None)
+		self._forget(client_id)
+
+		if ipv6 is None:
+			return ip
+
+		addresses = []
+		for pair in map(None, ipv6.split(), ip.split()):
+			for address in pair:
+				if address is not None and address not in addresses:
+					addresses.append(address)
+
+		return ' '.join(addresses)
+
+	def _forget(self, client_id):
+		"""the client got its answer, we no longer wait for the AAAA query made for it"""
+		companion = self.companion.pop(client_id, None)
+		if companion is not None:
+			self.companions.pop(companion, None)
+
+		self.ipv6.pop(client_id, None)
+		if self.delayed.pop(client_id, None) is not None:
+			self.wheel.cancel(('resolution', client_id))
+
+	def _companion(self, client_id, ip):
+		"""the answer to the AAAA query sent with the A query of the client"""
+		self.companion.pop(client_id, None)
+		self.ipv6[client_id] = ip
+
+		# the IPv4 address was waiting for us
+		if client_id in self.delayed:
+			return self.resolved(client_id)
+
+		return None
+
+	def resolved(self, client_id):
+		"""answer with what we have, the IPv4 address waited long enough or the IPv6 one arrived"""
+		delayed = self.delayed.pop(client_id, None)
+		if delayed is None:
+			return None
+
+		self.wheel.cancel(('resolution', client_id))
+		original, command, decision, ip = delayed
+
+		ip = self._addresses(client_id, ip)
+		self.cacheDestination(original, ip)
+		return client_id, command, self.resolveDecision(command, decision, ip)
+
 	def continueSending(self, sock):
 		"""Continue sending data over the connected TCP socket"""
 		data = self.sending.get(sock)
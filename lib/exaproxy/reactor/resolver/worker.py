@@ -60,11 +60,20 @@ class DNSClient (object):
 		return identifier, True
 
 	def readResponse (self):
-		response_s, peer = self.socket.recvfrom(65535)
+		try:
+			response_s, peer = self.socket.recvfrom(65535)
+		except socket.error, e:
+			if e.args[0] not in errno_block:
+				return None
+
+			# nothing left to read
+			return False
+
 		return response_s
 
-	def getResponse(self, chained={}):
-		"""Read a response from the wire and return the desired result if present"""
+	def getResponse(self, chained={}, unfollowed={}):
+		"""Read a response from the wire and return the desired result if present
+		the answers to the queries in unfollowed, keyed by (w_id, identifier), are taken as they are"""
 
 		# We may need to make another query
 		newidentifier = None
@@ -77,6 +86,9 @@ class DNSClient (object):
 		if response_s is None:
 			return None
 
+		if response_s is False:
+			return False
+
 		# and convert it into something we can play with
 		completed, response = self.dns_factory.normalizeResponse(response_s, extended=self.extended)
 
@@ -88,19 +100,19 @@ class DNSClient (object):
 		if not response:
 			return None
 
-		# Try to get the IP address we asked for
-		qtype, value = response.getValue()
+		# Try to get the IP addresses we asked for (space separated)
+		qtype, value = response.getValue(every=True)
 
 		# If we didn't get the IP address then check to see if
 		# we can find it by following the CNAMEs in the response
 		if value is None:
-			qtype, value = response.getChainedValue()
+			qtype, value = response.getChainedValue(every=True)
 
 
 		chain_count = chained.get(response.identifier, 0)
 
 		# watch out for loops
-		if chain_count < 10:
+		if chain_count < 10 and (self.w_id, response.identifier) not in unfollowed:
 			# Or the IPv4 address
 			if value is None:
 				related = response.getRelated()
@@ -111,7 +123,7 @@ class DNSClient (object):
 					value = None
 
 				elif response.qtype == 'A' and self.configuration.tcp6.out:
-					qtype, value = response.getValue(qtype='AAAA')
+					qtype, value = response.getValue(qtype='AAAA', every=True)
 
 					if value is None:
 						newidentifier, newcomplete = self.resolveHost(response.qhost, qtype='AAAA')
@@ -143,7 +155,10 @@ class UDPClient (DNSClient):
 	extended = False
 
 	def startConnecting (self):
-		return socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+		sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+		# edge triggered, we read until there is nothing left
+		sock.setblocking(0)
+		return sock
 
 
 class TCPClient (DNSClient):
@@ -189,10 +204,10 @@ class TCPClient (DNSClient):
 	def _write (self, sock, data):
 		while data:
 			try:
+				# keep sending until the socket would block (required when edge triggered)
 				while data:
 					sent = sock.send(data)
 					data = data[sent:]
-					yield bool(data)
 
 			except IOError, e:
 				if e.errno in errno_block:
@@ -0,0 +1,81 @@
+# encoding: utf-8
+"""
+scheduler.py
+
+Created by agent on 2026-10-17.
+Copyright (c) 2011-2013  Exa Networks. All rights reserved.
+"""
+
+import heapq
+
+from exaproxy.util.clock import monotonic
+
+
+class Scheduler (object):
+	"""Timers run by the reactor in between two polls
+
+	The reactor never sleeps past the next deadline, so timers fire on time
+	without anything having to interrupt the poller."""
+
+	clock = staticmethod(monotonic)
+	resolution = 0.001  # epoll truncates its timeout to the millisecond, do not spin for what is left
+
+	def __init__ (self):
+		self.timers = []        # heap of (deadline, timer id, interval, callback)
+		self.cancelled = set()  # timer ids removed from the heap lazily
+		self.nextid = 0
+		self.fired = 0L
+
+	def _schedule (self, deadline, interval, callback):
+		self.nextid += 1
+		heapq.heappush(self.timers, (deadline, self.nextid, interval, callback))
+		return self.nextid
+
+	def after (self, delay, callback):
+		"""call callback once, in delay seconds"""
+		return self._schedule(self.clock() + delay, None, callback)
+
+	def every (self, interval, callback, delay=None):
+		"""call callback every interval seconds, the first time after delay (default interval) seconds"""
+		return self._schedule(self.clock() + (interval if delay is None else delay), interval, callback)
+
+	def cancel (self, timer):
+		self.cancelled.add(timer)
+
+	def timeout (self):
+		"""how long the poller can sleep before the next timer is due (None: no timer)"""
+		timers = self.timers
+
+		while timers and timers[0][1] in self.cancelled:
+			self.cancelled.discard(heapq.heappop(timers)[1])
+
+		if not timers:
+			return None
+
+		return max(0, timers[0][0] - self.clock())
+
+	def run (self):
+		"""call all the timers which are due, returns how many were called"""
+		timers = self.timers
+		now = self.clock() + self.resolution
+		count = 0
+
+		while timers and timers[0][0] <= now:
+			deadline, timer, interval, callback = heapq.heappop(timers)
+
+			if timer in self.cancelled:
+				self.cancelled.discard(timer)
+				continue
+
+			if interval is not None:
+				deadline += interval
+				# do not try to catch up if we were too busy to run on time
+				if deadline <= now:
+					deadline = now + interval
+				heapq.heappush(timers, (deadline, timer, interval, callback))
+
+			count += 1
+			callback()
+
+		self.fired += count
+		return count
@@ -19,12 +19,16 @@ from .reactor.redirector.manager import RedirectorManager
 from .reactor.content.manager import ContentManager
 from .reactor.client.manager import ClientManager
 from .reactor.resolver.manager import ResolverManager
+from .reactor.relay.manager import RelayManager
 from .network.async import Poller
 from .network.server import Server
 from .html.page import Page
 from .monitor import Monitor
+from .processes import Processes
 
 from .reactor import Reactor
+from .reactor.scheduler import Scheduler
+from .util.wheel import TimingWheel
 
 from .configuration import load
 from exaproxy.util.log.logger import Logger
@@ -34,13 +38,12 @@ from exaproxy.util.log.writer import UsageWriter
 from exaproxy.util.interfaces import getifaddrs,AF_INET,AF_INET6
 
 class Supervisor (object):
-	alarm_time = 0.1                           # regular backend work
-	second_frequency = int(1/alarm_time)       # when we record history
-	minute_frequency = int(60/alarm_time)      # when we want to average history
-	increase_frequency = int(5/alarm_time)     # when we add workers
-	decrease_frequency = int(60/alarm_time)    # when we remove workers
-	saturation_frequency = int(20/alarm_time)  # when we report connection saturation
-	interface_frequency = int(300/alarm_time)  # when we check for new interfaces
+	second_interval = 1        # when we record history
+	minute_interval = 60       # when we want to average history
+	increase_interval = 5      # when we add workers
+	decrease_interval = 60     # when we remove workers
+	saturation_interval = 20   # when we report connection saturation
+	interface_interval = 300   # when we check for new interfaces
 
 	# import os
 	# clear = [hex(ord(c)) for c in os.popen('clear').read()]
@@ -71,7 +74,10 @@ class Supervisor (object):
 		self.pid = PID(self.configuration)
 
 		self.daemon = Daemon(self.configuration)
+		self.processes = Processes(self.configuration)
 		self.poller = Poller(self.configuration.daemon)
+		self.scheduler = Scheduler()
+		self.wheel = TimingWheel()
 
 		self.poller.setupRead('read_proxy')           # Listening proxy sockets
 		self.poller.setupRead('read_web')             # Listening webserver sockets
@@ -88,6 +94,9 @@ class Supervisor (object):
 		self.poller.setupWrite('write_download')      # Established connections we have buffered data to send to
 		self.poller.setupWrite('opening_download')    # Opening connections
 
+		self.poller.setupRead('read_relay')           # Tunnels relayed by the kernel
+		self.poller.setupWrite('write_relay')         # Tunnels with data waiting in their pipe
+
 		self.monitor = Monitor(self)
 		self.page = Page(self)
 		self.manager = RedirectorManager(
@@ -95,13 +104,14 @@ class Supervisor (object):
 			self.poller,
 		)
 		self.content = ContentManager(self,configuration)
-		self.client = ClientManager(self.poller, configuration)
-		self.resolver = ResolverManager(self.poller, self.configuration, configuration.dns.retries*10)
+		self.client = ClientManager(self.poller, configuration, self.wheel)
+		self.resolver = ResolverManager(self.poller, self.configuration, configuration.dns.retries*10, self.wheel)
+		self.relay = RelayManager(self.poller, configuration, self.client, self.content)
 		self.proxy = Server('http proxy',self.poller,'read_proxy', configuration.http.connections)
 		self.web = Server('web server',self.poller,'read_web', configuration.web.connections)
 		self.icap = Server('icap server',self.poller,'read_icap', configuration.icap.connections)
 
-		self.reactor = Reactor(self.configuration, self.web, self.proxy, self.icap, self.manager, self.content, self.client, self.resolver, self.log_writer, self.usage_writer, self.poller)
+		self.reactor = Reactor(self.configuration, self.web, self.proxy, self.icap, self.manager, self.content, self.client, self.resolver, self.relay, self.log_writer, self.usage_writer, self.poller, self.scheduler, self.wheel)
 
 		self._shutdown = True if self.daemon.filemax == 0 else False  # stop the program
 		self._softstop = False  # stop once all current connection have been dealt with
@@ -130,8 +140,6 @@ class Supervisor (object):
 		signal.signal(signal.SIGTTOU, self.sigttou)
 		signal.signal(signal.SIGTTIN, self.sigttin)
 
-		signal.signal(signal.SIGALRM, self.sigalrm)
-
 		# make sure we always have data in history
 		# (done in zero for dependencies reasons)
 		self.monitor.zero()
@@ -145,6 +153,7 @@ class Supervisor (object):
 			self.signal_log.critical('SIG INT received, soft-stop')
 			self._softstop = True
 			self._listen = False
+		self.reactor.running = False
 
 	def sigterm (self,signum, frame):
 		self.signal_log.critical('SIG TERM received, shutdown request')
@@ -152,6 +161,7 @@ class Supervisor (object):
 			self._pdb = True
 		else:
 			self._shutdown = True
+		self.reactor.running = False
 
 	# def sigabrt (self,signum, frame):
 	# 	self.signal_log.info('SIG INFO received, refork request')
@@ -163,31 +173,35 @@ class Supervisor (object):
 
 	def sigtrap (self,signum, frame):
 		self.signal_log.critical('SIG TRAP received, toggle debug')
+		self.processes.forward(signum)
 		self._toggle_debug = True
+		self.reactor.running = False
 
 
 	def sigusr1 (self,signum, frame):
 		self.signal_log.critical('SIG USR1 received, decrease worker number')
+		self.processes.forward(signum)
 		self._decrease_spawn_limit += 1
+		self.reactor.running = False
 
 	def sigusr2 (self,signum, frame):
 		self.signal_log.critical('SIG USR2 received, increase worker number')
+		self.processes.forward(signum)
 		self._increase_spawn_limit += 1
+		self.reactor.running = False
 
 
 	def sigttou (self,signum, frame):
 		self.signal_log.critical('SIG TTOU received, stop listening')
+		self.processes.forward(signum)
 		self._listen = False
+		self.reactor.running = False
 
 	def sigttin (self,signum, frame):
 		self.signal_log.critical('SIG IN received, star listening')
+		self.processes.forward(signum)
 		self._listen = True
-
-
-	def sigalrm (self,signum, frame):
-		self.signal_log.debug('SIG ALRM received, timed actions')
 		self.reactor.running = False
-		signal.setitimer(signal.ITIMER_REAL,self.alarm_time,self.alarm_time)
 
 
 	def interfaces (self):
@@ -215,34 +229,36 @@ class Supervisor (object):
 		elif not self.initialise():
 			self._shutdown = True
 
-		signal.setitimer(signal.ITIMER_REAL,self.alarm_time,self.alarm_time)
+		# regular work, the reactor makes sure to wake up when it is due
+		self.scheduler.every(self.second_interval, self.second)
+		self.scheduler.every(self.minute_interval, self.monitor.minute)
 
-		count_second = 0
-		count_minute = 0
-		count_increase = 0
-		count_decrease = 0
-		count_saturation = 0
-		count_interface = 0
+		# with many reactor processes, each runs its own redirectors and the master never adds any
+		if not self.processes.master:
+			self.scheduler.every(self.increase_interval, self.manager.provision)    # make sure we have enough workers
+			self.scheduler.every(self.decrease_interval, self.manager.deprovision)  # and every so often remove useless workers
 
-		while True:
-			count_second = (count_second + 1) % self.second_frequency
-			count_minute = (count_minute + 1) % self.minute_frequency
+		self.scheduler.every(self.saturation_interval, self.saturation)
 
-			count_increase = (count_increase + 1) % self.increase_frequency
-			count_decrease = (count_decrease + 1) % self.decrease_frequency
-			count_saturation = (count_saturation + 1) % self.saturation_frequency
-			count_interface = (count_interface + 1) % self.interface_frequency
+		if self.configuration.daemon.poll_interfaces:
+			self.scheduler.every(self.interface_interval, self.interfaces)
 
+		while True:
 			try:
 				if self._pdb:
 					self._pdb = False
 					import pdb
 					pdb.set_trace()
 
+				# we want to stop, only go once through the reactor to flush the logs
+				if self._shutdown:
+					self.scheduler.after(0, self.wakeup)
 
-				# check for IO change with select
+				# check for IO change and run our timers until a signal needs our attention
 				self.reactor.run()
 
+				# any signal received from now on will be seen below, or stop the next run
+				self.reactor.running = True
 
 				# must follow the reactor so we are sure to go through the reactor at least once
 				# and flush any logs
@@ -265,7 +281,7 @@ class Supervisor (object):
 					if self._listen == False:
 						self.proxy.rejecting()
 						self._listen = None
-					if self.client.softstop():
+					if self.processes.softstop() and self.client.softstop():
 						self._shutdown = True
 				# only change listening if we are not shutting down
 				elif self._listen is not None:
@@ -287,46 +303,19 @@ class Supervisor (object):
 					self._increase_spawn_limit = 0
 					self.manager.low += number
 					self.manager.high = max(self.manager.low,self.manager.high)
-					for _ in range(number):
-						self.manager.increase()
+					# the reactor processes were passed the signal and change their own redirectors
+					if not self.processes.master:
+						for _ in range(number):
+							self.manager.increase()
 
 				if self._decrease_spawn_limit:
 					number = self._decrease_spawn_limit
 					self._decrease_spawn_limit = 0
 					self.manager.high = max(1,self.manager.high-number)
 					self.manager.low = min(self.manager.high,self.manager.low)
-					for _ in range(number):
-						self.manager.decrease()
-
-
-				# save our monitoring stats
-				if count_second == 0:
-					self.monitor.second()
-					expired = self.reactor.client.expire()
-					self.reactor.log.debug('events : ' + ', '.join('%s:%d' % (k,len(v)) for (k,v) in self.reactor.events.items()))
-				else:
-					expired = 0
-
-				if expired:
-					self.proxy.notifyClose(None, count=expired)
-
-				if count_minute == 0:
-					self.monitor.minute()
-
-				# make sure we have enough workers
-				if count_increase == 0:
-					self.manager.provision()
-				# and every so often remove useless workers
-				if count_decrease == 0:
-					self.manager.deprovision()
-
-				# report if we saw too many connections
-				if count_saturation == 0:
-					self.proxy.saturation()
-					self.web.saturation()
-
-				if self.configuration.daemon.poll_interfaces and count_interface == 0:
-					self.interfaces()
+					if not self.processes.master:
+						for _ in range(number):
+							self.manager.decrease()
 
 			except KeyboardInterrupt:
 				self.log.critical('^C received')
@@ -359,12 +348,49 @@ class Supervisor (object):
 #					self.log.info('^C received')
 #					self._shutdown = True
 
+		# our exit code, a reactor process which keeps failing to start is an error
+		return 1 if self.processes.failed else 0
+
+	def wakeup (self):
+		"""stop the reactor so the main loop can act on our flags"""
+		self.reactor.running = False
+
+	def second (self):
+		# save our monitoring stats
+		if not self.processes.collect():
+			self._shutdown = True
+			self.wakeup()
+
+		self.monitor.second()
+		if not self.processes.report(self.monitor.seconds[-1]):
+			self._shutdown = True
+			self.wakeup()
+
+		self.reactor.log.debug('events : ' + ', '.join('%s:%d' % (k,len(v)) for (k,v) in self.reactor.events.items()))
+
+		# check if we are done with our current clients
+		if self._softstop:
+			self.wakeup()
+
+	def saturation (self):
+		# report if we saw too many connections
+		self.proxy.saturation()
+		self.web.saturation()
 
 	def initialise (self):
 		self.daemon.daemonise()
 		self.pid.save()
-		# start our threads
-		self.manager.start()
+
+		# the reactor processes are started before any of our threads
+		if not self.processes.start():
+			return False
+
+		# start our threads, with many reactor processes the master only answers its web interface
+		if self.processes.master:
+			self.manager.program = None
+			self.manager.spawn(1)
+		else:
+			self.manager.start()
 
 
 		# only start listening once we know we were able to fork our worker processes
@@ -387,25 +413,28 @@ class Supervisor (object):
 
 		ok = out and listen
 
-		if ok and tcp4.listen:
+		# with many reactor processes, the master only serves the web interface
+		proxy = not self.processes.master
+
+		if ok and proxy and tcp4.listen:
 			s = self.proxy.listen(tcp4.host,tcp4.port, tcp4.timeout, tcp4.backlog)
 			ok = bool(s)
 			if not ok:
 				self.log.critical('IPv4 proxy, unable to listen on %s:%s' % (tcp4.host,tcp4.port))
 
-		if ok and tcp6.listen:
+		if ok and proxy and tcp6.listen:
 			s = self.proxy.listen(tcp6.host,tcp6.port, tcp6.timeout, tcp6.backlog)
 			ok = bool(s)
 			if not ok:
 				self.log.critical('IPv6 proxy, unable to listen on %s:%s' % (tcp6.host,tcp6.port))
 
-		if ok and icap.enable:
+		if ok and proxy and icap.enable:
 			s = self.icap.listen(icap.host, icap.port, tcp4.timeout, tcp4.backlog)
 			ok = bool(s)
 			if not ok:
 				self.log.critical('ICAP server, unable to listen on %s:%s' % (icap.host, icap.port))
 
-		if ok and icap.enable and tcp6.listen:
+		if ok and proxy and icap.enable and tcp6.listen:
 			s = self.icap.listen(icap.ipv6, icap.port, tcp4.timeout, tcp4.backlog)
 			ok = bool(s)
 			if not ok:
@@ -423,10 +452,11 @@ class Supervisor (object):
 		"""terminate all the current BGP connections"""
 		self.log.info('Performing shutdown')
 		try:
+			self.processes.stop()  # terminate our reactor processes
 			self.web.stop()  # accept no new web connection
 			self.proxy.stop()  # accept no new proxy connections
 			self.manager.stop()  # shut down redirector children
-			os.kill(os.getpid(),signal.SIGALRM)
+			self.relay.stop()  # release the pipes of the tunnels
 			self.content.stop()  # stop downloading data
 			self.client.stop()  # close client connections
 			self.pid.remove()
@@ -436,4 +466,5 @@ class Supervisor (object):
 
 	def reload (self):
 		self.log.info('Performing reload of exaproxy %s' % self.configuration.proxy.version ,'supervisor')
-		self.manager.respawn()
+		if not self.processes.master:
+			self.manager.respawn()
@@ -0,0 +1,50 @@
+# encoding: utf-8
+"""
+clock.py
+
+Created by agent on 2026-10-17.
+Copyright (c) 2011-2013  Exa Networks. All rights reserved.
+"""
+
+# python 2 has no monotonic clock, and time.time() jumps when the system clock is changed
+
+import time
+from sys import platform
+
+try:
+	import ctypes
+	import ctypes.util
+
+	# the clock ids are not the same everywhere, with the wrong one we could be reading the cpu time
+	if platform.startswith('linux'):
+		CLOCK_MONOTONIC = 1  # linux/time.h
+	elif platform.startswith('freebsd'):
+		CLOCK_MONOTONIC = 4  # sys/time.h
+	elif platform.startswith('darwin'):
+		CLOCK_MONOTONIC = 6  # time.h, clock_gettime is only there since 10.12
+	else:
+		raise ImportError('no known monotonic clock id on %s' % platform)
+
+	class _timespec (ctypes.Structure):
+		_fields_ = [
+			('tv_sec', ctypes.c_long),
+			('tv_nsec', ctypes.c_long),
+		]
+
+	_librt = ctypes.CDLL(ctypes.util.find_library('rt') or ctypes.util.find_library('c'), use_errno=True)
+	_clock_gettime = _librt.clock_gettime
+	_clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_timespec)]
+
+	_now = _timespec()
+	_pointer = ctypes.pointer(_now)
+
+	if _clock_gettime(CLOCK_MONOTONIC, _pointer) != 0:
+		raise OSError(ctypes.get_errno(), 'clock_gettime')
+
+	def monotonic ():
+		"""seconds (as a float) from an arbitrary point, never going backward"""
+		_clock_gettime(CLOCK_MONOTONIC, _pointer)
+		return _now.tv_sec + _now.tv_nsec * 1e-9
+
+except (ImportError, OSError, AttributeError, TypeError):
+	monotonic = time.time
@@ -8,6 +8,7 @@ Copyright (c) 2011-2013  Exa Networks. All rights reserved.
 
 import os
 import sys
+import select
 import pwd
 import errno
 import socket
@@ -31,8 +32,8 @@ class Daemon (object):
 		if configuration.web.debug:
 			self.log.critical('WARNING: python remove execution via the web server is enabled')
 
-		if configuration.daemon.reactor == 'epoll' and not sys.platform.startswith('linux'):
-			self.log.error('exaproxy.daemon.reactor can only be epoll on Linux, changing the reactor to select')
+		if configuration.daemon.reactor in ('epoll','epoll-et') and not sys.platform.startswith('linux'):
+			self.log.error('exaproxy.daemon.reactor can only be %s on Linux, changing the reactor to select' % configuration.daemon.reactor)
 			configuration.daemon.reactor = 'select'
 
 		self.nb_descriptors = 40  # some to be safe ...
@@ -40,8 +41,10 @@ class Daemon (object):
 		self.nb_descriptors += configuration.web.connections       # one socket per web client connection
 		self.nb_descriptors += configuration.redirector.maximum*2  # one socket per pipe to the thread and one for the forked process
 		self.nb_descriptors += configuration.dns.retries*10        # some sockets for the DNS
+		self.nb_descriptors += min(configuration.http.splice, configuration.http.connections)*4  # two pipes per tunnel relayed with splice
 
-		if configuration.daemon.reactor == 'select':
+		# the select reactor only uses select() when poll() is not available
+		if configuration.daemon.reactor == 'select' and not hasattr(select, 'poll'):
 			if self.nb_descriptors > 1024:
 				self.log.critical('the select reactor is not very scalable, and can only handle 1024 simultaneous descriptors')
 				self.log.critical('your configuration requires %d file descriptors' % self.nb_descriptors)
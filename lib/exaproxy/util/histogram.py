@@ -0,0 +1,51 @@
+# encoding: utf-8
+"""
+histogram.py
+
+Created by agent on 2026-10-17.
+Copyright (c) 2011-2013  Exa Networks. All rights reserved.
+"""
+
+from bisect import bisect_left
+
+
+class Histogram (object):
+	"""Count durations in fixed buckets, so recording one costs next to nothing
+
+	The counters only ever increase, the monitor works out the rate per
+	second (or minute) like for all its other counters."""
+
+	limits = (0.00001, 0.0001, 0.001, 0.01, 0.1, 1.0)
+	names = ('10us', '100us', '1ms', '10ms', '100ms', '1s', 'slower')
+	summed = 'time'  # what the total is reported as
+
+	def __init__ (self):
+		self.buckets = [0] * len(self.names)
+		self.count = 0L
+		self.total = 0.0
+
+	def add (self, value):
+		self.buckets[bisect_left(self.limits, value)] += 1
+		self.count += 1
+		self.total += value
+
+	def statistics (self, prefix, statistics):
+		"""add our counters to the statistics, as <prefix>.<bucket>, <prefix>.count and <prefix>.<summed>"""
+		for name, value in zip(self.names, self.buckets):
+			statistics['%s.%s' % (prefix, name)] = value
+
+		statistics['%s.count' % prefix] = self.count
+		statistics['%s.%s' % (prefix, self.summed)] = self.total
+		return statistics
+
+
+class Sizes (Histogram):
+	"""Count sizes in bytes, like Histogram does durations"""
+
+	limits = (1024, 16*1024, 256*1024, 4*1024*1024, 64*1024*1024)
+	names = ('1KB', '16KB', '256KB', '4MB', '64MB', 'larger')
+	summed = 'bytes'
+
+	def __init__ (self):
+		Histogram.__init__(self)
+		self.total = 0L
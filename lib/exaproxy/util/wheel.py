@@ -0,0 +1,159 @@
+# encoding: utf-8
+"""
+wheel.py
+
+Created by agent on 2026-10-17.
+Copyright (c) 2011-2013  Exa Networks. All rights reserved.
+"""
+
+# Hashed and Hierarchical Timing Wheels, Varghese & Lauck
+# the layout is the one used by the linux kernel (before 4.8)
+
+import math
+
+from .clock import monotonic
+
+
+class TimingWheel (object):
+	"""Deadlines scheduled and cancelled in O(1), whatever how many are pending
+
+	Time is cut in ticks (resolution seconds). The first level has one slot
+	per tick, and each slot of the next levels covers a full turn of the level
+	below it. Deadlines further away than the last level are kept in its
+	furthest slot and placed again once it is reached. When a level turns,
+	the timers of the next slot of the level above are moved down, so each
+	timer is only ever moved once per level."""
+
+	clock = staticmethod(monotonic)
+	granularity = 0.001  # the precision of the poller timeout
+
+	def __init__ (self, resolution=0.1, bits=6, levels=4):
+		self.resolution = resolution
+		self.bits = bits
+		self.size = 1 << bits
+		self.mask = self.size - 1
+		self.levels = levels
+		self.span = 1 << (bits*levels)  # how many ticks ahead we can hold
+
+		self.slots = [[{} for _ in range(self.size)] for _ in range(levels)]
+		self.timers = {}  # key : (level, slot)
+
+		self.start = self.clock()
+		self.tick = 0     # the next tick to process
+		self.fired = 0L   # how many timers expired
+
+	def __len__ (self):
+		return len(self.timers)
+
+	def __contains__ (self, key):
+		return key in self.timers
+
+	def _now (self):
+		return int((self.clock() - self.start) / self.resolution)
+
+	def _place (self, key, expire, data):
+		delta = expire - self.tick
+
+		if delta < 0:
+			level, slot = 0, self.tick & self.mask
+		else:
+			position = expire
+			if delta >= self.span:
+				position = self.tick + self.span - 1
+				delta = self.span - 1
+
+			level = 0
+			while delta >= 1 << (self.bits * (level+1)):
+				level += 1
+
+			slot = (position >> (self.bits * level)) & self.mask
+
+		self.slots[level][slot][key] = expire, data
+		self.timers[key] = level, slot
+
+	def schedule (self, key, delay, data=None):
+		"""expire key in delay seconds, replacing any deadline already set for it"""
+		self.cancel(key)
+
+		# never fire early
+		expire = int(math.ceil((self.clock() - self.start + delay) / self.resolution))
+		self._place(key, max(expire, self.tick), data)
+
+	def cancel (self, key):
+		"""remove the deadline for key, returns its data (or None)"""
+		where = self.timers.pop(key, None)
+		if where is None:
+			return None
+
+		level, slot = where
+		expire, data = self.slots[level][slot].pop(key)
+		return data
+
+	def _cascade (self, level, slot):
+		timers = self.slots[level][slot]
+		self.slots[level][slot] = {}
+
+		for key, (expire, data) in timers.iteritems():
+			self._place(key, expire, data)
+
+	def expired (self):
+		"""remove and return (key, data) for all the deadlines which passed"""
+		now = self._now()
+
+		if not self.timers:
+			self.tick = max(self.tick, now + 1)
+			return []
+
+		fired = []
+		slots = self.slots[0]
+
+		while self.tick <= now:
+			index = self.tick & self.mask
+
+			# the first level turned, bring down the timers of the levels above
+			if not index:
+				for level in range(1, self.levels):
+					slot = (self.tick >> (self.bits * level)) & self.mask
+					self._cascade(level, slot)
+					if slot:
+						break
+
+			self.tick += 1
+
+			timers = slots[index]
+			if timers:
+				slots[index] = {}
+				for key, (expire, data) in timers.iteritems():
+					del self.timers[key]
+					fired.append((key, data))
+
+				if not self.timers:
+					self.tick = now + 1
+					break
+
+		self.fired += len(fired)
+		return fired
+
+	def timeout (self):
+		"""how long until we may have to expire timers (None if there is none)"""
+		if not self.timers:
+			return None
+
+		slots = self.slots[0]
+		index = self.tick & self.mask
+
+		# the next used slot of the first level, or the next time it turns
+		# (at index zero, the timers of the levels above are not yet moved down)
+		ahead = self.size - index if index else 0
+
+		for slot in range(index, index + ahead):
+			if slots[slot]:
+				ahead = slot - index
+				break
+
+		remaining = self.start + (self.tick + ahead) * self.resolution - self.clock()
+		if remaining <= 0:
+			return 0
+
+		# epoll truncates its timeout to the millisecond, never wake up before the tick
+		return remaining + self.granularity